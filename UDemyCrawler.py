@@ -1,11 +1,11 @@
 import json, os, sys, traceback, util_logging as log, util_constants as const, util_downloader as downloader, \
-    util_webengine as webengine, util_settings, util_overview as overview, util_ffmpeg as ffmpeg
-from urllib.request import Request, urlopen
+    util_webengine as webengine, util_settings, util_overview as overview, util_ffmpeg as ffmpeg, \
+    util_progress as progress, util_metrics as metrics, util_checksums as checksums, util_library as library, \
+    util_session as session, util_courselist as courselist
 from PySide2 import QtWidgets, QtCore, QtGui
 from PySide2.QtGui import QIcon, QFont
 from PySide2.QtWidgets import QWidget, QVBoxLayout, QApplication, \
     QProgressBar, QLabel, QMainWindow, QAction, QMessageBox
-from bs4 import BeautifulSoup
 
 
 class UDemyWebCrawler(QMainWindow):
@@ -17,18 +17,24 @@ class UDemyWebCrawler(QMainWindow):
         self.initUI()
         self.CreateMenu()
         self.BlockUI()
+        self.Login()
 
     def init(self):
         # Reset cancel trigger
         self.ThreadCancelTrigger = None
+        # Progress of running download which is polled by timer
+        self.ProgressReader = None
         # Reset vars
         self.access_token = ""
         self.access_token_value = ""
+        self.session = None
         # Init used classes
         self.cfg = util_settings.GlobalSettings()
         self.web = webengine.QWebEngineViewPlus()
-        # Load mysources page of udemy
-        self.SwitchUser(False, None)
+        # Export metrics periodically to app path
+        metrics.GlobalMetrics().StartExport()
+        # Keep library index current in background if enabled
+        self.WatchLibrary()
 
     def initUI(self):
         # Main application settings
@@ -45,9 +51,17 @@ class UDemyWebCrawler(QMainWindow):
         self.progressBar.setGeometry(QtCore.QRect(170, 420, 391, 23))
         self.progressBar.setProperty('value', 0)
         self.progressBar.setAlignment(QtCore.Qt.AlignCenter)
+        # Refresh progress of running download with a fixed rate
+        self.ProgressTimer = QtCore.QTimer(self)
+        self.ProgressTimer.setInterval(const.PROGRESS_REFRESH_INTERVAL_MS)
+        self.ProgressTimer.timeout.connect(self.OnProgressTimer)
+        # Native list of the subscribed courses, web view is only used to log in
+        self.courses = courselist.CourseList(self, self.OnCourseClicked)
+        self.courses.hide()
         # Layout
         vbox = QVBoxLayout(self)
         vbox.addWidget(self.web)
+        vbox.addWidget(self.courses)
         vbox.addWidget(self.progressBarLabel)
         vbox.addWidget(self.progressBar)
         # Central widget
@@ -112,6 +126,11 @@ class UDemyWebCrawler(QMainWindow):
                                 "Combine selected downloaded video courses into one video", self)
         self.ActionCombine.triggered.connect(self.OnActionCombine)
         actionsMenu.addAction(self.ActionCombine)
+        # Verify checksums of all downloaded courses
+        self.ActionVerify = QAction(QIcon(const.FontAweSomeIcon("check-double.svg")),
+                                "Verify downloaded courses", self)
+        self.ActionVerify.triggered.connect(self.OnActionVerify)
+        actionsMenu.addAction(self.ActionVerify)
         # Cancel current download
         actionsMenu.addSeparator()
         self.ActionCancel = QAction("Cancel current process", self)
@@ -134,6 +153,7 @@ class UDemyWebCrawler(QMainWindow):
                                                            self.cfg.StartOnMonitorNumber].availableGeometry(), ), )
         if dlg.exec_():
             self.cfg.LoadConfigs()
+            self.WatchLibrary()
         self.BlockUI(False)
         self.OnActionJump2MyCourses()
 
@@ -151,7 +171,7 @@ class UDemyWebCrawler(QMainWindow):
 
     def OnActionGenerateOverview(self):
         if not self.access_token_value == "":
-            self.overview = overview.Overview(self.access_token_value)
+            self.overview = overview.Overview(self.session)
             self.overview.GenerateOverview(True, True)
 
     # When user clicked on a course - start download course
@@ -159,9 +179,7 @@ class UDemyWebCrawler(QMainWindow):
         log.info(f"Start downloading course from url : {course_url}")
         self.course_url = course_url
         self.ResetProgress()
-        Thread = downloader.DownloaderThread(self, course_url, self.access_token_value)
-        Thread._signal_progress_parts.connect(self.OnSignalPartsChanged)
-        Thread._signal_progress.connect(self.OnSignalProgressChanged)
+        Thread = downloader.DownloaderThread(self, course_url, self.session)
         Thread._signal_info.connect(self.OnSignalInfo)
         Thread._signal_error.connect(self.OnSignalError)
         Thread._signal_canceled.connect(self.OnSignalCanceled)
@@ -176,6 +194,8 @@ class UDemyWebCrawler(QMainWindow):
                 return
         Thread.start()
         self.BlockUI(True)
+        self.ProgressReader = progress.ProgressReader(Thread.progress)
+        self.ProgressTimer.start()
 
     def OnActionCombine(self):
         # Check if FFMPEG is already installed:
@@ -207,6 +227,22 @@ class UDemyWebCrawler(QMainWindow):
             Thread.start()
             self.BlockUI(True)
 
+    def OnActionVerify(self):
+        if self.cfg.DownloadPath == "" or not os.path.exists(self.cfg.DownloadPath):
+            QMessageBox.critical(self, "Error!", "Courses path is not set.\nPlease set up by opening menu\nFile->Settings !")
+            return
+        log.info(f"Start verifying library '{self.cfg.DownloadPath}'")
+        self.ResetProgress()
+        Thread = checksums.VerifyThread(self, self.cfg.DownloadPath)
+        Thread._signal_progress.connect(self.OnSignalProgressChanged)
+        Thread._signal_info.connect(self.OnSignalInfo)
+        Thread._signal_error.connect(self.OnSignalError)
+        Thread._signal_canceled.connect(self.OnSignalCanceled)
+        self.ThreadCancelTrigger = Thread.TriggerCancelDownload
+        Thread._signal_done.connect(self.OnSignalCoursesVerified)
+        Thread.start()
+        self.BlockUI(True)
+
     def OnActionCancel(self):
         if not self.ThreadCancelTrigger is None:
             ret = QMessageBox.question(self, 'Cancel',
@@ -220,10 +256,11 @@ class UDemyWebCrawler(QMainWindow):
                 pass
 
     def OnActionJump2MyCourses(self):
-        # Jump to course overview
-        self.BlockUI()
-        self.web.href(const.UDEMY_MAIN_COURSE_OVERVIEW, None, self.OnCourseClicked)
-        self.BlockUI(False)
+        # Not logged in yet - login page of the web view, otherwise the course list is refreshed
+        if self.session is None:
+            self.web.href(const.UDEMY_MAIN_COURSE_OVERVIEW, None, self.OnCourseClicked)
+            return
+        self.courses.Reload()
 
     #
     # Slots connected if signal from thread is coming
@@ -233,6 +270,18 @@ class UDemyWebCrawler(QMainWindow):
         self.progressBar.setFormat(
             f"{cnt}% [{idx}\\{max}] courses loaded from '{coursetitle}', estimated finish time: {finishtime}")
 
+    def OnProgressTimer(self):
+        if self.ProgressReader is None:
+            return
+        Progress = self.ProgressReader.ReadProgress()
+        if not Progress is None:
+            self.OnSignalProgressChanged(*Progress)
+        Label = self.ProgressReader.ReadLabel()
+        if isinstance(Label, tuple):
+            self.OnSignalPartsChanged(*Label)
+        elif not Label is None:
+            self.progressBarLabel.setText(Label)
+
     def OnSignalPartsChanged(self, sectionindex, lectureindex, segment, count):
         processed = int(segment / count * 100)
         PartsLabel = const.PROGRESSBAR_LABEL_DOWNLOAD_PARTS.format(Section_Index=sectionindex,
@@ -253,15 +302,15 @@ class UDemyWebCrawler(QMainWindow):
         # Show/Log message
         log.error(message)
         QMessageBox.critical(self, "An error has been occured", message)
-        # Reload current page
-        self.web.href(self.web.url(), self.OnCoursePageReloaded, self.OnCourseClicked)
+        # Reload course list
+        self.ReloadCourses()
 
     def OnSignalCanceled(self):
         self.ThreadCancelTrigger = None
         self.BlockUI(False)
         self.ResetProgress()
-        # Reload current page
-        self.web.href(self.web.url(), self.OnCoursePageReloaded, self.OnCourseClicked)
+        # Reload course list
+        self.ReloadCourses()
         # Inform user
         QMessageBox.warning(self, "Canceled", "Process has been canceled !")
 
@@ -279,61 +328,90 @@ class UDemyWebCrawler(QMainWindow):
                 body = {
                     "course_id": courseid
                 }
-                req = Request(const.UDEMY_API_ARCHIVE_COURSE)
-                # Build request header
-                RequestHeaders = const.RequestHeaders(self.access_token_value)
-                for key in RequestHeaders:
-                    req.add_header(key, RequestHeaders[key])
+                # Request with the headers of the account
+                req = self.session.Request(const.UDEMY_API_ARCHIVE_COURSE)
                 jsondata = json.dumps(body)
                 jsondataasbytes = jsondata.encode('utf-8')
                 req.add_header('Content-Length', len(jsondataasbytes))
-                self.result = urlopen(req, jsondataasbytes)
+                self.result = self.session.Open(req, jsondataasbytes)
             except Exception as error:
                 log.error(f"An error has been occured on Course {coursename}:")
                 log.error(traceback.format_exc())
             else:
-                # Reload current page
+                # Archived course is no longer listed
                 log.info(self.result)
-                self.web.href(self.web.url(), self.OnCoursePageReloaded, self.OnCourseClicked)
+                self.ReloadCourses()
         else:
-            # Reload current page
-            self.web.href(self.web.url(), self.OnCoursePageReloaded, self.OnCourseClicked)
+            self.ReloadCourses()
 
     def OnSignalCoursesCombined(self):
         self.ThreadCancelTrigger = None
         self.BlockUI(False)
         self.ResetProgress()
-        # Reload current page
-        self.web.href(self.web.url(), self.OnCoursePageReloaded, self.OnCourseClicked)
+        # Reload course list
+        self.ReloadCourses()
         # Inform user
         QMessageBox.warning(self, "Done.", "Video has been combined into one !")
 
+    def OnSignalCoursesVerified(self, summary):
+        self.ThreadCancelTrigger = None
+        self.BlockUI(False)
+        self.ResetProgress()
+        # Inform user
+        QMessageBox.information(self, "Verified", f"Downloaded courses have been verified:\n{summary}\n\nSee log for details.")
+
     #
     # Helper functions
     #
 
     def BlockUI(self, block=True):
         self.web.setDisabled(block)
+        self.courses.setDisabled(block)
         if not block:
             self.progressBarLabel.setText(const.PROGRESSBAR_LABEL_DEFAULT)
         else:
             self.progressBarLabel.setText(const.PROGRESSBAR_LABEL_DOWNLOAD)
-            self.ApplyBlockStyle()
         # Block all actions but not the canceling
         self.ActionCancel.setEnabled(block)
         self.ActionExit.setEnabled(not block)
         self.ActionSettings.setEnabled(not block)
         self.ActionCombine.setEnabled(not block)
+        self.ActionVerify.setEnabled(not block)
         self.ActionJump2MyCourses.setEnabled(not block)
         self.ActionSwitchUser.setEnabled(not block)
 
 
+    def WatchLibrary(self):
+        if self.cfg.LibraryWatcher and os.path.isdir(self.cfg.DownloadPath):
+            library.GlobalLibrary(self.cfg.DownloadPath, True)
+        elif not self.cfg.LibraryWatcher:
+            library.StopWatchers()
+
     def ResetProgress(self):
+        self.ProgressTimer.stop()
+        self.ProgressReader = None
         self.progressBar.setValue(0)
         self.progressBar.setFormat(const.PROGRESSBAR_LABEL_DEFAULT)
         self.BlockUI(False)
 
+    def Login(self):
+        # Session of the last login if still valid, the login page of udemy only if not - checked in background while
+        # the window is blocked
+        self.progressBarLabel.setText(const.PROGRESSBAR_LABEL_LOGIN)
+        Thread = session.StoredSessionThread(self)
+        Thread._signal_done.connect(self.OnStoredSessionChecked)
+        Thread.start()
+
+    def OnStoredSessionChecked(self, AccessToken):
+        if AccessToken == "":
+            self.SwitchUser(False, None)
+        else:
+            log.info("Using stored session of the last login")
+            self.OnTokenFound(const.UDEMY_ACCESS_TOKEN_NAME, AccessToken)
+
     def SwitchUser(self, clearall, ondonecallback=None):
+        if clearall:
+            session.DeleteToken()
         self.web.AddCookieFilterCallbackOnURL(const.UDEMY_MAIN_COURSE_OVERVIEW, const.UDEMY_ACCESS_TOKEN_NAME,
                                               self.OnTokenFound)
         self.web.ConnectOnUrlChanged(self.OnURLChanged)
@@ -342,54 +420,29 @@ class UDemyWebCrawler(QMainWindow):
     def OnSwitchUserDone(self, html):
         self.close()
 
-    def LoadAll(self):
-        script = (
-            "document.getElementsByClassName('my-courses__course-card-grid')[0].innerHTML"
-        )
-        log.info(f"Loadall script:\n{script}")
-        self.web.RunJavaScript(script, self.LoadAllDone)
-
-    def LoadAllDone(self, html):
-        log.info("------- LoadAllDone result:")
-        log.info(html)
-        soup = BeautifulSoup(html, "html.parser")
-        alllinks = soup.find_all("a")
-        log.info(alllinks)
-
-    def OnCoursePageReloaded(self, html):
+    def ReloadCourses(self):
         self.ThreadCancelTrigger = None
-        self.ApplyStyleChanges()
-
-    def ApplyStyleChanges(self):
-        script = (
-            "var sheet = document.createElement('style');\n"
-            f"sheet.innerHTML = {const.MAIN_STYLE} ;\n"
-            "document.body.appendChild(sheet);"
-        )
-        log.info(f"Script:\n{script}")
-        self.web.RunJavaScript(script)
-
-    def ApplyBlockStyle(self):
-        script = (
-            "var sheet = document.createElement('style');\n"
-            f"sheet.innerHTML = {const.BLOCK_STYLE} ;\n"
-            "document.body.appendChild(sheet);"
-        )
-        log.info(f"Script blockstyle:\n{script}")
-        self.web.RunJavaScript(script)
+        self.courses.Reload()
 
     # Page states
     def OnURLChanged(self, url):
-        log.info(f"URL has been changed : '{url}' - apply style changes.")
-        if "my-courses" in url.toString():
-            self.ApplyStyleChanges()
-        elif "login" in url.toString():
+        log.info(f"URL has been changed : '{url}'")
+        if "login" in url.toString():
             self.BlockUI(False)
 
-    def OnTokenFound(self, TokenName, TokenValue):
+    def OnTokenFound(self, TokenName, TokenValue, TokenExpires=None):
         self.access_token_value = TokenValue
         self.access_token = TokenName + "=" + self.access_token_value
+        self.session = session.GlobalSession(TokenValue)
         log.info(f"Got access_token : {self.access_token}")
+        # Next start (and the command line) can skip the login
+        if not TokenExpires is None:
+            session.SaveToken(TokenValue, TokenExpires)
+        # Logged in - courses page is not rendered any longer, the native list takes its place
+        self.web.href("about:blank")
+        self.web.hide()
+        self.courses.SetSession(self.session)
+        self.courses.show()
         self.OnActionJump2MyCourses()
 
 
@@ -0,0 +1,181 @@
+"""
+Command line tools for the downloaded course library.
+
+    python UDemyCrawlerCli.py verify [--path PATH] [--workers N] [--full]
+    python UDemyCrawlerCli.py courses [--path PATH] [--json]
+    python UDemyCrawlerCli.py plan (--course-id ID [ID ...] | --all) [--token TOKEN] [--path PATH] [--json]
+    python UDemyCrawlerCli.py sync (--course-id ID [ID ...] | --all) [--token TOKEN ...] [--path PATH] [--no-engine]
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import util_constants as const
+import util_settings
+import util_checksums as checksums
+import util_library as library
+import util_planner as planner
+import util_downloader as downloader
+import util_session as session
+
+
+def CoursesPath(args):
+    path = args.path or util_settings.GlobalSettings().DownloadPath
+    if path == "":
+        print("Courses path is not set - use --path or set it in the settings of the application")
+    return path
+
+
+def CommandVerify(args):
+    path = CoursesPath(args)
+    if path == "":
+        return 2
+    verifier = checksums.LibraryVerifier(path, args.workers, args.full)
+    results = verifier.Run()
+    for state in ["corrupt", "missing"]:
+        for name in sorted(results[state]):
+            print(f"{state:>8}: {name}")
+    print(verifier.Summary())
+    return 1 if results["corrupt"] or results["missing"] else 0
+
+
+def CommandCourses(args):
+    path = CoursesPath(args)
+    if path == "":
+        return 2
+    # Index on disk is only refreshed for course folders which have been changed since
+    Courses = library.GlobalLibrary(path, False).CourseInfos()
+    if args.json:
+        print(json.dumps(Courses, indent=1))
+        return 0
+    for Course in Courses:
+        print(f"{Course['Id']:>10}  {Course['Videos']:>4} videos  {Course['Bytes'] / 1024 / 1024 / 1024:>7.2f} GB  {Course['Title']}")
+    print(f"{len(Courses)} courses")
+    return 0
+
+
+def StoredToken():
+    # Session of the last login of the application
+    Stored = session.StoredSession()
+    return "" if Stored is None else Stored.AccessToken
+
+
+def AccessToken(args):
+    token = args.token or os.environ.get(const.CLI_TOKEN_ENV_NAME, "") or StoredToken()
+    if token == "":
+        print(f"Access token is missing - use --token, set {const.CLI_TOKEN_ENV_NAME} or log in with the application")
+    return token
+
+
+def CommandPlan(args):
+    path = CoursesPath(args)
+    token = AccessToken(args)
+    if path == "" or token == "":
+        return 2
+    if args.path:
+        util_settings.GlobalSettings().DownloadPath = path
+    coursesplanner = planner.CoursePlanner(session.GlobalSession(token))
+    def PrintPlan(Plan):
+        if not args.json:
+            print(f"{Plan['Id']:>10}  {Plan['FilesToDownload']:>4}/{Plan['Files']:<4} files  "
+                  f"{Plan['BytesToDownload'] / 1024 ** 3:>7.2f}/{Plan['Bytes'] / 1024 ** 3:<7.2f} GB  {Plan['Title']}")
+    Plans = coursesplanner.PlanAll(None if args.all else args.course_id, PrintPlan)
+    Total = coursesplanner.Summary(Plans)
+    if args.json:
+        print(json.dumps({"courses": Plans, "total": Total}, indent=1))
+        return 0
+    print(f"{Total['Courses']} courses, {Total['Lectures']} lectures, {Total['FilesToDownload']} of {Total['Files']} video files "
+          f"and {Total['AssetsToDownload']} assets to download")
+    print(f"{Total['BytesToDownload'] / 1024 ** 3:.2f} GB to download, {Total['BytesOnDisk'] / 1024 ** 3:.2f} GB already on disk")
+    print(f"Estimated duration {Total['Seconds'] / 3600:.1f}h at {Total['Bandwidth'] / 1024 ** 2:.1f} MB/s ({Total['BandwidthSource']} bandwidth)")
+    return 0
+
+
+def AccessTokens(args):
+    # Several accounts by repeating --token or comma separated in the environment variable
+    tokens = args.token or [token for token in os.environ.get(const.CLI_TOKEN_ENV_NAME, "").split(",") if token] \
+             or [token for token in [StoredToken()] if token]
+    if not tokens:
+        print(f"Access token is missing - use --token, set {const.CLI_TOKEN_ENV_NAME} or log in with the application")
+    return tokens
+
+
+def SyncAccount(accountsession, CourseIds):
+    # Courses of one account one after the other, returns the ids of the failed ones
+    if CourseIds is None:
+        CourseIds = planner.CoursePlanner(accountsession).SubscribedCourseIds()
+    Failed = []
+    for CourseId in CourseIds:
+        courseurl = f"{const.UDEMY_MAIN_COURSE_REDIRECT}?{const.UDEMY_API_FIELD_COURSE_ID}={CourseId}"
+        thread = downloader.DownloaderThread(None, courseurl, accountsession)
+        errors = []
+        thread._signal_error.connect(errors.append)
+        # Runs in the thread of the account
+        thread.run()
+        if errors:
+            Failed.append(CourseId)
+            print(f"{CourseId:>10}  failed: {errors[0]}")
+        else:
+            print(f"{CourseId:>10}  synced: {thread.CourseTitle}")
+    return len(CourseIds), Failed
+
+
+def CommandSync(args):
+    path = CoursesPath(args)
+    tokens = AccessTokens(args)
+    if path == "" or not tokens:
+        return 2
+    # Settings are only changed for this run, not stored
+    cfg = util_settings.GlobalSettings()
+    cfg.DownloadPath = path
+    cfg.DeltaSync = True
+    cfg.TransferEngine = not args.no_engine
+    # Accounts are synced in parallel, each with its own session
+    with concurrent.futures.ThreadPoolExecutor(len(tokens), thread_name_prefix="Account") as executor:
+        futures = [executor.submit(SyncAccount, session.GlobalSession(token), None if args.all else args.course_id)
+                   for token in tokens]
+        results = [future.result() for future in futures]
+    Count = sum(AccountCount for AccountCount, AccountFailed in results)
+    Failed = [CourseId for AccountCount, AccountFailed in results for CourseId in AccountFailed]
+    print(f"{Count - len(Failed)} of {Count} courses synced with {len(tokens)} account(s)")
+    return 1 if Failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"{const.APP_TITLE} command line tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    verify = commands.add_parser("verify", help="Verify checksums of all downloaded courses")
+    verify.add_argument("--path", help="Courses path (default: courses path of the settings)")
+    verify.add_argument("--workers", type=int, default=const.CHECKSUM_VERIFY_WORKERS, help="Files verified in parallel")
+    verify.add_argument("--full", action="store_true", help="Hash all files, even if size and mtime are unchanged")
+    verify.set_defaults(func=CommandVerify)
+    courses = commands.add_parser("courses", help="List downloaded courses from the library index")
+    courses.add_argument("--path", help="Courses path (default: courses path of the settings)")
+    courses.add_argument("--json", action="store_true", help="Output as JSON")
+    courses.set_defaults(func=CommandCourses)
+    plan = commands.add_parser("plan", help="Sizes and duration of course downloads without downloading anything")
+    selection = plan.add_mutually_exclusive_group(required=True)
+    selection.add_argument("--course-id", type=int, nargs="+", help="Ids of the courses to plan")
+    selection.add_argument("--all", action="store_true", help="Plan all subscribed courses")
+    plan.add_argument("--token", help=f"Access token (default: environment variable {const.CLI_TOKEN_ENV_NAME} "
+                                      f"or the stored session of the application)")
+    plan.add_argument("--path", help="Courses path (default: courses path of the settings)")
+    plan.add_argument("--json", action="store_true", help="Output as JSON")
+    plan.set_defaults(func=CommandPlan)
+    sync = commands.add_parser("sync", help="Download lectures added or changed since the last complete download")
+    selection = sync.add_mutually_exclusive_group(required=True)
+    selection.add_argument("--course-id", type=int, nargs="+", help="Ids of the courses to sync")
+    selection.add_argument("--all", action="store_true", help="Sync all subscribed courses")
+    sync.add_argument("--token", action="append",
+                      help=f"Access token, repeat for several accounts (default: environment variable {const.CLI_TOKEN_ENV_NAME} "
+                           f"or the stored session of the application)")
+    sync.add_argument("--path", help="Courses path (default: courses path of the settings)")
+    sync.add_argument("--no-engine", action="store_true", help="Transfer with a thread per download instead of the asyncio engine")
+    sync.set_defaults(func=CommandSync)
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
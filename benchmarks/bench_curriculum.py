@@ -0,0 +1,140 @@
+"""
+Scaling benchmark of the curriculum parser with synthetic curricula.
+
+    python benchmarks/bench_curriculum.py [--lectures N ...] [--output FILE] [--baseline FILE]
+
+For each size the curriculum is parsed into lecture records and the parse time, the peak memory while parsing and
+the memory kept by the records are measured with tracemalloc. The same lectures as plain dicts (the former
+representation) are compared by the size of their containers.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import socket
+import sys
+import time
+import tracemalloc
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_PATH))
+import util_curriculum as curriculum
+
+DEFAULT_LECTURES = [1000, 10000, 100000]
+LECTURES_PER_CHAPTER = 25
+DEFAULT_OUTPUT = os.path.join(BENCH_PATH, "results", "bench_curriculum.json")
+
+
+def SyntheticCurriculum(lectures):
+    # Mix of the lecture kinds of real courses: mp4 downloads, hls streams, protected dash streams and articles
+    results = []
+    for LectureIdx in range(lectures):
+        if LectureIdx % LECTURES_PER_CHAPTER == 0:
+            ChapterIdx = LectureIdx // LECTURES_PER_CHAPTER + 1
+            results.append({"_class": "chapter", "id": ChapterIdx, "object_index": ChapterIdx, "title": f"Chapter {ChapterIdx}"})
+        LectureId = 1000000 + LectureIdx
+        asset = {"_class": "asset", "id": LectureId, "filename": f"lecture-{LectureId}.mp4", "time_estimation": 300 + LectureIdx % 600,
+                 "captions": [{"url": f"https://cdn.example.com/{LectureId}/{locale}.vtt", "locale_id": locale, "file_name": f"{locale}.vtt"}
+                              for locale in ["en_US", "de_DE"]]}
+        kind = LectureIdx % 10
+        if kind < 7:
+            asset["asset_type"] = "Video"
+            asset["download_urls"] = {"Video": [{"label": str(height), "file": f"https://cdn.example.com/{LectureId}/{height}.mp4"}
+                                                for height in [360, 480, 720, 1080]]}
+            asset["stream_urls"] = None
+        elif kind == 7:
+            asset["asset_type"] = "Video"
+            asset["media_sources"] = [{"type": "video/mp4", "label": str(height), "src": f"https://cdn.example.com/{LectureId}/{height}.mp4"}
+                                      for height in [480, 720]]
+        elif kind == 8:
+            asset["asset_type"] = "Video"
+            asset["media_sources"] = [{"type": "application/dash+xml", "src": f"https://cdn.example.com/{LectureId}/index.mpd"}]
+            asset["media_license_token"] = "token"
+        else:
+            asset["asset_type"] = "Article"
+            asset["body"] = f"<p>Article {LectureId}</p>" * 20
+        supplementary = []
+        if LectureIdx % 5 == 0:
+            supplementary.append({"id": LectureId, "filename": f"slides-{LectureId}.pdf",
+                                  "download_urls": {"File": [{"file": f"https://cdn.example.com/{LectureId}/slides.pdf"}]}})
+        results.append({"_class": "lecture", "id": LectureId, "object_index": LectureIdx % LECTURES_PER_CHAPTER + 1,
+                        "title": f"Lecture {LectureIdx}: a synthetic lecture", "asset": asset, "supplementary_assets": supplementary})
+    return {"count": len(results), "next": None, "previous": None, "results": results}
+
+
+def Measure(fct):
+    # Result, seconds, peak and kept bytes of a call
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fct()
+    seconds = time.perf_counter() - start
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak, kept
+
+
+def Run(lectures):
+    data = SyntheticCurriculum(lectures)
+    # Parse once without tracing, tracemalloc slows allocations down considerably
+    start = time.perf_counter()
+    Lectures = curriculum.ParseCurriculum(data, "Benchmark")
+    seconds = time.perf_counter() - start
+    del Lectures
+    Lectures, traced, peak, kept = Measure(lambda: curriculum.ParseCurriculum(data, "Benchmark"))
+    # Fields are shared, so only the containers of records and dicts are compared
+    Dicts, dictseconds, dictpeak, dictkept = Measure(
+        lambda: [{name: getattr(Lecture, name) for name in curriculum.Lecture.__slots__} for Lecture in Lectures])
+    return {
+        "name": f"lectures-{lectures}",
+        "lectures": lectures,
+        "items": len(data["results"]),
+        "seconds": seconds,
+        "lectures_per_s": lectures / seconds if seconds > 0 else 0.0,
+        "peak_bytes": peak,
+        "kept_bytes": kept,
+        "bytes_per_lecture": kept / lectures,
+        "record_container_bytes": sys.getsizeof(Lectures[0]),
+        "dict_container_bytes": dictkept / lectures
+    }
+
+
+def Compare(results, baselinefile):
+    with open(baselinefile, encoding="utf-8") as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    print(f"\n{'scenario':<20}{'seconds':>10}{'baseline':>10}{'peak MB':>10}{'baseline':>10}")
+    for result in results:
+        base = baseline.get(result["name"])
+        if base is None:
+            print(f"{result['name']:<20}{result['seconds']:>10.3f}{'-':>10}{result['peak_bytes'] / 1024 ** 2:>10.1f}{'-':>10}")
+            continue
+        print(f"{result['name']:<20}{result['seconds']:>10.3f}{base['seconds']:>10.3f}"
+              f"{result['peak_bytes'] / 1024 ** 2:>10.1f}{base['peak_bytes'] / 1024 ** 2:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing of synthetic curricula")
+    parser.add_argument("--lectures", type=int, action="append", help="Number of lectures (default: 1000, 10000, 100000)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON file to store the results")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+    results = []
+    for lectures in args.lectures or DEFAULT_LECTURES:
+        print(f"Parsing {lectures} lectures ...")
+        result = Run(lectures)
+        print(f"  {result['seconds']:.3f}s ({result['lectures_per_s']:.0f} lectures/s), peak {result['peak_bytes'] / 1024 ** 2:.1f} MB, "
+              f"{result['bytes_per_lecture']:.0f} bytes/lecture, record {result['record_container_bytes']} bytes "
+              f"(as dict {result['dict_container_bytes']:.0f} bytes)")
+        results.append(result)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": time.time(), "host": socket.gethostname(), "python": platform.python_version(),
+                   "results": results}, f, indent=1)
+    print(f"Results written to '{args.output}'")
+    if args.baseline:
+        Compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Throughput benchmark of the course downloader against a local stand-in for the udemy api and cdn.
+
+    python benchmarks/bench_download.py [--scenario NAME ...] [--policy POLICY] [--workers N] [--engine] [--output FILE] [--baseline FILE]
+
+Each scenario drives DownloaderThread.run headless and records wall time, MB/s and requests/s. The videos on disk are
+checked against the sizes served, a mismatch is reported as error of the scenario.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_PATH))
+import bench_server as server
+
+MB = 1024 * 1024
+SCENARIOS = [
+    server.BenchScenario("mp4-local", "mp4", chapters=2, lectures=5, size=8 * MB),
+    server.BenchScenario("mp4-latency-50ms", "mp4", chapters=2, lectures=5, size=8 * MB, latency=0.05),
+    server.BenchScenario("mp4-throttled-8MBs", "mp4", chapters=2, lectures=5, size=8 * MB, bandwidth=8 * MB),
+    server.BenchScenario("mp4-many-small", "mp4", chapters=10, lectures=20, size=256 * 1024, latency=0.02),
+    server.BenchScenario("hls-segments", "hls", chapters=2, lectures=5, size=8 * MB, segments=40, latency=0.01),
+]
+DEFAULT_OUTPUT = os.path.join(BENCH_PATH, "results", "bench_download.json")
+
+
+class BenchEnvironment():
+    """ App data, settings and api urls of the crawler redirected to temporary paths and the local server """
+
+    def __init__(self, workdir, policy="curriculum", workers=1, engine=False):
+        self.WorkDir = workdir
+        # App data path must be set before settings singleton is created
+        os.environ["APPDATA"] = os.path.join(workdir, "appdata")
+        from PySide2.QtCore import QCoreApplication
+        self.App = QCoreApplication.instance() or QCoreApplication([])
+        import util_constants as const
+        import util_settings
+        import util_downloader as downloader
+        import util_session as session
+        self.const = const
+        self.downloader = downloader
+        self.session = session.GlobalSession("benchmark-token")
+        self.cfg = util_settings.GlobalSettings()
+        self.cfg.DownloadCourseVideoAgain = True
+        self.cfg.CombinePipeline = False
+        self.cfg.SchedulePolicy = policy
+        self.cfg.DownloadWorkers = workers
+        self.cfg.TransferEngine = engine
+        self.OriginalMainURL = const.UDEMY_MAIN_URL
+        self.OriginalURLs = {name: getattr(const, name) for name in dir(const)
+                             if name.startswith("UDEMY_") and isinstance(getattr(const, name), str)}
+
+    def RedirectURLs(self, baseurl):
+        for name, value in self.OriginalURLs.items():
+            setattr(self.const, name, value.replace(self.OriginalMainURL, baseurl))
+
+    @staticmethod
+    def VideoBytesOnDisk(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(path) for name in names
+                   if os.path.splitext(name)[1] in [".mp4", ".ts"])
+
+    def Run(self, scenario):
+        bench = server.BenchServer(scenario).Start()
+        try:
+            self.RedirectURLs(bench.BaseURL())
+            self.cfg.DownloadPath = os.path.join(self.WorkDir, "courses", scenario.Name)
+            os.makedirs(self.cfg.DownloadPath)
+            courseurl = f"{bench.BaseURL()}/course-dashboard-redirect/?course_id={server.BENCH_COURSE_ID}"
+            thread = self.downloader.DownloaderThread(None, courseurl, self.session)
+            errors = []
+            thread._signal_error.connect(errors.append)
+            start = time.perf_counter()
+            thread.run()
+            walltime = time.perf_counter() - start
+        finally:
+            bench.Stop()
+        # Videos must be on disk completely, otherwise MB/s would be measured on playlists or partial files
+        BytesOnDisk = self.VideoBytesOnDisk(self.cfg.DownloadPath)
+        if not BytesOnDisk == bench.VideoBytes():
+            errors.append(f"{BytesOnDisk} bytes of videos on disk, expected {bench.VideoBytes()}")
+        result = scenario.ToDict()
+        result.update({
+            "policy": self.cfg.SchedulePolicy,
+            "workers": self.cfg.DownloadWorkers,
+            "engine": self.cfg.TransferEngine,
+            "wall_time": walltime,
+            "bytes": bench.BytesSent,
+            "bytes_on_disk": BytesOnDisk,
+            "requests": bench.Requests,
+            "mb_per_s": bench.BytesSent / MB / walltime if walltime > 0 else 0.0,
+            "requests_per_s": bench.Requests / walltime if walltime > 0 else 0.0,
+            "errors": errors
+        })
+        return result
+
+
+def Compare(results, baselinefile):
+    with open(baselinefile, encoding="utf-8") as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    print(f"\n{'scenario':<24}{'MB/s':>10}{'baseline':>10}{'delta':>9}{'wall s':>9}{'baseline':>10}")
+    for result in results:
+        base = baseline.get(result["name"])
+        if base is None:
+            print(f"{result['name']:<24}{result['mb_per_s']:>10.2f}{'-':>10}{'-':>9}{result['wall_time']:>9.2f}{'-':>10}")
+            continue
+        delta = (result["mb_per_s"] / base["mb_per_s"] - 1) * 100 if base["mb_per_s"] > 0 else 0.0
+        print(f"{result['name']:<24}{result['mb_per_s']:>10.2f}{base['mb_per_s']:>10.2f}{delta:>+8.1f}%"
+              f"{result['wall_time']:>9.2f}{base['wall_time']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the course downloader against a local stand-in server")
+    parser.add_argument("--scenario", action="append", help="Run only the given scenario(s)")
+    parser.add_argument("--policy", default="curriculum", choices=["curriculum", "first-lectures", "first-per-chapter"],
+                        help="Download order of the lectures")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel lecture downloads")
+    parser.add_argument("--engine", action="store_true", help="Transfer with the asyncio engine")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON file to store the results")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+    scenarios = [scenario for scenario in SCENARIOS if not args.scenario or scenario.Name in args.scenario]
+    workdir = tempfile.mkdtemp(prefix="udemycrawler-bench-")
+    try:
+        environment = BenchEnvironment(workdir, args.policy, args.workers, args.engine)
+        results = []
+        for scenario in scenarios:
+            print(f"Running scenario '{scenario.Name}' ...")
+            result = environment.Run(scenario)
+            print(f"  {result['wall_time']:.2f}s, {result['mb_per_s']:.2f} MB/s, {result['requests_per_s']:.1f} requests/s"
+                  + (f", errors: {result['errors']}" if result["errors"] else ""))
+            results.append(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": time.time(), "host": socket.gethostname(), "python": platform.python_version(),
+                   "results": results}, f, indent=1)
+    print(f"Results written to '{args.output}'")
+    if args.baseline:
+        Compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
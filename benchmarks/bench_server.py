@@ -0,0 +1,238 @@
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for the udemy api and cdn used by the benchmarks
+BENCH_COURSE_ID = 4711
+BENCH_CHUNK_SIZE = 64 * 1024
+BENCH_SEGMENT_DURATION = 6
+
+
+class BenchScenario():
+    def __init__(self, name, kind="mp4", chapters=2, lectures=5, size=8 * 1024 * 1024, latency=0.0, bandwidth=0,
+                 segments=10):
+        self.Name = name
+        # "mp4" serves downloadable videos, "hls" serves variant playlists with ts segments
+        self.Kind = kind
+        self.Chapters = chapters
+        self.LecturesPerChapter = lectures
+        # Size of each video in bytes, latency per request in seconds, bandwidth per connection in bytes/s (0=unlimited)
+        self.Size = size
+        self.Latency = latency
+        self.Bandwidth = bandwidth
+        self.Segments = segments
+
+    def ToDict(self):
+        return {
+            "name": self.Name,
+            "kind": self.Kind,
+            "chapters": self.Chapters,
+            "lectures": self.LecturesPerChapter,
+            "size": self.Size,
+            "latency": self.Latency,
+            "bandwidth": self.Bandwidth,
+            "segments": self.Segments
+        }
+
+
+class BenchServer():
+    def __init__(self, scenario, host="127.0.0.1", port=0):
+        self.Scenario = scenario
+        self.Lock = threading.Lock()
+        self.Requests = 0
+        self.BytesSent = 0
+        handler = type("BenchHandler", (BenchRequestHandler,), {"bench": self})
+        self.Server = ThreadingHTTPServer((host, port), handler)
+        self.Server.daemon_threads = True
+        self.Thread = None
+
+    def BaseURL(self):
+        host, port = self.Server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def Start(self):
+        self.Thread = threading.Thread(target=self.Server.serve_forever, daemon=True)
+        self.Thread.start()
+        return self
+
+    def Stop(self):
+        self.Server.shutdown()
+        self.Server.server_close()
+
+    def Count(self, sent):
+        with self.Lock:
+            self.Requests += 1
+            self.BytesSent += sent
+
+    def CourseDetails(self):
+        return {
+            "_class": "course",
+            "id": BENCH_COURSE_ID,
+            "title": f"Benchmark course {self.Scenario.Name}",
+            "description": "<p>Synthetic course served by the benchmark server</p>",
+            "image_240x135": self.BaseURL() + "/cdn/cover.jpg"
+        }
+
+    def Curriculum(self):
+        scenario = self.Scenario
+        results = []
+        for ChapterIdx in range(1, scenario.Chapters + 1):
+            results.append({"_class": "chapter", "id": ChapterIdx, "object_index": ChapterIdx,
+                            "title": f"Chapter {ChapterIdx}", "sort_order": ChapterIdx})
+            for LectureIdx in range(1, scenario.LecturesPerChapter + 1):
+                LectureId = ChapterIdx * 1000 + LectureIdx
+                asset = {"_class": "asset", "id": LectureId, "asset_type": "Video",
+                         "filename": f"lecture_{LectureId}.mp4",
+                         "time_estimation": scenario.Segments * BENCH_SEGMENT_DURATION,
+                         "download_urls": None, "stream_urls": None, "media_sources": None,
+                         "captions": [], "body": ""}
+                if scenario.Kind == "hls":
+                    # Unencrypted streams come as master playlist in stream_urls, its segments are assembled per lecture
+                    asset["stream_urls"] = {"Video": [{"type": "application/x-mpegURL", "label": "auto",
+                                                       "file": self.BaseURL() + f"/cdn/hls/{LectureId}/master.m3u8"}]}
+                else:
+                    asset["download_urls"] = {"Video": [
+                        {"type": "video/mp4", "label": "360", "file": self.BaseURL() + f"/cdn/video/{LectureId}_360.mp4?size={scenario.Size // 4}"},
+                        {"type": "video/mp4", "label": "720", "file": self.BaseURL() + f"/cdn/video/{LectureId}_720.mp4?size={scenario.Size}"}
+                    ]}
+                results.append({"_class": "lecture", "id": LectureId, "object_index": LectureIdx,
+                                "title": f"Lecture {LectureIdx}", "asset": asset, "supplementary_assets": []})
+        return {"count": len(results), "next": None, "previous": None, "results": results}
+
+    def SegmentSize(self):
+        return max(self.Scenario.Size // self.Scenario.Segments, 188)
+
+    def VideoBytes(self):
+        # Bytes of all lecture videos on disk after a complete download in the highest resolution
+        scenario = self.Scenario
+        PerLecture = scenario.Segments * self.SegmentSize() if scenario.Kind == "hls" else scenario.Size
+        return scenario.Chapters * scenario.LecturesPerChapter * PerLecture
+
+    def MasterPlaylist(self, LectureId):
+        return (
+            "#EXTM3U\n"
+            "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\n"
+            f"{self.BaseURL()}/cdn/hls/{LectureId}/360/index.m3u8\n"
+            "#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720\n"
+            f"{self.BaseURL()}/cdn/hls/{LectureId}/720/index.m3u8\n"
+        )
+
+    def MediaPlaylist(self, LectureId, Resolution):
+        scenario = self.Scenario
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{BENCH_SEGMENT_DURATION}",
+                 "#EXT-X-MEDIA-SEQUENCE:0"]
+        SegmentSize = self.SegmentSize()
+        for SegmentIdx in range(scenario.Segments):
+            lines.append(f"#EXTINF:{BENCH_SEGMENT_DURATION}.0,")
+            lines.append(f"{self.BaseURL()}/cdn/hls/{LectureId}/{Resolution}/seg{SegmentIdx:05d}.ts?size={SegmentSize}")
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+
+def SyntheticBytes(size, offset=0):
+    # Deterministic content, so equal urls always deliver equal files
+    pattern = bytes(range(256)) * (BENCH_CHUNK_SIZE // 256)
+    while size > 0:
+        start = offset % len(pattern)
+        chunk = (pattern[start:] + pattern[:start])[:min(size, len(pattern))]
+        yield chunk
+        size -= len(chunk)
+        offset += len(chunk)
+
+
+class BenchRequestHandler(BaseHTTPRequestHandler):
+    bench = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.Handle(False)
+
+    def do_GET(self):
+        self.Handle(True)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        self.SendJSON({}, True)
+
+    def Handle(self, withbody):
+        scenario = self.bench.Scenario
+        if scenario.Latency > 0:
+            time.sleep(scenario.Latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if re.match(r"^/api-2\.0/courses/\d+/cached-subscriber-curriculum-items/?$", url.path):
+            self.SendJSON(self.bench.Curriculum(), withbody)
+        elif re.match(r"^/api-2\.0/courses/\d+/?$", url.path):
+            self.SendJSON(self.bench.CourseDetails(), withbody)
+        elif re.match(r"^/api-2\.0/users/me/subscribed-courses/?$", url.path):
+            self.SendJSON({"count": 1, "next": None, "previous": None, "results": [self.bench.CourseDetails()]}, withbody)
+        elif url.path == "/cdn/cover.jpg":
+            self.SendData(16 * 1024, "image/jpeg", withbody)
+        elif url.path.startswith("/cdn/video/"):
+            self.SendData(int(query.get("size", [scenario.Size])[0]), "video/mp4", withbody)
+        elif re.match(r"^/cdn/hls/\d+/master\.m3u8$", url.path):
+            self.SendText(self.bench.MasterPlaylist(url.path.split("/")[3]), withbody)
+        elif re.match(r"^/cdn/hls/\d+/\d+/index\.m3u8$", url.path):
+            parts = url.path.split("/")
+            self.SendText(self.bench.MediaPlaylist(parts[3], parts[4]), withbody)
+        elif url.path.endswith(".ts"):
+            self.SendData(int(query.get("size", [188])[0]), "video/mp2t", withbody)
+        else:
+            self.send_error(404)
+            self.bench.Count(0)
+
+    def SendJSON(self, data, withbody):
+        self.SendBody(json.dumps(data).encode("utf-8"), "application/json", withbody)
+
+    def SendText(self, text, withbody):
+        self.SendBody(text.encode("utf-8"), "application/vnd.apple.mpegurl", withbody)
+
+    def SendBody(self, body, contenttype, withbody):
+        self.send_response(200)
+        self.send_header("Content-Type", contenttype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if withbody:
+            self.wfile.write(body)
+        self.bench.Count(len(body) if withbody else 0)
+
+    def SendData(self, size, contenttype, withbody):
+        # Honour simple byte ranges, so ranged downloads can be benchmarked too
+        start, end = 0, size - 1
+        RangeHeader = self.headers.get("Range")
+        RangeMatch = re.match(r"bytes=(\d*)-(\d*)", RangeHeader or "")
+        if RangeMatch and RangeMatch.group(1):
+            start = int(RangeMatch.group(1))
+            if RangeMatch.group(2):
+                end = min(int(RangeMatch.group(2)), size - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        length = max(end - start + 1, 0)
+        self.send_header("Content-Type", contenttype)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{self.path.split("?")[0].replace("/", "_")}-{size}"')
+        self.end_headers()
+        sent = 0
+        if withbody:
+            bandwidth = self.bench.Scenario.Bandwidth
+            started = time.time()
+            for chunk in SyntheticBytes(length, start):
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                # Throttle to configured bandwidth
+                if bandwidth > 0:
+                    ahead = sent / bandwidth - (time.time() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        self.bench.Count(sent)
@@ -0,0 +1,199 @@
+import concurrent.futures
+import hashlib
+import html
+import os
+import re
+import threading
+import util_bufferpool as bufferpool
+import util_constants as const
+import util_logging as log
+import util_metrics as metrics
+import util_settings
+from urllib.parse import parse_qsl, urlencode, urlparse
+from urllib.request import Request
+
+# One cache per download root, shared by all courses
+Caches = {}
+CachesLock = threading.Lock()
+
+
+def URLKey(url):
+    """ Host, path and query of an url without the signing parameters, which change on every request - other query
+        parameters (eg. /image?id=...) select the content and are kept """
+    parsed_url = urlparse(url)
+    Query = sorted((name, value) for name, value in parse_qsl(parsed_url.query, keep_blank_values=True)
+                   if not name.lower() in const.ASSET_URL_SIGNING_PARAMETERS)
+    key = f"{parsed_url.netloc}{parsed_url.path}"
+    if Query:
+        key += "?" + urlencode(Query)
+    return key
+
+
+def GlobalCache(rootpath):
+    with CachesLock:
+        MaxBytes = util_settings.GlobalSettings().AssetCacheMB * 1024 * 1024
+        if rootpath not in Caches:
+            Caches[rootpath] = AssetCache(rootpath, MaxBytes)
+        Caches[rootpath].MaxBytes = MaxBytes
+        return Caches[rootpath]
+
+
+class AssetCache():
+    """ URL keyed disk cache of web assets (eg. article images) with size bounded LRU eviction """
+
+    def __init__(self, rootpath, maxbytes):
+        self.CachePath = rootpath.replace("\\", "/") + "/" + const.ASSET_CACHE_PATH
+        self.MaxBytes = maxbytes
+        self.Lock = threading.Lock()
+        # Assets currently downloaded - the same url requested by several articles is fetched only once
+        self.Pending = {}
+        self.Executor = concurrent.futures.ThreadPoolExecutor(const.ASSET_CACHE_WORKERS, thread_name_prefix="AssetCache")
+        self.metrics = metrics.GlobalMetrics()
+        if not os.path.exists(self.CachePath):
+            os.makedirs(self.CachePath, exist_ok=True)
+        # Cached files by name with size and last use
+        self.Entries = {}
+        for entry in os.scandir(self.CachePath):
+            if entry.is_file() and not entry.name.endswith(const.DOWNLOAD_TEMP_EXT):
+                stat = entry.stat()
+                self.Entries[entry.name] = (stat.st_size, stat.st_mtime)
+
+    @staticmethod
+    def CacheName(url):
+        parsed_url = urlparse(url)
+        key = hashlib.sha256(URLKey(url).encode("utf-8")).hexdigest()
+        ext = os.path.splitext(parsed_url.path)[1][:8]
+        return key + ext
+
+    def CacheFileName(self, name):
+        return self.CachePath + "/" + name
+
+    def Touch(self, name):
+        # Mark as recently used
+        try:
+            os.utime(self.CacheFileName(name))
+            with self.Lock:
+                size, used = self.Entries[name]
+                self.Entries[name] = (size, os.path.getmtime(self.CacheFileName(name)))
+        except (OSError, KeyError):
+            pass
+
+    def Evict(self):
+        with self.Lock:
+            total = sum(size for size, used in self.Entries.values())
+            if total <= self.MaxBytes:
+                return
+            for name, (size, used) in sorted(self.Entries.items(), key=lambda item: item[1][1]):
+                if total <= self.MaxBytes:
+                    break
+                try:
+                    os.remove(self.CacheFileName(name))
+                except OSError as error:
+                    log.debug(f"Can not evict cached asset '{name}': {repr(error)}")
+                total -= size
+                del self.Entries[name]
+                self.metrics.Inc("asset_cache_total", state="evicted")
+
+    def Download(self, url, name, openurl):
+        FileName = self.CacheFileName(name)
+        FileNameTemp = FileName + const.DOWNLOAD_TEMP_EXT
+        try:
+            # Streamed in chunks of the shared buffer pool (articles may reference large files)
+            with openurl(Request(url), timeout=const.ASSET_FETCH_TIMEOUT) as res, open(FileNameTemp, "wb") as f:
+                bufferpool.CopyToFile(res, f)
+            os.replace(FileNameTemp, FileName)
+        except Exception as error:
+            log.warn(f"Can not download asset '{url}': {repr(error)}")
+            if os.path.exists(FileNameTemp):
+                os.remove(FileNameTemp)
+            self.metrics.Inc("asset_cache_total", state="failed")
+            return None
+        with self.Lock:
+            self.Entries[name] = (os.path.getsize(FileName), os.path.getmtime(FileName))
+        self.metrics.Inc("asset_cache_total", state="miss")
+        self.Evict()
+        return FileName
+
+    def Get(self, url, openurl):
+        # Returns a future with the cached file name (or None if the asset can not be downloaded)
+        name = self.CacheName(url)
+        with self.Lock:
+            cached = name in self.Entries and os.path.exists(self.CacheFileName(name))
+            if not cached:
+                future = self.Pending.get(name)
+                if future is None:
+                    future = self.Executor.submit(self.Download, url, name, openurl)
+                    future.add_done_callback(lambda done: self.Done(name))
+                    self.Pending[name] = future
+                return future
+        self.Touch(name)
+        self.metrics.Inc("asset_cache_total", state="hit")
+        future = concurrent.futures.Future()
+        future.set_result(self.CacheFileName(name))
+        return future
+
+    def Done(self, name):
+        with self.Lock:
+            self.Pending.pop(name, None)
+
+    def FetchAll(self, urls, openurl):
+        # Fetch all urls concurrently, returns cached file name by url
+        futures = {url: self.Get(url, openurl) for url in set(urls)}
+        return {url: future.result() for url, future in futures.items()}
+
+    @staticmethod
+    def Place(cachefilename, filename):
+        # Hardlink cached asset into the course, copy if the file system can not link
+        if os.path.exists(filename):
+            return
+        try:
+            os.link(cachefilename, filename)
+        except OSError:
+            FileNameTemp = filename + const.DOWNLOAD_TEMP_EXT
+            with open(cachefilename, "rb") as fsrc, open(FileNameTemp, "wb") as fdst:
+                fdst.write(fsrc.read())
+            os.replace(FileNameTemp, filename)
+
+
+# Attributes in articles which reference remote assets
+ArticleReference = re.compile(r"""(?P<attr>\b(?:src|href))\s*=\s*(?P<quote>["'])(?P<url>https?://[^"']+)(?P=quote)""", re.IGNORECASE)
+
+
+def ArticleAssetURLs(body):
+    # Images are always localized, links only if they reference a file
+    urls = []
+    for match in ArticleReference.finditer(body):
+        url = html.unescape(match.group("url"))
+        if match.group("attr").lower() == "href":
+            ext = os.path.splitext(urlparse(url).path)[1].lower()
+            if ext not in const.ASSET_ARTICLE_LINK_TYPES:
+                continue
+        urls.append(url)
+    return urls
+
+
+def LocalizeArticle(body, coursepath, cache, openurl):
+    """ Fetches the assets of an article through the cache, places them in the course and rewrites the html to them -
+        returns the html and the number of assets which are still remote """
+    urls = ArticleAssetURLs(body)
+    if len(urls) == 0:
+        return body, 0
+    AssetsPath = coursepath + "/" + const.COURSE_ASSETS_PATH
+    if not os.path.exists(AssetsPath):
+        os.makedirs(AssetsPath, exist_ok=True)
+    LocalNames = {}
+    for url, cachefilename in cache.FetchAll(urls, openurl).items():
+        if cachefilename is None:
+            continue
+        try:
+            cache.Place(cachefilename, AssetsPath + "/" + os.path.basename(cachefilename))
+            LocalNames[url] = const.COURSE_ASSETS_PATH + "/" + os.path.basename(cachefilename)
+        except OSError as error:
+            log.warn(f"Can not place asset '{url}' into course: {repr(error)}")
+
+    def Replace(match):
+        LocalName = LocalNames.get(html.unescape(match.group("url")))
+        if LocalName is None:
+            return match.group(0)
+        return f"{match.group('attr')}={match.group('quote')}{LocalName}{match.group('quote')}"
+    return ArticleReference.sub(Replace, body), len(set(urls)) - len(LocalNames)
@@ -0,0 +1,90 @@
+import concurrent.futures
+import os
+import threading
+import time
+import util_bufferpool as bufferpool
+import util_constants as const
+import util_logging as log
+import util_metrics as metrics
+from urllib.request import Request
+
+
+class AssetFetcher():
+    """ Downloads small files (captions, supplementary assets) with many workers and a short timeout,
+        so they don't wait behind the big video transfers - or all at once on the transfer engine if given """
+
+    def __init__(self, openurl, workers=const.ASSET_FETCH_WORKERS, timeout=const.ASSET_FETCH_TIMEOUT, engine=None):
+        self.OpenURL = openurl
+        self.Timeout = timeout
+        self.Engine = engine
+        self.Executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="AssetFetcher")
+        self.Futures = []
+        self.Lock = threading.Lock()
+        self.canceled = False
+        self.metrics = metrics.GlobalMetrics()
+
+    def Submit(self, url, filename):
+        # Already downloaded before (eg. resumed course)
+        if os.path.exists(filename):
+            self.metrics.Inc("assets_total", state="skipped")
+            return
+        with self.Lock:
+            if self.Engine is None:
+                self.Futures.append(self.Executor.submit(self.Fetch, url, filename))
+            else:
+                self.Futures.append(self.Engine.Submit(self.FetchAsync(url, filename)))
+
+    def SubmitLink(self, url, filename):
+        # External resources are stored as internet shortcut only
+        if os.path.exists(filename):
+            return
+        with open(filename, "w", encoding="utf-8") as shortcut:
+            shortcut.write(f"[InternetShortcut]\nURL={url}\n")
+
+    def SubmitTask(self, fct, *args):
+        # Other small work (eg. localizing articles) running beside the videos
+        with self.Lock:
+            self.Futures.append(self.Executor.submit(fct, *args))
+
+    def Fetch(self, url, filename):
+        FileNameTemp = filename + const.DOWNLOAD_TEMP_EXT
+        for attempt in range(1, const.ASSET_FETCH_RETRIES + 1):
+            if self.canceled:
+                return False
+            try:
+                with self.OpenURL(Request(url), timeout=self.Timeout) as res, open(FileNameTemp, "wb") as f:
+                    bufferpool.CopyToFile(res, f)
+                os.replace(FileNameTemp, filename)
+                self.metrics.Inc("assets_total", state="downloaded")
+                return True
+            except Exception as error:
+                log.warn(f"Download of asset '{filename}' failed (attempt {attempt}/{const.ASSET_FETCH_RETRIES}): {repr(error)}")
+                if os.path.exists(FileNameTemp):
+                    os.remove(FileNameTemp)
+                time.sleep(const.DOWNLOAD_RETRY_DELAY)
+        self.metrics.Inc("assets_total", state="failed")
+        return False
+
+    async def FetchAsync(self, url, filename):
+        if self.canceled:
+            return False
+        try:
+            await self.Engine.Fetch(url, filename, retries=const.ASSET_FETCH_RETRIES - 1, timeout=self.Timeout)
+        except Exception as error:
+            log.warn(f"Download of asset '{filename}' failed: {repr(error)}")
+            self.metrics.Inc("assets_total", state="failed")
+            return False
+        self.metrics.Inc("assets_total", state="downloaded")
+        return True
+
+    def Finish(self, canceled=False):
+        # Wait for all queued assets, on cancel queued assets are dropped - returns the number of failed assets and tasks
+        self.canceled = canceled
+        with self.Lock:
+            futures = list(self.Futures)
+            self.Futures = []
+        if canceled:
+            for future in futures:
+                future.cancel()
+        self.Executor.shutdown(wait=True)
+        return sum(1 for future in futures if not future.cancelled() and not future.result())
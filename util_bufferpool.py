@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import util_constants as const
+import util_settings
+from contextlib import contextmanager
+
+
+class BufferPool():
+    """ Reusable fixed size buffers with a memory ceiling - acquiring waits while all buffers are in use """
+
+    def __init__(self, buffersize, maxmemory):
+        self.MaxMemory = maxmemory
+        self.BufferSize = buffersize
+        self.Capacity = max(1, maxmemory // buffersize)
+        self.Free = []
+        self.Created = 0
+        self.Condition = threading.Condition()
+        # Coroutines waiting on an event loop (loop, future) - woken by Release from any thread
+        self.Waiters = []
+
+    def Acquire(self):
+        with self.Condition:
+            # Backpressure: wait until a transfer gives its buffer back
+            while not self.Free and self.Created >= self.Capacity:
+                self.Condition.wait()
+            if self.Free:
+                return self.Free.pop()
+            self.Created += 1
+            return bytearray(self.BufferSize)
+
+    def TryAcquire(self):
+        # Without waiting - None while all buffers are in use
+        with self.Condition:
+            if self.Free:
+                return self.Free.pop()
+            if self.Created >= self.Capacity:
+                return None
+            self.Created += 1
+            return bytearray(self.BufferSize)
+
+    async def AcquireAsync(self):
+        # On an event loop without blocking it - waits until Release wakes it up
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.Condition:
+                buffer = self.TryAcquire()
+                if not buffer is None:
+                    return buffer
+                waiter = loop.create_future()
+                self.Waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self.Condition:
+                    if (loop, waiter) in self.Waiters:
+                        self.Waiters.remove((loop, waiter))
+                    elif self.Free:
+                        # Woken but canceled meanwhile - the next one takes the buffer
+                        self.Wake()
+                raise
+
+    @staticmethod
+    def SetWaiter(waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def Wake(self):
+        # Called with the condition held
+        if self.Waiters:
+            loop, waiter = self.Waiters.pop(0)
+            loop.call_soon_threadsafe(self.SetWaiter, waiter)
+
+    def Release(self, buffer):
+        with self.Condition:
+            self.Free.append(buffer)
+            self.Condition.notify()
+            self.Wake()
+
+    @contextmanager
+    def Buffer(self):
+        buffer = self.Acquire()
+        try:
+            yield buffer
+        finally:
+            self.Release(buffer)
+
+
+def CopyToFile(source, f):
+    # Streams a response (or any file object with readinto) into f through a pooled buffer - returns the number of bytes
+    Written = 0
+    with GlobalPool().Buffer() as buffer:
+        view = memoryview(buffer)
+        while True:
+            count = source.readinto(view)
+            if not count:
+                break
+            f.write(view[:count])
+            Written += count
+    return Written
+
+
+# One pool for all transfers of the application, recreated if the memory ceiling has been changed
+Pool = None
+PoolLock = threading.Lock()
+
+
+def GlobalPool():
+    global Pool
+    with PoolLock:
+        MaxMemory = util_settings.GlobalSettings().TransferMemoryMB * 1024 * 1024
+        if Pool is None or not Pool.MaxMemory == MaxMemory:
+            Pool = BufferPool(const.TRANSFER_BUFFER_SIZE, MaxMemory)
+        return Pool
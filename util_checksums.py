@@ -0,0 +1,226 @@
+import concurrent.futures
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+import traceback
+import util_constants as const
+import util_logging as log
+from typing import Union
+from PySide2.QtCore import QThread, Signal
+
+# One manifest per course path, shared by all downloaders and verifiers
+Manifests = {}
+ManifestsLock = threading.Lock()
+
+
+def GlobalManifest(coursepath):
+    coursepath = coursepath.replace("\\", "/")
+    with ManifestsLock:
+        if coursepath not in Manifests:
+            Manifests[coursepath] = ChecksumManifest(coursepath)
+        return Manifests[coursepath]
+
+
+def NewHash():
+    return hashlib.new(const.CHECKSUM_ALGORITHM)
+
+
+def HashFile(filename):
+    # Large files are mapped and hashed sequentially, small files are read in chunks
+    sha = NewHash()
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= const.CHECKSUM_MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, const.CHECKSUM_CHUNK_SIZE):
+                        sha.update(view[offset:offset + const.CHECKSUM_CHUNK_SIZE])
+                finally:
+                    view.release()
+        else:
+            for chunk in iter(lambda: f.read(const.CHECKSUM_CHUNK_SIZE), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ChecksumManifest():
+    """ Checksums of the files of a course with size and mtime of the last verification """
+
+    def __init__(self, coursepath):
+        self.CoursePath = coursepath
+        self.FileName = coursepath + "/" + const.COURSE_CHECKSUMS_FILE_NAME
+        self.Lock = threading.Lock()
+        self.SaveLock = threading.Lock()
+        self.Entries = {}
+        # Recorded entries not written yet and time of the last write
+        self.Dirty = False
+        self.Saved = time.time()
+        self.Load()
+
+    def Load(self):
+        if os.path.exists(self.FileName):
+            try:
+                with open(self.FileName, encoding="utf-8") as f:
+                    self.Entries = json.load(f).get("files", {})
+            except Exception as error:
+                log.error(f"An error has been occured on loading checksums '{self.FileName}':")
+                log.error(traceback.format_exc())
+                self.Entries = {}
+
+    def Save(self):
+        with self.SaveLock:
+            with self.Lock:
+                data = {"algorithm": const.CHECKSUM_ALGORITHM, "files": dict(self.Entries)}
+                self.Dirty = False
+                self.Saved = time.time()
+            FileNameTemp = self.FileName + const.DOWNLOAD_TEMP_EXT
+            with open(FileNameTemp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+            os.replace(FileNameTemp, self.FileName)
+
+    def Flush(self):
+        # Writes recorded entries which have not been saved yet (eg. at the end of a download)
+        if self.Dirty:
+            self.Save()
+
+    def RelativeName(self, filename):
+        return os.path.relpath(filename, self.CoursePath).replace("\\", "/")
+
+    def Record(self, filename, hash, save=True):
+        # Whole manifest is rewritten on save, so with save it is only written once per interval - Flush writes the rest
+        stat = os.stat(filename)
+        with self.Lock:
+            self.Entries[self.RelativeName(filename)] = {"hash": hash, "size": stat.st_size,
+                                                          "mtime": stat.st_mtime, "verified": time.time()}
+            self.Dirty = True
+            Due = time.time() - self.Saved >= const.CHECKSUM_SAVE_INTERVAL
+        if save and Due:
+            self.Save()
+
+    def Get(self, name):
+        with self.Lock:
+            return self.Entries.get(name)
+
+
+class LibraryVerifier():
+    """ Verifies all courses under the download root - only files whose size or mtime changed are hashed again """
+
+    STATES = ["ok", "unchanged", "added", "corrupt", "missing"]
+
+    def __init__(self, rootpath, workers=const.CHECKSUM_VERIFY_WORKERS, full=False):
+        self.RootPath = rootpath.replace("\\", "/")
+        self.Workers = workers
+        self.Full = full
+        self.canceled = False
+        self.Lock = threading.Lock()
+        self.Results = {state: [] for state in self.STATES}
+        self.BytesHashed = 0
+
+    def CoursePaths(self):
+        for entry in sorted(os.scandir(self.RootPath), key=lambda entry: entry.name):
+            if entry.is_dir() and not entry.name.startswith("."):
+                yield entry.path.replace("\\", "/")
+
+    @staticmethod
+    def Untracked(manifest):
+        # Videos downloaded before checksums were recorded are taken over with their current content
+        for entry in os.scandir(manifest.CoursePath):
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in const.CHECKSUM_ADOPT_TYPES:
+                if manifest.Get(entry.name) is None:
+                    yield entry.path.replace("\\", "/")
+
+    def Jobs(self):
+        for coursepath in self.CoursePaths():
+            manifest = GlobalManifest(coursepath)
+            with manifest.Lock:
+                names = list(manifest.Entries.keys())
+            for name in names:
+                yield manifest, name
+            for filename in self.Untracked(manifest):
+                yield manifest, manifest.RelativeName(filename)
+
+    def Check(self, manifest, name):
+        if self.canceled:
+            return None
+        filename = manifest.CoursePath + "/" + name
+        entry = manifest.Get(name)
+        if not os.path.exists(filename):
+            return "missing"
+        stat = os.stat(filename)
+        if not self.Full and entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return "unchanged"
+        hash = HashFile(filename)
+        with self.Lock:
+            self.BytesHashed += stat.st_size
+        if entry is None:
+            manifest.Record(filename, hash, False)
+            return "added"
+        if not entry["hash"] == hash:
+            return "corrupt"
+        manifest.Record(filename, hash, False)
+        return "ok"
+
+    def Run(self, onprogress=None):
+        jobs = list(self.Jobs())
+        with concurrent.futures.ThreadPoolExecutor(self.Workers, thread_name_prefix="Verify") as executor:
+            futures = {executor.submit(self.Check, manifest, name): (manifest, name) for manifest, name in jobs}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                manifest, name = futures[future]
+                try:
+                    state = future.result()
+                except Exception as error:
+                    log.error(f"An error has been occured on verifying '{manifest.CoursePath}/{name}': {repr(error)}")
+                    state = "corrupt"
+                if state is not None:
+                    with self.Lock:
+                        self.Results[state].append(f"{os.path.basename(manifest.CoursePath)}/{name}")
+                if not onprogress is None:
+                    onprogress(done, len(jobs), name)
+        for manifest in set(manifest for manifest, name in jobs):
+            manifest.Save()
+        return self.Results
+
+    def Summary(self):
+        counts = ", ".join(f"{len(self.Results[state])} {state}" for state in self.STATES)
+        return f"{counts} ({self.BytesHashed / 1024 / 1024:.0f} MB hashed)"
+
+
+class VerifyThread(QThread):
+    _signal_progress: Union[Signal, Signal] = Signal(int, int, int, str, str)
+    _signal_info: Union[Signal, Signal] = Signal(str)
+    _signal_error: Union[Signal, Signal] = Signal(str)
+    _signal_done: Union[Signal, Signal] = Signal(str)
+    _signal_canceled: Union[Signal, Signal] = Signal()
+
+    def __init__(self, mw, rootpath, full=False):
+        super(VerifyThread, self).__init__(mw)
+        self.verifier = LibraryVerifier(rootpath, full=full)
+
+    def TriggerCancelDownload(self):
+        self.verifier.canceled = True
+
+    def OnProgress(self, done, count, name):
+        self._signal_progress.emit(int(done * 100 / count), done, count, name, "")
+
+    def run(self):
+        try:
+            self._signal_info.emit("Verifying library ...")
+            self.verifier.Run(self.OnProgress)
+            log.info(f"Verification of library '{self.verifier.RootPath}': {self.verifier.Summary()}")
+            for name in self.verifier.Results["corrupt"] + self.verifier.Results["missing"]:
+                log.warn(f"Verification failed for '{name}'")
+        except Exception as error:
+            log.error(f"An error has been occured on verifying library '{self.verifier.RootPath}':")
+            log.error(traceback.format_exc())
+            self._signal_error.emit(repr(error))
+        else:
+            if self.verifier.canceled:
+                self._signal_canceled.emit()
+            else:
+                self._signal_done.emit(self.verifier.Summary())
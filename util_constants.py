@@ -1,5 +1,6 @@
 import os
 import re
+from types import MappingProxyType
 from os import path
 
 # User setting names and default values
@@ -15,6 +16,37 @@ USR_CONFIG_DOWNLOAD_CHECK_FILESIZE = "CheckFileSize"
 USR_CONFIG_DOWNLOAD_CHECK_FILESIZE_DEFAULT = False
 USR_CONFIG_FFMPEG_PATH = "FFMPEGPath"
 USR_CONFIG_FFMPEG_PATH_DEFAULT = ""
+USR_CONFIG_COMBINE_PIPELINE = "CombinePipeline"
+USR_CONFIG_COMBINE_PIPELINE_DEFAULT = False
+USR_CONFIG_PROFILE_RUNS = "ProfileRuns"
+USR_CONFIG_PROFILE_RUNS_DEFAULT = False
+USR_CONFIG_DEDUPLICATE = "Deduplicate"
+USR_CONFIG_DEDUPLICATE_DEFAULT = False
+USR_CONFIG_TRANSFER_MEMORY = "TransferMemoryMB"
+USR_CONFIG_TRANSFER_MEMORY_DEFAULT = 64
+USR_CONFIG_CHAPTER_PLAYLISTS = "ChapterPlaylists"
+USR_CONFIG_CHAPTER_PLAYLISTS_DEFAULT = False
+USR_CONFIG_ASSET_CACHE = "AssetCacheMB"
+USR_CONFIG_ASSET_CACHE_DEFAULT = 512
+USR_CONFIG_LIBRARY_WATCHER = "LibraryWatcher"
+USR_CONFIG_LIBRARY_WATCHER_DEFAULT = False
+USR_CONFIG_DELTA_SYNC = "DeltaSync"
+USR_CONFIG_DELTA_SYNC_DEFAULT = False
+USR_CONFIG_TRANSFER_ENGINE = "TransferEngine"
+USR_CONFIG_TRANSFER_ENGINE_DEFAULT = False
+USR_CONFIG_SCHEDULE_POLICY = "SchedulePolicy"
+USR_CONFIG_SCHEDULE_POLICY_DEFAULT = "curriculum"
+USR_CONFIG_SCHEDULE_FIRST_LECTURES = "ScheduleFirstLectures"
+USR_CONFIG_DOWNLOAD_WORKERS = "DownloadWorkers"
+USR_CONFIG_DOWNLOAD_WORKERS_DEFAULT = 1
+USR_CONFIG_RESOLUTION_POLICY = "ResolutionPolicy"
+USR_CONFIG_RESOLUTION_POLICY_DEFAULT = "highest"
+USR_CONFIG_RESOLUTION_BUDGET = "ResolutionBudgetGB"
+USR_CONFIG_RESOLUTION_BUDGET_DEFAULT = 10
+USR_CONFIG_RESOLUTION_DEADLINE = "ResolutionDeadlineHours"
+USR_CONFIG_RESOLUTION_DEADLINE_DEFAULT = 0
+USR_CONFIG_RESOLUTION_BANDWIDTH = "ResolutionBandwidthMBs"
+USR_CONFIG_RESOLUTION_BANDWIDTH_DEFAULT = 10
 USR_CONFIG_STATUSBAR_DEFAULT_LABEL_INSTALLED = "FFMPEG is installed"
 USR_CONFIG_STATUSBAR_DEFAULT_LABEL_NOT_FOUND = "FFMPEG path is not set !"
 
@@ -24,8 +56,19 @@ FFMPEG_DOWNLOAD_LATEST_VERSION_URL = "https://github.com/BtbN/FFmpeg-Builds/rele
 FFMPEG_TOOL_PATH = "\\ffmpeg-master-latest-win64-gpl\\bin"
 FFMPEG_TOOL_FILENAME = "ffmpeg.exe"
 FFMPEG_PLAYLIST_NAME = "playlist.txt"
+FFPROBE_TOOL_FILENAME = "ffprobe.exe"
+FFPROBE_DURATION_ARGS = ["-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", "{input}"]
+FFPROBE_STREAMS_ARGS = ["-v", "error", "-show_entries",
+                        "stream=codec_type,codec_name,profile,width,height,pix_fmt,time_base,sample_rate,channels,channel_layout",
+                        "-of", "json", "{input}"]
+FFPROBE_WORKERS = 4
 COURSE_COMBINE_FILENAME_EXT = ".mp4"
 FFMPEG_COMBINE_PARAMS = FFMPEG_TOOL_FILENAME + ' {videoinputs}-filter_complex "{mapping}concat=n={videocount}:v=1:a=1 [vv] [aa]" -map "[vv]" -map "[aa]" {output}'
+# Pipeline: remux each downloaded video into a concat ready mpeg-ts piece and concatenate pieces on combine
+FFMPEG_REMUX_ARGS = ["-y", "-v", "error", "-i", "{input}", "-map", "0:v?", "-map", "0:a?", "-c", "copy", "-f", "mpegts", "{output}"]
+FFMPEG_CONCAT_ARGS = ["-y", "-f", "concat", "-safe", "0", "-i", "{playlist}", "-c", "copy", "-bsf:a", "aac_adtstoasc", "{output}"]
+FFMPEG_PREPARED_PATH = ".combine"
+FFMPEG_PREPARED_EXT = ".ts"
 
 # Application
 APP_NAME = "UDemyCrawler"
@@ -40,16 +83,123 @@ PROGRESSBAR_LABEL_DEFAULT = "Click on a course to download."
 PROGRESSBAR_LABEL_DOWNLOAD = "Course will be downloaded. Please wait!"
 PROGRESSBAR_LABEL_DOWNLOAD_PARTS = "Course section {Section_Index:02d}/{Lecture_Index:02d}. will be downloaded: Part {segmentid:04d} of {segmentscount:04d} [{percentdone}%]"
 PROGRESSBAR_LABEL_DOWNLOAD_RESUME = "Course download will be continued after canceling/error ..."
+PROGRESSBAR_LABEL_LOGIN = "Checking the session of the last login ..."
+PROGRESS_THROUGHPUT_SMOOTHING = 0.3
+PROGRESS_REFRESH_INTERVAL_MS = 100
+# Bytes of running transfers are sampled for the throughput (and progress replaced) at most once per interval
+PROGRESS_SAMPLE_INTERVAL = 0.5
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_RETRY_DELAY = 2
+DOWNLOAD_TEMP_EXT = ".part"
+TRANSFER_BUFFER_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+# Small files (captions, supplementary assets) are fetched separately from the videos
+ASSET_FETCH_WORKERS = 16
+ASSET_FETCH_TIMEOUT = 15
+ASSET_FETCH_RETRIES = 2
+ASSET_CACHE_PATH = ".assets"
+ASSET_CACHE_WORKERS = 8
+# Query parameters of signed cdn urls which change on every request, the rest of the query selects the content
+ASSET_URL_SIGNING_PARAMETERS = ["expires", "signature", "key-pair-id", "policy", "token"]
+ASSET_ARTICLE_LINK_TYPES = [".pdf", ".zip", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".txt", ".csv", ".xlsx",
+                            ".docx", ".pptx"]
+STAGING_MOVE_WORKERS = 2
+STAGING_COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Segments of a hls stream fetched in parallel per lecture
+HLS_SEGMENT_WORKERS = 8
+METRICS_PATH = "Metrics"
+METRICS_PREFIX = "udemycrawler"
+METRICS_EXPORT_INTERVAL = 30
+METRICS_JSON_FILE_NAME = "metrics.json"
+METRICS_PROMETHEUS_FILE_NAME = "metrics.prom"
+METRICS_HISTORY_FILE_NAME = "metrics_history.jsonl"
+METRICS_LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+METRICS_DURATION_BUCKETS = [1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600]
+PROFILE_ENV_NAME = "UDEMYCRAWLER_PROFILE"
+PROFILE_PATH = "Profiles"
+PROFILE_STATS_EXT = ".prof"
+PROFILE_ALLOCATIONS_EXT = "-allocations.txt"
+PROFILE_TOP_ALLOCATIONS = 25
+PROFILE_TRACEMALLOC_FRAMES = 5
+# Worker threads started during a profiled run get a profiler of their own, merged into the run's profile
+PROFILE_THREAD_PREFIXES = ["Lecture", "Segment", "AssetFetcher", "ProbeSize", "FFProbe"]
+PROFILE_LOOP_TIMEOUT = 5
+DEDUP_STORE_PATH = ".store"
+DEDUP_INDEX_FILE_NAME = "index.json"
+DEDUP_HASH_CHUNK_SIZE = 1024 * 1024
+# Index of the store is written at most once per interval while downloading and once at the end
+DEDUP_SAVE_INTERVAL = 30
+CHECKSUM_ALGORITHM = "sha256"
+CHECKSUM_CHUNK_SIZE = 4 * 1024 * 1024
+CHECKSUM_MMAP_THRESHOLD = 64 * 1024 * 1024
+CHECKSUM_VERIFY_WORKERS = 4
+# Manifest of a course is written at most once per interval while downloading and once at the end
+CHECKSUM_SAVE_INTERVAL = 30
+# Course covers stored once by content hash in the courses path, referenced by the overview
+THUMBNAIL_CACHE_PATH = ".thumbnails"
+THUMBNAIL_INDEX_FILE_NAME = "thumbnails.json"
+THUMBNAIL_CACHE_MB = 64
+THUMBNAIL_SIZE = (240, 135)
+CHECKSUM_ADOPT_TYPES = [".mp4", ".mov", ".ts"]
+LIBRARY_INDEX_FILE_NAME = ".library.json"
+LIBRARY_POLL_INTERVAL = 10
+LIBRARY_WATCH_DEBOUNCE = 0.5
+SCHEDULE_POLICY_CURRICULUM = "curriculum"
+SCHEDULE_POLICY_FIRST_LECTURES = "first-lectures"
+SCHEDULE_POLICY_FIRST_PER_CHAPTER = "first-per-chapter"
+SCHEDULE_FIRST_LECTURES = 3
+RESOLUTION_POLICY_HIGHEST = "highest"
+RESOLUTION_POLICY_COURSE_BUDGET = "course-budget"
+RESOLUTION_POLICY_LIBRARY_BUDGET = "library-budget"
+RESOLUTION_PROBE_WORKERS = 16
+RESOLUTION_MIN_DURATION = 60
+# Typical video bitrates in bits per second by resolution (height), used if size and bandwidth are unknown
+RESOLUTION_TYPICAL_BITRATES = {144: 100000, 240: 250000, 360: 500000, 480: 900000, 720: 1800000, 1080: 3500000,
+                               1440: 6000000, 2160: 12000000}
+# Planning: resolution assumed for protected lectures and segment playlists (their size can not be asked for)
+PLAN_PROTECTED_RESOLUTION = 1080
+# Per account: api requests per second (and burst), pooled connections
+SESSION_API_RATE = 5
+SESSION_API_BURST = 10
+SESSION_POOL_SIZE = 16
+# Access token of the last login, protected by DPAPI on Windows and by file permissions otherwise
+SESSION_FILE_NAME = f"{APP_NAME}_Session.dat"
+SESSION_VALIDATE_TIMEOUT = 10
+# Transfer engine - all videos and assets on one asyncio event loop
+ENGINE_THREAD_NAME = "TransferEngine"
+ENGINE_MAX_IN_FLIGHT = 256
+ENGINE_CONNECTIONS_PER_HOST = 32
+ENGINE_MAX_REDIRECTS = 5
+ENGINE_CHUNK_SIZE = 256 * 1024
+ENGINE_PROGRESS_INTERVAL = 0.5
+ENGINE_PROGRESS_LABEL = "{count} transfer(s) running: {done:.1f} of {total:.1f} MB"
+CLI_TOKEN_ENV_NAME = "UDEMYCRAWLER_ACCESS_TOKEN"
 
 # Download course details
 COURSE_PREVIEW_IMAGE_NAME = "cover.jpg"
 COURSE_DESCRIPTION_FILE_NAME = "description.html"
 COURSE_PLAYLIST = "playlist.m3u"
+COURSE_ASSETS_PATH = "Assets"
+COURSE_CHAPTER_PLAYLIST = "playlist-{Chapter_Index:04d}-{Chapter_Title}.m3u"
+COURSE_PLAYLIST_VIDEO_TYPES = [".mp4", ".mov", ".ts"]
 COURSE_ID_FILE_NAME = "courseinfo.pickle"
 COURSE_OVERVIEW_FILE_NAME = "index.html"
 COURSE_CANCELED_STATE_FILE_NAME = "canceled.json"
+COURSE_CHECKSUMS_FILE_NAME = f"{APP_NAME}_Checksums.json"
+COURSE_RESOLUTIONS_FILE_NAME = f"{APP_NAME}_Resolutions.json"
+# Curriculum of the last complete download and the changes found by the latest delta sync
+COURSE_SYNCED_FILE_NAME = f"{APP_NAME}_CourseSynced.json"
+# Native course list - subscribed courses cached in app path, thumbnails loaded when they become visible
+COURSE_LIST_CACHE_FILE_NAME = f"{APP_NAME}_Courses.json"
+COURSE_LIST_THUMBNAIL_PATH = "Thumbnails"
+COURSE_LIST_THUMBNAIL_WORKERS = 8
+COURSE_LIST_THUMBNAIL_SIZE = THUMBNAIL_SIZE
+COURSE_LIST_GRID_SIZE = (260, 200)
+COURSE_LIST_PLACEHOLDER_COLOR = "#e0e0e0"
+COURSE_DELTA_FILE_NAME = f"{APP_NAME}_CourseDelta.json"
 COURSE_CANCEL_TYPE_CHAPTER = "Chapter"
 COURSE_CANCEL_TYPE_SEGMENT = "Segment"
+COURSE_CANCEL_TYPE_SCHEDULE = "Schedule"
 COURSE_COMPLETE_SCAN_FOR_FILETYPES = ["*.ts", "*.mp4", "*.mov"]
 # Special chars in chapter, ...
 COURSE_NAME_SPECIAL_CHARS_REPLACE = {
@@ -62,21 +212,6 @@ COURSE_NAME_SPECIAL_CHARS_REPLACE = {
     'ß': 'ss'
 }
 
-#    ".my-courses__course-card-grid>div { min-width: 100% !important; padding-bottom: 3rem !important; } "
-#    ".enrolled-course-card--options-menu--37ZJY { z-index: -1000 !important; height: 0 !important; display: none !important; } "
-#    "[data-purpose='tab-nav-buttons'] { z-index: -1000 !important; height: 0 !important; display: none !important; } "
-MAIN_STYLE = (
-    '"'
-    ".udlite-header { z-index: -1000 !important; height: 0 !important; display: none !important; } "
-    "[data-purpose='footer'] { z-index: -1000 !important; height: 0 !important; display: none !important; } "
-    ".my-courses__app { padding-top: 10px !important; background: orange !important;"
-    '"'
-)
-BLOCK_STYLE = (
-    '"'
-    "body { opacity: 0.4 !important; }"
-    '"'
-)
 HTML_HEADER = """
             <!doctype html>
             <html lang=en>
@@ -100,6 +235,8 @@ HTML_HEADER = """
                             border-radius: 0.375rem;
                             margin-bottom: 10px;
                             width: 100%;
+                            content-visibility: auto;
+                            contain-intrinsic-size: auto 260px;
                         }
                         .card-body {
                             flex: 1 1 auto;
@@ -111,6 +248,10 @@ HTML_HEADER = """
                         }
                         .card-img-top {
                             border-top-left-radius: 0.375rem;
+                            width: 240px;
+                            height: 135px;
+                            object-fit: cover;
+                            background: #e0e0e0;
                         }
                         .card-link {
                             border: 1px solid gray;
@@ -172,20 +313,22 @@ UDEMY_MAIN_COURSE_OVERVIEW = UDEMY_MAIN_URL + "/home/my-courses/"
 UDEMY_MAIN_COURSE_REDIRECT = UDEMY_MAIN_URL + "/course-dashboard-redirect/"
 UDEMY_API_URL_COURSE_DETAILS = UDEMY_MAIN_URL + "/api-2.0/courses/{CourseId}/" + f"?fields[course]={UDEMY_API_FIELD_COURSE_TITLE},{UDEMY_API_FIELD_COURSE_DESCRIPTION},{UDEMY_API_FIELD_COURSE_IMAGE}&fields[locale]={UDEMY_API_FIELD_LOCALE}"
 UDEMY_API_URL_COURSE_CHAPTERS = UDEMY_MAIN_URL + '/api-2.0/courses/{CourseId}/cached-subscriber-curriculum-items?fields[asset]=results,external_url,time_estimation,download_urls,slide_urls,filename,asset_type,captions,stream_urls,body,media_sources,media_license_token&fields[chapter]=object_index,title,sort_order&fields[lecture]=id,title,object_index,asset,supplementary_assets,view_html&page_size=10000'
-UDEMY_API_MY_COURSES = UDEMY_MAIN_URL + f"/api-2.0/users/me/subscribed-courses/?ordering=-last_accessed&fields[course]={UDEMY_API_FIELD_COURSE_TITLE},{UDEMY_API_FIELD_COURSE_DESCRIPTION},{UDEMY_API_FIELD_COURSE_IMAGE}&is_archived=false&page_size=10000"
+UDEMY_API_PAGE_SIZE = 100
+UDEMY_API_MY_COURSES = UDEMY_MAIN_URL + f"/api-2.0/users/me/subscribed-courses/?ordering=-last_accessed&fields[course]={UDEMY_API_FIELD_COURSE_TITLE},{UDEMY_API_FIELD_COURSE_DESCRIPTION},{UDEMY_API_FIELD_COURSE_IMAGE}&is_archived=false&page_size={UDEMY_API_PAGE_SIZE}"
+UDEMY_API_ME = UDEMY_MAIN_URL + "/api-2.0/users/me/?fields[user]=id"
 UDEMY_API_ARCHIVE_COURSE = UDEMY_MAIN_URL + "/api-2.0/users/me/archived-courses/?fields[course]=archive_time"
 UDEMY_API_COURSE_TITLE = UDEMY_MAIN_URL + "/api-2.0/courses/{CourseId}/?fields[course]=title"
 
 # Access token
 UDEMY_ACCESS_TOKEN_NAME = "access_token"
 
-# Additional headers to send (User agent, ...)
-HEADER_DEFAULT = {
+# Additional headers to send (User agent, ...) - read only, use RequestHeaders for the headers of a request
+HEADER_DEFAULT = MappingProxyType({
     'Origin': 'www.udemy.com',
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:66.0) Gecko/20100101 Firefox/66.0',
     'Referer': 'https://www.udemy.com/join/login-popup/',
     'Accept': 'application/json'
-}
+})
 HEADER_COOKIE_NAME = "Cookie"
 HEADER_COOKIE_ACCESS_TOKEN = "access_token={access_token_value}"
 
@@ -208,7 +351,7 @@ def FFMPEGDownloadPath():
 
 
 def RequestHeaders(accesstokenvalue):
-    HEADERS = HEADER_DEFAULT
+    HEADERS = dict(HEADER_DEFAULT)
     HEADERS.update({HEADER_COOKIE_NAME: HEADER_COOKIE_ACCESS_TOKEN.format(
         access_token_value=accesstokenvalue)})
     HEADERS.update({'Content-Type': 'application/json; charset=utf-8'})
@@ -0,0 +1,274 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import traceback
+import util_constants as const
+import util_logging as log
+import util_thumbnails as thumbnails
+from typing import Union
+from urllib.error import HTTPError
+from PySide2.QtCore import QObject, QSize, QThread, QTimer, Qt, Signal
+from PySide2.QtGui import QColor, QIcon, QPixmap
+from PySide2.QtWidgets import QLabel, QLineEdit, QListView, QListWidget, QListWidgetItem, QVBoxLayout, QWidget
+
+
+class CourseCatalog():
+    """ Subscribed courses of an account from the api - pages are cached on disk and refreshed with conditional requests """
+
+    def __init__(self, session):
+        # Account of the requests (util_session.Session)
+        self.session = session
+        self.Account = hashlib.sha256(session.AccessToken.encode("utf-8")).hexdigest()[:16]
+        self.CacheFileName = const.GlobalPaths().AppDataPath() + "/" + const.COURSE_LIST_CACHE_FILE_NAME
+
+    def LoadCache(self):
+        # Pages by url with their validators, only of the same account
+        try:
+            with open(self.CacheFileName, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not cache.get("Account") == self.Account:
+            return {}
+        return cache.get("Pages") or {}
+
+    def SaveCache(self, Pages):
+        CacheFileNameTemp = self.CacheFileName + const.DOWNLOAD_TEMP_EXT
+        with open(CacheFileNameTemp, "w", encoding="utf-8") as f:
+            json.dump({"Account": self.Account, "Pages": Pages}, f)
+        os.replace(CacheFileNameTemp, self.CacheFileName)
+
+    @staticmethod
+    def Courses(Pages):
+        # Courses of all pages in api order, starting with the first page
+        Courses = []
+        url = const.UDEMY_API_MY_COURSES
+        while url in Pages:
+            Data = Pages[url]["Data"]
+            for Course in Data.get("results") or []:
+                Courses.append({
+                    "Id": Course["id"],
+                    "Title": Course.get(const.UDEMY_API_FIELD_COURSE_TITLE, ""),
+                    "Description": Course.get(const.UDEMY_API_FIELD_COURSE_DESCRIPTION, ""),
+                    "Image": Course.get(const.UDEMY_API_FIELD_COURSE_IMAGE, ""),
+                    "URL": f"{const.UDEMY_MAIN_COURSE_REDIRECT}?{const.UDEMY_API_FIELD_COURSE_ID}={Course['id']}"
+                })
+            url = Data.get("next")
+        return Courses
+
+    def Cached(self):
+        # Without any request - courses of the last refresh
+        return self.Courses(self.LoadCache())
+
+    def FetchPage(self, url, Cached):
+        # Unchanged page is answered with 304 and taken from cache
+        req = self.session.Request(url)
+        if not Cached is None:
+            if Cached.get("ETag"):
+                req.add_header("If-None-Match", Cached["ETag"])
+            if Cached.get("LastModified"):
+                req.add_header("If-Modified-Since", Cached["LastModified"])
+        try:
+            res = self.session.Open(req)
+        except HTTPError as error:
+            if error.code == 304 and not Cached is None:
+                return Cached
+            raise
+        return {"ETag": res.getheader("ETag"), "LastModified": res.getheader("Last-Modified"),
+                "Data": json.loads(res.read().decode("utf-8"))}
+
+    def Refresh(self):
+        # All pages of the api, stored for the next start
+        Cached = self.LoadCache()
+        Pages = {}
+        url = const.UDEMY_API_MY_COURSES
+        while url and url not in Pages:
+            Pages[url] = self.FetchPage(url, Cached.get(url))
+            url = Pages[url]["Data"].get("next")
+        self.SaveCache(Pages)
+        return self.Courses(Pages)
+
+
+class CourseListThread(QThread):
+    _signal_courses: Union[Signal, Signal] = Signal(list)
+    _signal_error: Union[Signal, Signal] = Signal(str)
+
+    def __init__(self, mw, catalog):
+        super(CourseListThread, self).__init__(mw)
+        self.catalog = catalog
+
+    def run(self):
+        try:
+            Courses = self.catalog.Refresh()
+        except Exception as error:
+            log.error(f"An error has been occured on refreshing the course list:")
+            log.error(traceback.format_exc())
+            self._signal_error.emit(repr(error))
+        else:
+            self._signal_courses.emit(Courses)
+
+
+class ThumbnailLoader(QObject):
+    """ Course images from the thumbnail cache in app path - requested only for the courses which are visible """
+    _signal_loaded: Union[Signal, Signal] = Signal(str, str)
+
+    def __init__(self, parent, session):
+        super(ThumbnailLoader, self).__init__(parent)
+        self.session = session
+        self.cache = thumbnails.GlobalCache(const.GlobalPaths().AppDataPath() + "/" + const.COURSE_LIST_THUMBNAIL_PATH)
+        self.Executor = concurrent.futures.ThreadPoolExecutor(const.COURSE_LIST_THUMBNAIL_WORKERS, thread_name_prefix="Thumbnail")
+        self.Requested = set()
+        # Loads queued or running - the cache is saved once all of them are done
+        self.Lock = threading.Lock()
+        self.Pending = 0
+
+    def Request(self, url):
+        if url == "" or url in self.Requested:
+            return
+        self.Requested.add(url)
+        # Shown from the cache at once, revalidated once per start in the background
+        filename = self.cache.Cached(url)
+        if not filename is None:
+            self._signal_loaded.emit(url, filename)
+        with self.Lock:
+            self.Pending += 1
+        self.Executor.submit(self.Load, url, filename)
+
+    def Load(self, url, cached):
+        # Runs in a worker - signal is delivered to the list in the ui thread
+        try:
+            filename = self.cache.FromURL(url, self.session.Open)
+            if filename is None:
+                # Next request tries again if nothing is shown yet
+                if cached is None:
+                    self.Requested.discard(url)
+                return
+            if not filename == cached:
+                self._signal_loaded.emit(url, filename)
+        finally:
+            with self.Lock:
+                self.Pending -= 1
+                Done = self.Pending == 0
+            if Done:
+                self.cache.Save()
+
+
+class CourseList(QWidget):
+    """ Subscribed courses as native list - shown from the disk cache at once and refreshed in the background """
+
+    def __init__(self, parent, onclick):
+        super(CourseList, self).__init__(parent)
+        self.OnCourseClickCallback = onclick
+        self.catalog = None
+        self.thumbnails = None
+        self.thread = None
+        # Items and loaded icons by image url, an image is shared by all of its items
+        self.Items = {}
+        self.Icons = {}
+        self.initUI()
+
+    def initUI(self):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.Filter = QLineEdit(self)
+        self.Filter.setPlaceholderText("Filter courses")
+        self.Filter.setClearButtonEnabled(True)
+        self.Filter.textChanged.connect(self.OnFilterChanged)
+        self.Status = QLabel("", self)
+        self.List = QListWidget(self)
+        self.List.setViewMode(QListView.IconMode)
+        self.List.setIconSize(QSize(*const.COURSE_LIST_THUMBNAIL_SIZE))
+        self.List.setGridSize(QSize(*const.COURSE_LIST_GRID_SIZE))
+        self.List.setResizeMode(QListView.Adjust)
+        self.List.setMovement(QListView.Static)
+        self.List.setUniformItemSizes(True)
+        self.List.setWordWrap(True)
+        self.List.itemClicked.connect(self.OnItemClicked)
+        # Thumbnails of the visible courses are requested when scrolling has stopped for a moment
+        self.VisibleTimer = QTimer(self)
+        self.VisibleTimer.setSingleShot(True)
+        self.VisibleTimer.setInterval(50)
+        self.VisibleTimer.timeout.connect(self.LoadVisibleThumbnails)
+        self.List.verticalScrollBar().valueChanged.connect(self.VisibleTimer.start)
+        placeholder = QPixmap(*const.COURSE_LIST_THUMBNAIL_SIZE)
+        placeholder.fill(QColor(const.COURSE_LIST_PLACEHOLDER_COLOR))
+        self.Placeholder = QIcon(placeholder)
+        layout.addWidget(self.Filter)
+        layout.addWidget(self.List)
+        layout.addWidget(self.Status)
+
+    def SetSession(self, session):
+        self.catalog = CourseCatalog(session)
+        self.thumbnails = ThumbnailLoader(self, session)
+        self.thumbnails._signal_loaded.connect(self.OnThumbnailLoaded)
+        self.List.clear()
+        self.Items = {}
+        self.Icons = {}
+
+    def Reload(self):
+        # Cached list first (only if nothing is shown yet), then refreshed from the api
+        if self.catalog is None:
+            return
+        if self.List.count() == 0:
+            self.ShowCourses(self.catalog.Cached())
+        if not self.thread is None and self.thread.isRunning():
+            return
+        self.Status.setText("Refreshing courses ...")
+        self.thread = CourseListThread(self, self.catalog)
+        self.thread._signal_courses.connect(self.OnCoursesRefreshed)
+        self.thread._signal_error.connect(self.OnRefreshError)
+        self.thread.start()
+
+    def ShowCourses(self, Courses):
+        Position = self.List.verticalScrollBar().value()
+        self.List.clear()
+        self.Items = {}
+        for Course in Courses:
+            item = QListWidgetItem(self.Icons.get(Course["Image"], self.Placeholder), Course["Title"])
+            item.setData(Qt.UserRole, Course["URL"])
+            item.setToolTip(Course["Description"] or Course["Title"])
+            self.Items.setdefault(Course["Image"], []).append(item)
+            self.List.addItem(item)
+        self.OnFilterChanged(self.Filter.text())
+        self.List.verticalScrollBar().setValue(Position)
+        self.Status.setText(f"{len(Courses)} courses")
+        self.VisibleTimer.start()
+
+    def OnCoursesRefreshed(self, Courses):
+        self.ShowCourses(Courses)
+
+    def OnRefreshError(self, message):
+        self.Status.setText(f"Courses could not be refreshed: {message}")
+
+    def OnFilterChanged(self, text):
+        text = text.lower()
+        for row in range(self.List.count()):
+            item = self.List.item(row)
+            item.setHidden(not text in item.text().lower())
+        self.VisibleTimer.start()
+
+    def LoadVisibleThumbnails(self):
+        if self.thumbnails is None:
+            return
+        Viewport = self.List.viewport().rect()
+        for url, items in self.Items.items():
+            for item in items:
+                if not item.isHidden() and self.List.visualItemRect(item).intersects(Viewport):
+                    self.thumbnails.Request(url)
+                    break
+
+    def OnThumbnailLoaded(self, url, filename):
+        icon = QIcon(filename)
+        self.Icons[url] = icon
+        for item in self.Items.get(url, []):
+            item.setIcon(icon)
+
+    def OnItemClicked(self, item):
+        if not self.OnCourseClickCallback is None:
+            self.OnCourseClickCallback(item.data(Qt.UserRole))
+
+    def resizeEvent(self, event):
+        super(CourseList, self).resizeEvent(event)
+        self.VisibleTimer.start()
@@ -0,0 +1,163 @@
+import os
+import re
+import util_constants as const
+import util_logging as log
+import util_resolution as resolution
+
+
+class Lecture():
+    """ Immutable record of one lecture of a curriculum - use replace() to get a changed copy """
+    __slots__ = ("cnt", "Lecture_Id", "Chapter_Index", "Chapter_Title", "Lecture_Index", "Lecture_Title", "Lecture_FileName",
+                 "Lecture_Download_URL", "Lecture_Download_TYP", "Lecture_Media_License_Token", "Lecture_Time_Estimation",
+                 "Lecture_Renditions", "Lecture_Resolution", "Lecture_Protected", "Lecture_Assets", "Lecture_Article")
+    Defaults = {"cnt": 0, "Lecture_Id": None, "Chapter_Index": 0, "Chapter_Title": "", "Lecture_Index": 0, "Lecture_Title": "",
+                "Lecture_FileName": "", "Lecture_Download_URL": "", "Lecture_Download_TYP": "", "Lecture_Media_License_Token": "",
+                "Lecture_Time_Estimation": 0, "Lecture_Renditions": (), "Lecture_Resolution": None, "Lecture_Protected": False,
+                "Lecture_Assets": (), "Lecture_Article": None}
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields.pop(name, self.Defaults[name]))
+        if fields:
+            raise TypeError(f"Unknown lecture field(s): {', '.join(fields)}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Lecture is immutable, use replace() to change '{name}'")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Lecture is immutable, can not delete '{name}'")
+
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return Lecture(**fields)
+
+    def __repr__(self):
+        return f"Lecture({self.Chapter_Index:04d}-{self.Lecture_Index:04d} '{self.Lecture_Title}')"
+
+
+def ShortChapterTitle(Chapter_Title):
+    # Chapter title as used in file names of videos and assets
+    return re.sub('[^0-9a-zA-Z]+', '_', const.ReplaceSpecialChars(Chapter_Title))[:25]
+
+
+def AssetFileName(CourseTitle, Chapter_Index, Chapter_Title, Lecture_Index, Lecture_Title, name):
+    Lecture_Title = const.ReplaceSpecialChars(Lecture_Title)[:35]
+    name = const.ReplaceSpecialChars(name)
+    return f"{Chapter_Index:04d}-{Lecture_Index:04d}-0000__{CourseTitle}__{ShortChapterTitle(Chapter_Title)}__{Lecture_Title}__{name}"
+
+
+def HighestURL(Renditions, default=""):
+    Highest = resolution.HighestRendition(Renditions)
+    if Highest is None:
+        return default
+    return Highest.URL
+
+
+def ParseVideo(asset):
+    """ Download type, url, renditions and license token of the video of a lecture asset,
+        ("", "", (), "") if the asset has no video """
+    TYP, URL, Renditions, Token = "", "", [], ""
+    if "download_urls" in asset or "stream_urls" in asset:
+        # Search for downloads, streams are preferred if both are given
+        for Key, Type in [("download_urls", "DOWNLOAD"), ("stream_urls", "STREAM")]:
+            urls = asset.get(Key)
+            if not urls is None and len(urls.get("Video") or []) > 0:
+                Videos = urls["Video"]
+                # Renditions are kept, so the resolution can be lowered later to fit into a budget
+                TYP = Type
+                Renditions = resolution.CollectVideoRenditions(Videos)
+                URL = HighestURL(Renditions, Videos[0].get("file", ""))
+    # Special case - m3u8 media streams
+    for mediasource in asset.get("media_sources") or []:
+        if "type" in mediasource and "src" in mediasource:
+            MediaType = mediasource["type"]
+            if MediaType in ["video/mp4"]:
+                Renditions = resolution.CollectMediaRenditions(asset["media_sources"])
+                return "MEDIA", HighestURL(Renditions), tuple(Renditions), ""
+            elif MediaType in ["application/dash+xml"]:
+                # Encrypted stream has no renditions to choose from
+                return "MEDIA", mediasource["src"], (), asset.get("media_license_token", "")
+            else:
+                log.warn(f"Unknown media type '{MediaType}' with url {mediasource['src']}")
+    return TYP, URL, tuple(Renditions), Token
+
+
+def ParseAssets(CourseTitle, Chapter_Index, Chapter_Title, CourseObject):
+    # Captions and supplementary assets of a lecture as (type, url, filename)
+    Lecture_Index = CourseObject["object_index"]
+    Lecture_Title = CourseObject["title"]
+    def FileName(name):
+        return AssetFileName(CourseTitle, Chapter_Index, Chapter_Title, Lecture_Index, Lecture_Title, name)
+    Assets = []
+    for caption in (CourseObject.get("asset") or {}).get("captions") or []:
+        if caption.get("url"):
+            locale = caption.get("locale_id") or caption.get("video_label") or "caption"
+            filename, ext = os.path.splitext(caption.get("file_name") or "")
+            Assets.append(("DOWNLOAD", caption["url"], FileName(f"{locale}{ext or '.vtt'}")))
+    for asset in CourseObject.get("supplementary_assets") or []:
+        filename = asset.get("filename") or asset.get("title") or f"asset-{asset.get('id', 0)}"
+        downloads = asset.get("download_urls")
+        if downloads:
+            for files in downloads.values():
+                for file in files or []:
+                    if file.get("file"):
+                        Assets.append(("DOWNLOAD", file["file"], FileName(filename)))
+                        break
+        elif asset.get("external_url"):
+            Assets.append(("LINK", asset["external_url"], FileName(f"{filename}.url")))
+    return tuple(Assets)
+
+
+def ParseLecture(CourseTitle, Chapter_Index, Chapter_Title, CourseObject, cnt):
+    asset = CourseObject.get("asset") or {}
+    TYP, URL, Renditions, Token = ParseVideo(asset)
+    Article = None
+    if URL == "" and "asset" in CourseObject:
+        # If asset type is article only its content is stored in an html file, but no content is downloaded
+        if asset.get("asset_type") in ["Article"]:
+            Article = asset.get("body")
+        else:
+            log.error(f"No video url found for '{asset.get('filename', '')}' / {asset.get('asset_type')}")
+    return Lecture(cnt=cnt if not URL == "" else 0,
+                   Lecture_Id=CourseObject.get("id"),
+                   Chapter_Index=Chapter_Index,
+                   Chapter_Title=const.ReplaceSpecialChars(Chapter_Title),
+                   Lecture_Index=CourseObject["object_index"],
+                   Lecture_Title=const.ReplaceSpecialChars(CourseObject["title"]),
+                   Lecture_FileName=asset.get("filename", ""),
+                   Lecture_Download_URL=URL,
+                   Lecture_Download_TYP=TYP,
+                   Lecture_Media_License_Token=Token,
+                   Lecture_Time_Estimation=asset.get("time_estimation") or 0,
+                   Lecture_Renditions=Renditions,
+                   Lecture_Protected="MEDIA" in TYP and ".mpd" in URL,
+                   Lecture_Assets=ParseAssets(CourseTitle, Chapter_Index, Chapter_Title, CourseObject),
+                   Lecture_Article=Article)
+
+
+def ParseCurriculum(CourseDetailsJSON, CourseTitle):
+    """ All lectures of a curriculum (cached-subscriber-curriculum-items) in curriculum order, lectures with a video
+        are numbered by cnt. Pure function - nothing is downloaded or written """
+    Lectures = []
+    Chapter_Index = 0
+    Chapter_Title = ""
+    cnt = 0
+    for CourseObject in CourseDetailsJSON.get("results") or []:
+        CourseObjectType = CourseObject["_class"]
+        if "chapter" in CourseObjectType:
+            Chapter_Index = CourseObject["object_index"]
+            Chapter_Title = CourseObject["title"]
+        elif "lecture" in CourseObjectType:
+            Lecture = ParseLecture(CourseTitle, Chapter_Index, Chapter_Title, CourseObject, cnt + 1)
+            if Lecture.cnt > 0:
+                cnt = Lecture.cnt
+            Lectures.append(Lecture)
+        else:
+            log.warn(f"Unknown course type '{CourseObjectType}'")
+    return Lectures
+
+
+def VideoLectures(Lectures):
+    # Lectures which have a video to download
+    return [Lecture for Lecture in Lectures if not Lecture.Lecture_Download_URL == ""]
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import util_constants as const
+import util_logging as log
+from urllib.parse import urlparse
+from urllib.request import Request
+
+# One store per download root, shared by all downloaders
+Stores = {}
+StoresLock = threading.Lock()
+
+
+def GlobalStore(rootpath):
+    with StoresLock:
+        if rootpath not in Stores:
+            Stores[rootpath] = ContentStore(rootpath)
+        return Stores[rootpath]
+
+
+def HashFile(filename):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(const.DEDUP_HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ContentStore():
+    """ Content addressed store under the download root - equal files of all courses are hardlinks to one object """
+
+    def __init__(self, rootpath):
+        self.StorePath = rootpath.replace("\\", "/") + "/" + const.DEDUP_STORE_PATH
+        self.ObjectsPath = self.StorePath + "/objects"
+        self.IndexFileName = self.StorePath + "/" + const.DEDUP_INDEX_FILE_NAME
+        self.Lock = threading.Lock()
+        self.SaveLock = threading.Lock()
+        self.Index = {}
+        # Indexed sources not written yet and time of the last write
+        self.Dirty = False
+        self.Saved = time.time()
+        # Host and path of all indexed sources, only those are worth a probe before downloading
+        self.URLKeys = set()
+        self.LoadIndex()
+
+    def LoadIndex(self):
+        if os.path.exists(self.IndexFileName):
+            try:
+                with open(self.IndexFileName, encoding="utf-8") as f:
+                    self.Index = json.load(f)
+            except Exception as error:
+                log.error(f"An error has been occured on loading dedup index '{self.IndexFileName}':")
+                log.error(traceback.format_exc())
+                self.Index = {}
+        self.URLKeys = set(sourcekey.split("|")[0] for sourcekey in self.Index)
+
+    def SaveIndex(self):
+        # Written outside of the store lock, so downloads are not queued behind it
+        with self.SaveLock:
+            with self.Lock:
+                Index = dict(self.Index)
+                self.Dirty = False
+                self.Saved = time.time()
+            IndexFileNameTemp = self.IndexFileName + ".tmp"
+            with open(IndexFileNameTemp, "w", encoding="utf-8") as f:
+                json.dump(Index, f)
+            os.replace(IndexFileNameTemp, self.IndexFileName)
+
+    def Flush(self):
+        # Writes indexed sources which have not been saved yet (eg. at the end of a download)
+        if self.Dirty:
+            self.SaveIndex()
+
+    def ObjectFileName(self, hash):
+        return f"{self.ObjectsPath}/{hash[:2]}/{hash}"
+
+    @staticmethod
+    def URLKey(url):
+        # Signed query strings change on every request, so only host and path identify the source
+        parsed_url = urlparse(url)
+        return f"{parsed_url.netloc}{parsed_url.path}"
+
+    @classmethod
+    def SourceKey(cls, url, size, etag):
+        if size is None or size < 0 or not etag:
+            return None
+        return f"{cls.URLKey(url)}|{size}|{etag}"
+
+    def HasCandidates(self, url):
+        # Any stored content of this host and path - else probing the source can not find anything
+        with self.Lock:
+            return self.URLKey(url) in self.URLKeys
+
+    def ProbeSourceKey(self, url, openurl):
+        # Ask server for size and etag of the source without downloading it
+        try:
+            res = openurl(Request(url, method="HEAD"))
+            size = int(res.getheader("Content-Length", -1))
+            return self.SourceKey(url, size, res.getheader("ETag"))
+        except Exception as error:
+            log.debug(f"Can not probe '{url}' for deduplication: {repr(error)}")
+            return None
+
+    def Lookup(self, sourcekey):
+        if sourcekey is None:
+            return None
+        with self.Lock:
+            hash = self.Index.get(sourcekey)
+        if hash is not None and os.path.exists(self.ObjectFileName(hash)):
+            return hash
+        return None
+
+    def LinkFromStore(self, hash, filename):
+        # Replace target atomically by a hardlink to the stored object
+        FileNameTemp = filename + ".dedup"
+        if os.path.exists(FileNameTemp):
+            os.remove(FileNameTemp)
+        os.link(self.ObjectFileName(hash), FileNameTemp)
+        os.replace(FileNameTemp, filename)
+
+    def Add(self, sourcekey, filename, hash=None):
+        # Store downloaded file, if content is already known replace file by a hardlink to reclaim space
+        if hash is None:
+            hash = HashFile(filename)
+        ObjectFileName = self.ObjectFileName(hash)
+        Due = False
+        with self.Lock:
+            try:
+                if os.path.exists(ObjectFileName):
+                    if not os.path.samefile(ObjectFileName, filename):
+                        FileNameTemp = filename + ".dedup"
+                        os.link(ObjectFileName, FileNameTemp)
+                        os.replace(FileNameTemp, filename)
+                        log.info(f"Deduplicated '{filename}' with stored object {hash}")
+                else:
+                    os.makedirs(os.path.dirname(ObjectFileName), exist_ok=True)
+                    os.link(filename, ObjectFileName)
+            except OSError as error:
+                # Eg. file system without hardlinks - keep the plain file
+                log.warn(f"Can not hardlink '{filename}' into content store: {repr(error)}")
+                return hash
+            if sourcekey is not None:
+                self.Index[sourcekey] = hash
+                self.URLKeys.add(sourcekey.split("|")[0])
+                self.Dirty = True
+                Due = time.time() - self.Saved >= const.DEDUP_SAVE_INTERVAL
+        if Due:
+            self.SaveIndex()
+        return hash
@@ -0,0 +1,56 @@
+import hashlib
+
+
+def AssetSignature(asset):
+    # Download urls are signed and change with every request, so only stable fields are compared
+    body = asset.get("body")
+    return {"Id": asset.get("id"), "Type": asset.get("asset_type"), "FileName": asset.get("filename"),
+            "Time_Estimation": asset.get("time_estimation"),
+            "Body": hashlib.sha256(body.encode("utf-8")).hexdigest() if body else None,
+            "Captions": sorted(str(caption.get("locale_id") or caption.get("video_label")) + "/" + str(caption.get("file_name"))
+                               for caption in asset.get("captions") or []),
+            "MediaSources": sorted(str(mediasource.get("type")) + "/" + str(mediasource.get("label"))
+                                   for mediasource in asset.get("media_sources") or [])}
+
+
+def LectureSignatures(CourseDetailsJSON):
+    """ Signature of each lecture of a curriculum by lecture id - contains everything the downloaded
+        file names and contents depend on (chapter, index, title, asset and supplementary assets) """
+    Signatures = {}
+    Chapter = {}
+    for CourseObject in CourseDetailsJSON.get("results") or []:
+        CourseObjectType = CourseObject.get("_class", "")
+        if "chapter" in CourseObjectType:
+            Chapter = CourseObject
+        elif "lecture" in CourseObjectType and "id" in CourseObject:
+            Signatures[CourseObject["id"]] = {
+                "Chapter_Index": Chapter.get("object_index", 0), "Chapter_Title": Chapter.get("title", ""),
+                "Lecture_Index": CourseObject.get("object_index"), "Lecture_Title": CourseObject.get("title"),
+                "Asset": AssetSignature(CourseObject.get("asset") or {}),
+                "Supplementary": sorted(str(asset.get("id")) + "/" + str(asset.get("filename") or asset.get("title"))
+                                        for asset in CourseObject.get("supplementary_assets") or [])}
+    return Signatures
+
+
+def DiffCurriculum(Synced, Current):
+    # Lecture ids added, changed, removed and unchanged since the curriculum was synced last
+    Old = LectureSignatures(Synced)
+    New = LectureSignatures(Current)
+    Delta = {"Added": [], "Changed": [], "Removed": [], "Unchanged": []}
+    for LectureId, Signature in New.items():
+        if LectureId not in Old:
+            Delta["Added"].append(LectureId)
+        elif Old[LectureId] == Signature:
+            Delta["Unchanged"].append(LectureId)
+        else:
+            Delta["Changed"].append(LectureId)
+    Delta["Removed"] = [LectureId for LectureId in Old if LectureId not in New]
+    return Delta
+
+
+def RemovedLectures(Synced, Delta):
+    # Chapter and title of the removed lectures as they were synced (for the report)
+    Old = LectureSignatures(Synced)
+    return [{"Id": LectureId, "Chapter_Index": Old[LectureId]["Chapter_Index"], "Chapter_Title": Old[LectureId]["Chapter_Title"],
+             "Lecture_Index": Old[LectureId]["Lecture_Index"], "Lecture_Title": Old[LectureId]["Lecture_Title"]}
+            for LectureId in Delta["Removed"]]
@@ -1,16 +1,68 @@
-import json, os, re, traceback, m3u8, time, datetime as dt, fastdl, util_logging as log, util_constants as const, util_settings, \
-    util_overview as overview, util_uncrypt as encrypt
+import json, os, traceback, m3u8, time, threading, datetime as dt, concurrent.futures, fastdl, util_logging as log, util_constants as const, util_settings, \
+    util_overview as overview, util_uncrypt as encrypt, util_ffmpeg as ffmpeg, util_progress as progress, \
+    util_metrics as metrics, util_profiling as profiling, util_dedup as dedup, util_staging as staging, \
+    util_bufferpool as bufferpool, util_assets as assets, util_assetcache as assetcache, util_checksums as checksums, \
+    util_schedule as schedule, util_resolution as resolution, util_library as library, util_delta as delta, util_curriculum as curriculum, \
+    util_engine as engine, util_thumbnails as thumbnails
 from pathlib import Path
 from typing import Union
 from urllib.parse import urlparse, parse_qs
 import requests
 from PySide2.QtCore import QThread, Signal
+from urllib.error import HTTPError
 from urllib.request import Request, urlopen
 from pprint import pformat
 from Crypto.Cipher import AES
 
 
+def OpenURL(req, data=None, timeout=None, opener=None):
+    # All requests are opened here, so they are counted with latency and status
+    Metrics = metrics.GlobalMetrics()
+    start = time.time()
+    Open = urlopen if opener is None else opener.open
+    try:
+        if timeout is None:
+            res = Open(req, data)
+        else:
+            res = Open(req, data, timeout)
+    except HTTPError as error:
+        Metrics.Inc("http_responses_total", status=error.code)
+        raise
+    except Exception as error:
+        Metrics.Inc("http_errors_total")
+        raise
+    finally:
+        Metrics.Inc("http_requests_total")
+        Metrics.Observe("http_request_seconds", time.time() - start)
+    Metrics.Inc("http_responses_total", status=res.status)
+    return res
+
+
+class LectureState():
+    """ State of the lecture currently downloaded - thread local, so lectures can be downloaded by parallel workers """
+
+    def __init__(self, default):
+        self.Default = default
+
+    def __set_name__(self, owner, name):
+        self.Name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj.lecture_state, self.Name, self.Default)
+
+    def __set__(self, obj, value):
+        setattr(obj.lecture_state, self.Name, value)
+
+
 class DownloaderThread(QThread):
+    LastLectureIdx = LectureState(-1)
+    LastSegmentIdx = LectureState(-1)
+    CurrentLectureIdx = LectureState(-1)
+    LectureBytes = LectureState(0)
+    LectureBytesTransferred = LectureState(0)
+    ResumeOnLastDownload = LectureState(False)
     _signal_progress_parts: Union[Signal, Signal] = Signal(int, int, int, int)
     _signal_progress: Union[Signal, Signal] = Signal(int, int, int, str, str)
     _signal_info: Union[Signal, Signal] = Signal(str)
@@ -18,23 +70,38 @@ class DownloaderThread(QThread):
     _signal_done: Union[Signal, Signal] = Signal(int, str)
     _signal_canceled: Union[Signal, Signal] = Signal()
 
-    def __init__(self, mw, courseurl, accesstokenvalue):
+    def __init__(self, mw, courseurl, session):
         super(DownloaderThread, self).__init__(mw)
         self.canceled = False
         self.course_url = courseurl
-        self.access_token_value = accesstokenvalue
-        self.LastLectureIdx = -1
-        self.LastSegmentIdx = -1
+        # Account of the download (util_session.Session)
+        self.session = session
+        self.lecture_state = threading.local()
+        # Lectures finished by a scheduled (not curriculum ordered) download
+        self.ScheduledDone = None
+        # Articles are written while parsing the curriculum (not while planning)
+        self.SaveArticles = True
+        # Lecture ids which have not changed since the last complete download (delta sync)
+        self.UnchangedLectures = set()
+        # Streams, assets and articles which could not be downloaded - the course is not synced completely then
+        self.Failures = 0
+        self.FailuresLock = threading.Lock()
+        self.CourseDetailsJSON = None
         self.cfg = util_settings.GlobalSettings()
-        self.overview = overview.Overview(accesstokenvalue)
-        self.downloader = Downloader(accesstokenvalue)
-
-    def calcProcessTime(self, starttime, cur_iter, max_iter):
-        telapsed = time.time() - starttime
-        testimated = (telapsed / cur_iter) * (max_iter)
-        finishtime = starttime + testimated
-        finishtime = dt.datetime.fromtimestamp(finishtime).strftime("%H:%M:%S")  # in time
-        return finishtime
+        self.overview = overview.Overview(session)
+        self.downloader = Downloader(session)
+        self.pipeline = None
+        self.assets = None
+        # Thumbnail cache a cover has been placed from
+        self.covers = None
+        self.engine = None
+        # Progress of the lectures, also updated by the bytes of the running transfers
+        self.estimator = None
+        self.LecturesDone = 0
+        self.LecturesCount = 0
+        # Frequent progress updates are coalesced and polled by the UI instead of emitting signals
+        self.progress = progress.ProgressAggregator()
+        self.metrics = metrics.GlobalMetrics()
 
     def TriggerCancelDownload(self):
         self.DeleteCancelFile()
@@ -74,38 +141,67 @@ class DownloaderThread(QThread):
         # Load all chapter videos
         LecturesCount = len(LecturesList)
         for LectureIdx in range(LecturesCount):
-            Chapter = LecturesList[LectureIdx]
-            if "Lecture_Protected" in Chapter:
-                if Chapter["Lecture_Protected"]:
-                    Protected = True
-                    break
+            if LecturesList[LectureIdx].Lecture_Protected:
+                Protected = True
+                break
         return Protected
 
+    @profiling.Profiled("download")
     def run(self):
         try:
             # Parse url
             parsed_url = urlparse(self.course_url)
             self.CourseId = parse_qs(parsed_url.query)[const.UDEMY_API_FIELD_COURSE_ID][0]
             # Prepare course path
-            self.CoursePath = self.PrepareCourseDownload(self.CourseId)
-            # Prepare playlist
+            with profiling.Span("Prepare course"):
+                self.CoursePath = self.SyncedCoursePath(self.CourseId)
+                if self.CoursePath is None:
+                    self.CoursePath = self.PrepareCourseDownload(self.CourseId)
+            # Playlist is generated from the lecture list after downloading
             self.PlaylistFileName = self.CoursePath + os.sep + const.COURSE_PLAYLIST
-            if os.path.exists(self.PlaylistFileName):
-                os.remove(self.PlaylistFileName)
-            with open(self.PlaylistFileName, "a") as playlist:
-                playlist.write("#EXTM3U\n")
-            # Process all courses
-            self.ProcessCourse()
+            # Prepare downloaded videos for combining in background
+            self.StartPipeline()
+            # Videos and assets on the event loop of the transfer engine, its progress is forwarded to the window
+            if self.cfg.TransferEngine:
+                self.engine = engine.GlobalEngine()
+                self.downloader.engine = self.engine
+                self.downloader.listener = None if self.parent() is None else engine.QtBridge(self)
+            # Captions and supplementary assets are fetched beside the videos
+            self.assets = assets.AssetFetcher(self.session.Open, engine=self.engine)
+            # Process all courses, wall clock time of all downloads is the base of the measured bandwidth
+            with self.metrics.WallTimer("download_wall_seconds"):
+                with profiling.Span("Download lectures"):
+                    self.ProcessCourse()
+                with profiling.Span("Finish pipeline"):
+                    self.FinishPipeline()
+                with profiling.Span("Finish assets"):
+                    self.FinishAssets()
+            self.FlushChecksums()
+            self.FlushStore()
+            self.FlushCovers()
             # Delete file cause no longer needed if not canceled by user
             if not self.canceled:
                 if os.path.exists(self.CanceledFileName()):
                     self.DeleteCancelFile()
+                # Curriculum is synced completely, next delta sync is compared against it (failed lectures raise before)
+                if self.Failures == 0:
+                    self.SaveSyncedCurriculum()
+                else:
+                    log.warn(f"{self.Failures} stream(s), article(s) or asset(s) of course '{self.CourseTitle}' could not be downloaded, "
+                             f"so the next delta sync checks the lectures of this download again")
         except Exception as error:
             log.error(f"An error has been occured on Course with url {self.course_url}:")
             log.error(traceback.format_exc())
+            self.FinishPipeline()
+            self.FinishAssets()
+            self.FlushChecksums()
+            self.FlushStore()
+            self.FlushCovers()
             # Try to make an canceled file depending on what has been canceled:
             try:
-                if self.LastSegmentIdx == -1:
+                if not self.ScheduledDone is None:
+                    self.ScheduleCanceled()
+                elif self.LastSegmentIdx == -1:
                     self.ChapterCanceled()
                 else:
                     self.SegmentCanceled()
@@ -120,16 +216,90 @@ class DownloaderThread(QThread):
                 self._signal_canceled.emit()
             else:
                 self._signal_done.emit(int(self.CourseId), self.CourseTitle)
+        self.metrics.WriteSnapshot(True)
+
+    def StartPipeline(self):
+        if self.cfg.CombinePipeline and ffmpeg.FFMPEGUtil().Available():
+            self.pipeline = ffmpeg.FFMPEGPipeline(self.CoursePath)
+            self.pipeline.Start()
+
+    def FinishPipeline(self):
+        if not self.pipeline is None:
+            self._signal_info.emit("Finishing preparation of videos for combining ...")
+            self.pipeline.Finish(self.canceled)
+            self.pipeline = None
+
+    def FinishAssets(self):
+        if not self.assets is None:
+            self._signal_info.emit("Finishing download of captions and supplementary assets ...")
+            self.CountFailures(self.assets.Finish(self.canceled))
+            self.assets = None
+
+    def CountFailures(self, count=1):
+        # From the lecture workers as well
+        with self.FailuresLock:
+            self.Failures += count
+
+    def FlushChecksums(self):
+        # Checksums recorded while downloading are written in batches, the rest at the end
+        try:
+            if hasattr(self, "CoursePath"):
+                checksums.GlobalManifest(self.CoursePath).Flush()
+        except Exception as error:
+            log.error(f"An error has been occured on writing the checksums of course '{self.course_url}':")
+            log.error(traceback.format_exc())
+
+    def FlushStore(self):
+        # Sources added to the content store are indexed in batches, the rest at the end
+        try:
+            if self.cfg.Deduplicate and not self.cfg.DownloadPath == "":
+                dedup.GlobalStore(self.cfg.DownloadPath).Flush()
+        except Exception as error:
+            log.error(f"An error has been occured on writing the content store index of course '{self.course_url}':")
+            log.error(traceback.format_exc())
+
+    def FlushCovers(self):
+        try:
+            if not self.covers is None:
+                self.covers.Save()
+        except Exception as error:
+            log.error(f"An error has been occured on writing the thumbnail index of course '{self.course_url}':")
+            log.error(traceback.format_exc())
 
     def ProcessCourse(self):
-        start = time.time()
         # Load canceled file if available to resume:
         self.canceled_file = self.LoadJSONCanceledState()
         # Get all course chapters
-        LecturesList = self.LoadAllCourseLectures(self.CourseId)
-        # Load all chapter videos
+        with profiling.Span("Load curriculum"):
+            LecturesList = self.LoadAllCourseLectures(self.CourseId)
+        # Delta sync downloads only lectures added or changed since the last complete download
+        PendingList = [Lecture for Lecture in LecturesList if not Lecture.Lecture_Id in self.UnchangedLectures]
+        if len(PendingList) == 0:
+            log.info(f"Course '{self.CourseTitle}' is unchanged since the last complete download")
+            # Playlists are written anyway, eg. if the chapter playlists setting has changed
+            with profiling.Span("Write playlists"):
+                self.WritePlaylists(LecturesList)
+            return
+        with profiling.Span("Select resolutions"):
+            PendingList = self.SelectResolutions(PendingList)
+        # Load all chapter videos, progress is accounted in bytes weighted by the time estimation of each lecture
+        LecturesCount = len(PendingList)
+        estimator = progress.ThroughputEstimator([Lecture.Lecture_Time_Estimation for Lecture in PendingList])
+        self.progress.SetProgress(0, 0, LecturesCount, self.CourseTitle, "'calculating...'")
+        self.estimator = estimator
+        self.LecturesDone = 0
+        self.LecturesCount = LecturesCount
+        self.downloader.onbytes = self.LectureBytesCallback
+        if not self.cfg.SchedulePolicy == const.SCHEDULE_POLICY_CURRICULUM or self.cfg.DownloadWorkers > 1:
+            self.ProcessCourseScheduled(PendingList, estimator)
+        else:
+            self.ProcessCourseInOrder(PendingList, estimator)
+        # Write playlist(s) with all videos downloaded until now
+        with profiling.Span("Write playlists"):
+            self.WritePlaylists(LecturesList)
+
+    def ProcessCourseInOrder(self, LecturesList, estimator):
         LecturesCount = len(LecturesList)
-        self._signal_progress.emit(0, 0, LecturesCount, self.CourseTitle, "'calculating...'")
         self.LastLectureIdx = -1
         self.LastSegmentIdx = -1
         self.CurrentLectureIdx = -1
@@ -137,11 +307,17 @@ class DownloaderThread(QThread):
             # Reset last segment index
             self.LastSegmentIdx = -1
             self.CurrentLectureIdx = LectureIdx + 1
+            self.LectureBytes = 0
+            self.LectureBytesTransferred = 0
             # Download chapter
+            start = time.time()
             self.DownloadVideoChapter(self.CurrentLectureIdx, LecturesList[LectureIdx])
-            processed = int((self.CurrentLectureIdx) / LecturesCount * 100)
-            prstime = self.calcProcessTime(start, self.CurrentLectureIdx, LecturesCount)
-            self._signal_progress.emit(processed, self.CurrentLectureIdx, LecturesCount, self.CourseTitle, prstime)
+            estimator.Completed(LectureIdx, self.LectureBytes, self.LectureBytesTransferred, time.time() - start)
+            self.metrics.Observe("lecture_seconds", time.time() - start, const.METRICS_DURATION_BUCKETS)
+            self.metrics.Inc("lectures_total", state="downloaded" if self.LectureBytesTransferred > 0 else "skipped")
+            self.LecturesDone = self.CurrentLectureIdx
+            self.progress.SetProgress(estimator.PercentDone(), self.CurrentLectureIdx, LecturesCount,
+                                      self.CourseTitle, estimator.FinishTime())
             # Store last processed lecture index
             self.LastLectureIdx = self.CurrentLectureIdx
             # User has been canceled ?
@@ -150,15 +326,105 @@ class DownloaderThread(QThread):
                     self.ChapterCanceled()
                 break
 
-    def PrepareCourseDownload(self, CourseId):
+    def ProcessCourseScheduled(self, LecturesList, estimator):
+        # Lectures needed to start watching first, the rest largest first by parallel workers
+        LecturesCount = len(LecturesList)
+        Workers = max(1, self.cfg.DownloadWorkers)
+        Priority, Rest = schedule.ScheduleLectures(LecturesList, self.cfg.SchedulePolicy, self.cfg.ScheduleFirstLectures)
+        log.info(f"Downloading {len(Priority)} priority lecture(s) first, then {len(Rest)} lecture(s) largest first "
+                 f"with {Workers} parallel download(s)")
+        self.ScheduledDone = set()
+        PriorityPending = set(Priority)
+        start = time.time()
+        LastCompleted = start
+        FirstPlayable = None
+        PriorityReady = None
+        with concurrent.futures.ThreadPoolExecutor(Workers, thread_name_prefix="Lecture") as executor:
+            # Executor starts the lectures in submit order, so priority lectures are taken first
+            futures = {executor.submit(self.DownloadScheduledLecture, LectureIdx, LecturesList[LectureIdx]): LectureIdx
+                       for LectureIdx in Priority + Rest}
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    LectureIdx = futures[future]
+                    result = future.result()
+                    if result is None:
+                        estimator.Failed(LectureIdx)
+                        continue
+                    LectureBytes, LectureBytesTransferred, seconds = result
+                    # Throughput of all workers together is measured between completions
+                    now = time.time()
+                    estimator.Completed(LectureIdx, LectureBytes, LectureBytesTransferred, now - LastCompleted)
+                    LastCompleted = now
+                    self.ScheduledDone.add(LectureIdx + 1)
+                    self.metrics.Observe("lecture_seconds", seconds, const.METRICS_DURATION_BUCKETS)
+                    self.metrics.Inc("lectures_total", state="downloaded" if LectureBytesTransferred > 0 else "skipped")
+                    # First finished lecture to watch - any priority lecture, or any lecture if nothing is prioritized
+                    if FirstPlayable is None and (LectureIdx in PriorityPending or len(Priority) == 0):
+                        FirstPlayable = now - start
+                    PriorityPending.discard(LectureIdx)
+                    if PriorityReady is None and len(Priority) > 0 and len(PriorityPending) == 0:
+                        PriorityReady = now - start
+                        self.progress.SetInfo(f"First lectures are ready to watch after {PriorityReady:.1f}s")
+                    self.LecturesDone = len(self.ScheduledDone)
+                    self.progress.SetProgress(estimator.PercentDone(), len(self.ScheduledDone), LecturesCount,
+                                              self.CourseTitle, estimator.FinishTime())
+                    if self.canceled:
+                        break
+            finally:
+                # Don't start any further lecture on cancel or error
+                for future in futures:
+                    future.cancel()
+        Makespan = time.time() - start
+        if not FirstPlayable is None:
+            self.metrics.Observe("schedule_first_playable_seconds", FirstPlayable, const.METRICS_DURATION_BUCKETS)
+        if not PriorityReady is None:
+            self.metrics.Observe("schedule_priority_ready_seconds", PriorityReady, const.METRICS_DURATION_BUCKETS)
+        self.metrics.Observe("schedule_makespan_seconds", Makespan, const.METRICS_DURATION_BUCKETS)
+        FirstPlayableText = "-" if FirstPlayable is None else f"{FirstPlayable:.1f}s"
+        PriorityReadyText = "-" if PriorityReady is None else f"{PriorityReady:.1f}s"
+        log.info(f"Scheduled download of '{self.CourseTitle}' ({self.cfg.SchedulePolicy}, {Workers} worker(s)): "
+                 f"first playable after {FirstPlayableText}, priority lectures after {PriorityReadyText}, makespan {Makespan:.1f}s")
+        if self.canceled:
+            self.ScheduleCanceled()
+
+    def LectureBytesCallback(self):
+        # Called by the thread starting a transfer - its bytes are accounted to the lecture of that thread
+        LectureIdx = self.CurrentLectureIdx - 1 if self.CurrentLectureIdx > 0 else None
+        return lambda count: self.OnBytes(count, LectureIdx)
+
+    def OnBytes(self, count, LectureIdx=None):
+        # Every chunk of every transfer - progress and finish time are only replaced when the estimator takes a sample
+        estimator = self.estimator
+        if not estimator is None and estimator.Transferred(count, LectureIdx):
+            self.progress.SetProgress(estimator.PercentDone(), self.LecturesDone, self.LecturesCount,
+                                      self.CourseTitle, estimator.FinishTime())
+
+    def DownloadScheduledLecture(self, LectureIdx, Lecture):
+        # Runs in a worker thread - lecture state is thread local
+        if self.canceled:
+            return None
+        self.LastSegmentIdx = -1
+        self.CurrentLectureIdx = LectureIdx + 1
+        self.LectureBytes = 0
+        self.LectureBytesTransferred = 0
+        start = time.time()
+        self.DownloadVideoChapter(self.CurrentLectureIdx, Lecture)
+        # Lecture interrupted by cancel is not finished
+        if self.canceled:
+            return None
+        return self.LectureBytes, self.LectureBytesTransferred, time.time() - start
+
+    def FetchCourseDetails(self, CourseId):
         url = const.UDEMY_API_URL_COURSE_DETAILS.format(CourseId=CourseId)
         log.info(f"Getting course detail information for course with id '{CourseId}'")
         log.info(f" Course url is: '{url}'")
         # Get more information on course:
-        req = Request(url, headers=const.RequestHeaders(self.access_token_value))
-        res = urlopen(req).read()
+        res = self.session.Open(self.session.Request(url)).read()
         # Convert to json
-        CourseInfo = json.loads(res.decode("utf-8"))
+        return json.loads(res.decode("utf-8"))
+
+    def PrepareCourseDownload(self, CourseId):
+        CourseInfo = self.FetchCourseDetails(CourseId)
         Title = CourseInfo[const.UDEMY_API_FIELD_COURSE_TITLE]
         log.info(f"Title:\n{Title}")
         Description = CourseInfo[const.UDEMY_API_FIELD_COURSE_DESCRIPTION]
@@ -177,13 +443,11 @@ class DownloaderThread(QThread):
     def BuildCoursePathInfo(self, CourseId, Title, Description, Image):
         log.info(f"Preparing download for course with id '{CourseId}', '{Title}'")
         # Create path
-        DownloadPath = self.cfg.DownloadPath
-        self.CourseTitle = const.ReplaceSpecialChars(Title)
-        CoursePath = DownloadPath + os.sep + self.CourseTitle + f"-#{CourseId}#"
+        CoursePath = self.CoursePathFor(CourseId, Title)
         if not os.path.exists((CoursePath)):
             os.makedirs(CoursePath)
-        # Download image
-        self.downloader.DownloadFileFast(Image, CoursePath + os.sep + const.COURSE_PREVIEW_IMAGE_NAME)
+        # Cover from the thumbnail cache, only fetched again if it has changed
+        self.PlaceCover(Image, CoursePath)
         # Create description
         desc = open(CoursePath + os.sep + const.COURSE_DESCRIPTION_FILE_NAME, "w", encoding="utf-8")
         desc.write(Description)
@@ -193,199 +457,273 @@ class DownloaderThread(QThread):
         # Return path created
         return CoursePath
 
-    def GetVideoWithHighestResolution(self, Videos):
-        # Default use first video
-        if "file" in Videos[0]:
-            url = Videos[0]["file"]
-        MaxRes = 0
-        for Video in Videos:
-            if "label" in Video:
-                VideoRes = Video["label"]
-                if VideoRes.isnumeric():
-                    CurrentVideoRes = int(VideoRes)
-                    if CurrentVideoRes >= MaxRes:
-                        if "file" in Video:
-                            MaxRes = CurrentVideoRes
-                            url = Video["file"]
-        return url
-
-    def GetMediaVideoWithHighestResolution(self, mediasources):
-        url = ""
-        MaxRes = 0
-        for mediasource in mediasources:
-            if "type" in mediasource and "src" in mediasource and "label" in mediasource:
-                MediaType = mediasource["type"]
-                MediaURL = mediasource["src"]
-                MediaRes = mediasource["label"]
-                if MediaType in ["video/mp4"]:
-                    if MediaRes.isnumeric():
-                        CurrentVideoRes = int(MediaRes)
-                        if CurrentVideoRes >= MaxRes:
-                            MaxRes = CurrentVideoRes
-                            url = MediaURL
-        return url
-
-    def GetPlaylistwithhighestResolution(self, variantplaylist):
-        MaxResPlayList = None
-        MaxRes = 0
+    def PlaceCover(self, Image, CoursePath):
+        cache = thumbnails.GlobalCache(self.cfg.DownloadPath.replace("\\", "/") + "/" + const.THUMBNAIL_CACHE_PATH)
+        CacheFileName = cache.FromURL(Image, self.session.Open)
+        if CacheFileName is None:
+            return
+        CoverFileName = CoursePath + os.sep + const.COURSE_PREVIEW_IMAGE_NAME
+        try:
+            cache.Place(CacheFileName, CoverFileName)
+            # Cached file is named by its checksum
+            checksums.GlobalManifest(CoursePath).Record(CoverFileName, os.path.splitext(os.path.basename(CacheFileName))[0])
+        except OSError:
+            log.warn(f"Can not place cover of course in '{CoursePath}':")
+            log.warn(traceback.format_exc())
+        # Index of the cache is written at the end of the download
+        self.covers = cache
+
+    def DeltaSyncEnabled(self):
+        return self.cfg.DeltaSync and not self.cfg.DownloadCourseVideoAgain
+
+    def SyncedCoursePath(self, CourseId):
+        # Course synced completely before needs neither course details nor cover and description again
+        if not self.DeltaSyncEnabled():
+            return None
+        for Course in library.GlobalLibrary(self.cfg.DownloadPath).CourseInfos():
+            if Course["Id"] == int(CourseId) and os.path.exists(Course["Path"] + '/' + const.COURSE_SYNCED_FILE_NAME):
+                self.CourseTitle = const.ReplaceSpecialChars(Course["Title"])
+                log.info(f"Delta sync of course with id '{CourseId}' in '{Course['Path']}'")
+                return Course["Path"]
+        return None
+
+    def CoursePathFor(self, CourseId, Title):
+        self.CourseTitle = const.ReplaceSpecialChars(Title)
+        return self.cfg.DownloadPath + os.sep + self.CourseTitle + f"-#{CourseId}#"
+
+    def GetPlaylistwithhighestResolution(self, variantplaylist, Chapter=None):
+        # Highest variant, but not above the resolution chosen for the lecture
+        MaxResolution = None
+        if not Chapter is None:
+            MaxResolution = Chapter.Lecture_Resolution
+        Renditions = resolution.CollectPlaylistRenditions(variantplaylist)
+        if len(Renditions) < len(variantplaylist):
+            log.warn(f"Ignoring unknown video resolution")
+        Highest = resolution.HighestRendition(Renditions, MaxResolution) or resolution.HighestRendition(Renditions)
+        if Highest is None:
+            return None
         for playlist in variantplaylist:
-            Resolution = playlist.stream_info.resolution
-            if not Resolution is None:
-                CurrentVideoRes = Resolution[0]
-                if CurrentVideoRes >= MaxRes:
-                    MaxRes = CurrentVideoRes
-                    MaxResPlayList = playlist
+            if playlist.uri == Highest.URL:
+                return playlist
+        return None
+
+    def SelectResolutions(self, LecturesList, save=True):
+        # Best resolution per lecture which fits into the storage budget and/or the deadline, returns the changed lectures
+        LibraryBytes = 0
+        if self.cfg.ResolutionPolicy == const.RESOLUTION_POLICY_LIBRARY_BUDGET:
+            LibraryBytes = sum(Course["Bytes"] for Course in library.GlobalLibrary(self.cfg.DownloadPath).CourseInfos()
+                               if not Course["Path"] == self.CoursePath)
+        Budget = resolution.BudgetBytes(self.cfg, LibraryBytes)
+        if Budget is None:
+            return LecturesList
+        self.progress.SetInfo("Selecting video resolutions within the budget ...")
+        # Variants of streams are given by their master playlist, sized by bandwidth times duration
+        Streams = [Lecture for Lecture in LecturesList
+                   if len(Lecture.Lecture_Renditions) == 0 and ".m3u8" in Lecture.Lecture_Download_URL]
+        StreamRenditions = resolution.LoadPlaylistRenditions([Lecture.Lecture_Download_URL for Lecture in Streams],
+                                                             dict(self.session.Headers))
+        Renditions = {Lecture.cnt: Lecture.Lecture_Renditions for Lecture in LecturesList}
+        Renditions.update(zip([Lecture.cnt for Lecture in Streams], StreamRenditions))
+        Lectures = [Lecture for Lecture in LecturesList if len(Renditions[Lecture.cnt]) > 0]
+        # Renditions are immutable, probing returns them with their size (kept by the changed lectures for planning)
+        Probed = iter(resolution.ProbeSizes([Rendition for Lecture in Lectures for Rendition in Renditions[Lecture.cnt]],
+                                            self.session.Open))
+        for Lecture in Lectures:
+            Renditions[Lecture.cnt] = tuple(next(Probed) for Rendition in Renditions[Lecture.cnt])
+        Chosen = resolution.SelectRenditions([[(Rendition, resolution.EstimateSize(Rendition, Lecture.Lecture_Time_Estimation))
+                                               for Rendition in Renditions[Lecture.cnt]] for Lecture in Lectures], Budget)
+        Choices = []
+        Selected = {}
+        for Lecture, (Rendition, Estimate) in zip(Lectures, Chosen):
+            if len(Lecture.Lecture_Renditions) == 0:
+                # Stream keeps its master playlist, the variant is capped by the resolution while downloading
+                Selected[Lecture.cnt] = Lecture.replace(Lecture_Resolution=Rendition.Resolution)
             else:
-                log.warn(f"Ignoring unknown video resolution")
-        return MaxResPlayList
-
-    def InitCurrentChapter(self):
-        self.Chapter_Title = ""
-        self.Chapter_Index = 0
-
-    def ParseChapter(self, CourseObject):
-        self.Chapter_Title = CourseObject["title"]
-        self.Chapter_Index = CourseObject["object_index"]
-
-    def InitCurrentLecture(self):
-        self.Lecture_Title = ""
-        self.Lecture_Index = 0
-        self.Lecture_FileName = ""
-        self.Lecture_Download_URL = ""
-        self.Lecture_Download_TYP = ""
-        self.Lecture_Media_License_Token = ""
-
-    def SaveArticle(self, CourseObject):
-        if not CourseObject is None:
-            Lecture_Title = const.ReplaceSpecialChars(CourseObject["title"])
-            Lecture_Index = CourseObject["object_index"]
-            Chapter_Title = const.ReplaceSpecialChars(self.Chapter_Title)
-            if "asset" in CourseObject:
-                asset = CourseObject["asset"]
-                if "body" in asset:
-                    ArticleFileName = f"{self.Chapter_Index:04d}-{Lecture_Index:04d}-0000__{self.CourseTitle}__{Chapter_Title}__{Lecture_Title}.html"
-                    ArticleFileNameFull = self.CoursePath + "/" + ArticleFileName
-                    body = CourseObject["asset"]["body"]
-                    with open(ArticleFileNameFull, "w", encoding="utf-8") as article:
-                        article.write(body)
-
-    def ParseLecture(self, CourseObject):
-        self.Lecture_Title = CourseObject["title"]
-        self.Lecture_Index = CourseObject["object_index"]
-        if "asset" in CourseObject:
-            assets = CourseObject["asset"]
-            if "filename" in assets:
-                self.Lecture_FileName = assets["filename"]
-            if "download_urls" in assets or "stream_urls" in assets:
-                # Search for downloads
-                downloads = assets["download_urls"]
-                if not downloads is None:
-                    if "Video" in downloads:
-                        if len(downloads["Video"]) > 0:
-                            self.Lecture_Download_TYP = "DOWNLOAD"
-                            self.Lecture_Download_URL = self.GetVideoWithHighestResolution(downloads["Video"])
-                # Search for streams
-                streams = assets["stream_urls"]
-                if not streams is None:
-                    if "Video" in streams:
-                        if len(streams["Video"]) > 0:
-                            self.Lecture_Download_TYP = "STREAM"
-                            self.Lecture_Download_URL = self.GetVideoWithHighestResolution(streams["Video"])
-            # Special case - m3u8 media streams
-            if "media_sources" in assets:
-                # Search for mediasource
-                mediasources = assets["media_sources"]
-                if not mediasources is None:
-                    MediaFound = False
-                    for mediasource in mediasources:
-                        if "type" in mediasource and "src" in mediasource:
-                            MediaType = mediasource["type"]
-                            MediaURL = mediasource["src"]
-                            if MediaType in ["video/mp4"]:
-                                self.Lecture_Download_TYP = "MEDIA"
-                                self.Lecture_Download_URL = self.GetMediaVideoWithHighestResolution(mediasources)
-                                MediaFound = True
-                            elif MediaType in ["application/dash+xml"]:
-                                self.Lecture_Download_TYP = "MEDIA"
-                                self.Lecture_Download_URL = MediaURL
-                                if "media_license_token" in assets:
-                                    self.Lecture_Media_License_Token = assets["media_license_token"]
-                                MediaFound = True
-                            else:
-                                log.warn(f"Unknown media type '{MediaType}' with url {MediaURL}")
-                        if MediaFound:
-                            break
-            # Check if url has been found - otherwise log warning
-            if self.Lecture_Download_URL == "":
-                asset_type = CourseObject["asset"]["asset_type"]
-                # If asset type is article only store content in an html file, but don't download any content
-                if asset_type in ["Article"]:
-                    self.SaveArticle(CourseObject)
-                else:
-                    errormessage = f"No video url found for '{self.Lecture_FileName}' / {asset_type}"
-                    log.error(errormessage)
+                Selected[Lecture.cnt] = Lecture.replace(Lecture_Download_URL=Rendition.URL, Lecture_Resolution=Rendition.Resolution,
+                                                        Lecture_Renditions=Renditions[Lecture.cnt])
+            Choices.append({"Chapter_Index": Lecture.Chapter_Index, "Lecture_Index": Lecture.Lecture_Index,
+                            "Lecture_Title": Lecture.Lecture_Title, "Resolution": Rendition.Resolution,
+                            "Size": Estimate,
+                            "Available": sorted(Candidate.Resolution for Candidate in Renditions[Lecture.cnt])})
+        Total = sum(Choice["Size"] for Choice in Choices)
+        log.info(f"Selected resolutions for '{self.CourseTitle}': {Total / 1024 ** 3:.2f} GB of {Budget / 1024 ** 3:.2f} GB budget")
+        # Store choices with the course
+        if save:
+            self.SaveJSON(self.CoursePath + '/' + const.COURSE_RESOLUTIONS_FILE_NAME,
+                          {"Policy": self.cfg.ResolutionPolicy, "DeadlineHours": self.cfg.ResolutionDeadlineHours,
+                           "Budget": Budget, "Total": Total, "Lectures": Choices})
+        return [Selected.get(Lecture.cnt, Lecture) for Lecture in LecturesList]
 
-    def LoadAllCourseLectures(self, CourseId):
+    def SaveArticle(self, Lecture):
+        ArticleFileName = f"{Lecture.Chapter_Index:04d}-{Lecture.Lecture_Index:04d}-0000__{self.CourseTitle}__{Lecture.Chapter_Title}__{Lecture.Lecture_Title}.html"
+        ArticleFileNameFull = self.CoursePath + "/" + ArticleFileName
+        body = Lecture.Lecture_Article
+        self.WriteArticle(ArticleFileNameFull, body)
+        # Referenced images and files are fetched beside the videos and the article is rewritten to them
+        if not self.assets is None and len(assetcache.ArticleAssetURLs(body)) > 0:
+            self.assets.SubmitTask(self.LocalizeArticle, ArticleFileNameFull, body)
+
+    @staticmethod
+    def WriteArticle(ArticleFileNameFull, body):
+        ArticleFileNameTemp = ArticleFileNameFull + const.DOWNLOAD_TEMP_EXT
+        with open(ArticleFileNameTemp, "w", encoding="utf-8") as article:
+            article.write(body)
+        os.replace(ArticleFileNameTemp, ArticleFileNameFull)
+
+    def LocalizeArticle(self, ArticleFileNameFull, body):
+        try:
+            cache = assetcache.GlobalCache(self.cfg.DownloadPath)
+            body, Missing = assetcache.LocalizeArticle(body, self.CoursePath, cache, self.session.Open)
+            self.WriteArticle(ArticleFileNameFull, body)
+            # Article keeps the remote urls of assets which could not be fetched - checked again on the next sync
+            if Missing > 0:
+                log.warn(f"{Missing} asset(s) of article '{ArticleFileNameFull}' could not be downloaded")
+            return Missing == 0
+        except Exception as error:
+            log.error(f"An error has been occured on localizing article '{ArticleFileNameFull}':")
+            log.error(traceback.format_exc())
+            return False
+
+    def QueueLectureAssets(self, Lecture):
+        if self.assets is None:
+            return
+        for typ, url, filename in Lecture.Lecture_Assets:
+            filename = self.CoursePath + os.sep + filename
+            if typ == "LINK":
+                self.assets.SubmitLink(url, filename)
+            else:
+                self.assets.Submit(url, filename)
+
+    def FetchCurriculum(self, CourseId):
         url = const.UDEMY_API_URL_COURSE_CHAPTERS.format(CourseId=CourseId)
         log.info(f"Getting course chapters information for course with id '{CourseId}'")
         log.info(f" Course chapter url is: '{url}'")
         # Get more information on course:
-        req = Request(url, headers=const.RequestHeaders(self.access_token_value))
-        res = urlopen(req).read()
+        res = self.session.Open(self.session.Request(url)).read()
         # Convert to json
         CourseDetailsJSON = json.loads(res.decode("utf-8"))
         # output readable
         log.debug("--- JSON CourseDetails:")
         log.debug(pformat(CourseDetailsJSON))
+        return CourseDetailsJSON
+
+    def LoadAllCourseLectures(self, CourseId):
+        CourseDetailsJSON = self.FetchCurriculum(CourseId)
         self.SaveJSON(self.CoursePath + '/' + const.APP_REST_COURSE_DETAILS_FILE_NAME, CourseDetailsJSON)
-        # Parse and prepare video list:
-        self.InitCurrentChapter()
-        self.InitCurrentLecture()
-        cnt = 0
-        VideosList = []
-        if "results" in CourseDetailsJSON:
-            for CourseObject in CourseDetailsJSON["results"]:
-                CourseObjectType = CourseObject["_class"]
-                if "chapter" in CourseObjectType:
-                    self.InitCurrentChapter()
-                    self.ParseChapter(CourseObject)
-                elif "lecture" in CourseObjectType:
-                    self.InitCurrentLecture()
-                    self.ParseLecture(CourseObject)
-                    if not self.Lecture_Download_URL == "":
-                        cnt = cnt + 1
-                        Lecture_Protected = False
-                        if "MEDIA" in self.Lecture_Download_TYP and ".mpd" in self.Lecture_Download_URL:
-                            Lecture_Protected = True
-                        VideosList.append(
-                            {"cnt": cnt,
-                             "Chapter_Index": self.Chapter_Index,
-                             "Chapter_Title": const.ReplaceSpecialChars(self.Chapter_Title),
-                             "Lecture_Index": self.Lecture_Index,
-                             "Lecture_Title": const.ReplaceSpecialChars(self.Lecture_Title),
-                             "Lecture_FileName": self.Lecture_FileName,
-                             "Lecture_Download_URL": self.Lecture_Download_URL,
-                             "Lecture_Download_TYP": self.Lecture_Download_TYP,
-                             "Lecture_Media_License_Token" : self.Lecture_Media_License_Token,
-                             "Lecture_Protected" : Lecture_Protected
-                             }
-                        )
-                else:
-                    log.warn(f"Unknown course type '{CourseObjectType}'")
-        return VideosList
+        self.CourseDetailsJSON = CourseDetailsJSON
+        self.UnchangedLectures = self.DiffSyncedCurriculum(CourseDetailsJSON)
+        return self.ParseCurriculum(CourseDetailsJSON)
+
+    def DiffSyncedCurriculum(self, CourseDetailsJSON):
+        # Returns the ids of the unchanged lectures, added, changed and removed lectures are reported
+        SyncedFileName = self.CoursePath + '/' + const.COURSE_SYNCED_FILE_NAME
+        if not self.DeltaSyncEnabled() or not os.path.exists(SyncedFileName):
+            return set()
+        try:
+            with open(SyncedFileName, encoding="utf-8") as json_file:
+                Synced = json.load(json_file)
+        except Exception as error:
+            log.warn(f"Can not read synced curriculum '{SyncedFileName}', syncing all lectures: {repr(error)}")
+            return set()
+        Delta = delta.DiffCurriculum(Synced, CourseDetailsJSON)
+        Removed = delta.RemovedLectures(Synced, Delta)
+        for Lecture in Removed:
+            log.warn(f"Lecture '{Lecture['Lecture_Title']}' ({Lecture['Chapter_Index']:04d}-{Lecture['Lecture_Index']:04d}) "
+                     f"has been removed from course '{self.CourseTitle}'")
+        self.SaveJSON(self.CoursePath + '/' + const.COURSE_DELTA_FILE_NAME,
+                      {"Synced": os.path.getmtime(SyncedFileName), "Added": Delta["Added"], "Changed": Delta["Changed"],
+                       "Removed": Removed, "Unchanged": len(Delta["Unchanged"])})
+        log.info(f"Delta sync of '{self.CourseTitle}': {len(Delta['Added'])} added, {len(Delta['Changed'])} changed, "
+                 f"{len(Removed)} removed, {len(Delta['Unchanged'])} unchanged lecture(s)")
+        if len(Removed) > 0:
+            self.progress.SetInfo(f"{len(Removed)} lecture(s) have been removed from the course since the last download")
+        return set(Delta["Unchanged"])
+
+    def SaveSyncedCurriculum(self):
+        if self.CourseDetailsJSON is None:
+            return
+        SyncedFileName = self.CoursePath + '/' + const.COURSE_SYNCED_FILE_NAME
+        SyncedFileNameTemp = SyncedFileName + const.DOWNLOAD_TEMP_EXT
+        with open(SyncedFileNameTemp, "w", encoding="utf-8") as json_file:
+            json.dump(self.CourseDetailsJSON, json_file)
+        os.replace(SyncedFileNameTemp, SyncedFileName)
+
+    def ParseCurriculum(self, CourseDetailsJSON):
+        # Lectures with a video, articles and assets are stored beside them
+        Lectures = curriculum.ParseCurriculum(CourseDetailsJSON, self.CourseTitle)
+        for Lecture in Lectures:
+            # Articles and assets of unchanged lectures are on disk since the last complete download
+            if Lecture.Lecture_Id in self.UnchangedLectures:
+                continue
+            if not Lecture.Lecture_Article is None and self.SaveArticles:
+                self.SaveArticle(Lecture)
+            self.QueueLectureAssets(Lecture)
+        return curriculum.VideoLectures(Lectures)
 
     def DoDownloadVideo(self, type, url, downloadvideoname):
         log.info(f"Try to download video (type={type}) '{downloadvideoname}' from '{url}' ")
         if not url == "":
-            self.downloader.DownloadFileFast(url, self.CoursePath + os.sep + downloadvideoname)
-            # Append video to playlist if filetype is video:
-            if self.ExtractDownloadExtFromUri(url) in [".mp4", ".mov"]:
-                with open(self.PlaylistFileName, "a") as playlist:
-                    playlist.write(f"#EXTINF:-1,{downloadvideoname}\n")
-                    playlist.write(f"{downloadvideoname}\n")
+            DownloadFileNameFull = self.CoursePath + os.sep + downloadvideoname
+            Transferred = self.downloader.DownloadFileFast(url, DownloadFileNameFull)
+            # Account bytes of lecture for progress
+            if os.path.exists(DownloadFileNameFull):
+                FileSize = os.path.getsize(DownloadFileNameFull)
+                self.LectureBytes += FileSize
+                if Transferred:
+                    self.LectureBytesTransferred += FileSize
+            # Queue downloaded video for preparing to combine
+            if not self.pipeline is None and self.ExtractDownloadExtFromUri(url) in [".ts", ".mp4", ".mov"]:
+                self.pipeline.Enqueue(downloadvideoname)
         else:
             log.info(f"Ignore no downloadable chapter (information only) !")
 
+    def DownloadVideoSegments(self, Chapter, DownloadVideoName):
+        # Unencrypted hls stream - segments are fetched into the temp path and assembled there into one transport stream,
+        # which is moved into the course path at once
+        Chapter_Index = Chapter.Chapter_Index
+        Lecture_Index = Chapter.Lecture_Index
+        url = Chapter.Lecture_Download_URL
+        DownloadFileNameFull = self.CoursePath + os.sep + DownloadVideoName
+        if os.path.exists(DownloadFileNameFull) and not self.cfg.DownloadCourseVideoAgain:
+            log.info(f"No need to redownload stream '{DownloadVideoName}' cause file exists !")
+            self.LectureBytes += os.path.getsize(DownloadFileNameFull)
+            return
+        log.info(f"Try to download stream '{DownloadVideoName}' from '{url}' ")
+        ReqHeaders = dict(self.session.Headers)
+        m3u8list = m3u8.load(url, headers=ReqHeaders)
+        # If playlist contains other playlists with different resolutions get highest (within the selected resolution)
+        if m3u8list.is_variant:
+            variant = self.GetPlaylistwithhighestResolution(m3u8list.playlists, Chapter)
+            if variant is None:
+                log.warn(f"Ignore stream '{DownloadVideoName}' without a known resolution !")
+                self.CountFailures()
+                return
+            m3u8list = m3u8.load(variant.absolute_uri, headers=ReqHeaders)
+        if any(not key is None and not key.method in [None, "NONE"] for key in m3u8list.keys):
+            log.warn(f"Ignore encrypted stream '{DownloadVideoName}' !")
+            self.CountFailures()
+            return
+        Segments = [(segment.absolute_uri, staging.SegmentFileName(DownloadFileNameFull, segmentid))
+                    for segmentid, segment in enumerate(m3u8list.segments, 1)]
+        if len(Segments) == 0:
+            log.info(f"Ignore stream without segments '{DownloadVideoName}' !")
+            self.CountFailures()
+            return
+        with self.metrics.Timer("download_seconds", const.METRICS_DURATION_BUCKETS):
+            Transferred = self.downloader.DownloadSegments(
+                Segments, lambda segmentid, segmentscount: self.progress.SetParts(Chapter_Index, Lecture_Index, segmentid, segmentscount))
+        hash = checksums.NewHash()
+        staging.AssembleFile([filename for url, filename in Segments], DownloadFileNameFull, hash)
+        checksums.GlobalManifest(self.CoursePath).Record(DownloadFileNameFull, hash.hexdigest())
+        self.metrics.Inc("downloads_total")
+        self.metrics.Inc("download_bytes_total", Transferred)
+        # Account bytes of lecture for progress
+        self.LectureBytes += os.path.getsize(DownloadFileNameFull)
+        self.LectureBytesTransferred += Transferred
+        # Queue assembled video for preparing to combine
+        if not self.pipeline is None:
+            self.pipeline.Enqueue(DownloadVideoName)
+
     def ChapterCanceled(self):
         CanceledInfo = {}
         CanceledInfo.update({"CancelType": const.COURSE_CANCEL_TYPE_CHAPTER})
@@ -400,6 +738,15 @@ class DownloaderThread(QThread):
         CanceledInfo.update({"SegmentIdx": self.LastSegmentIdx})
         self.SaveJSONCanceledState(CanceledInfo)
 
+    def ScheduleCanceled(self):
+        # Lectures are finished out of curriculum order, so all finished lectures are stored
+        CanceledInfo = {}
+        CanceledInfo.update({"CancelType": const.COURSE_CANCEL_TYPE_SCHEDULE})
+        CanceledInfo.update({"LectureIdx": -1})
+        CanceledInfo.update({"SegmentIdx": -1})
+        CanceledInfo.update({"Done": sorted(self.ScheduledDone)})
+        self.SaveJSONCanceledState(CanceledInfo)
+
     def IgnoreDownloadFileChapterSectionCauseOfResume(self, cnt, LectureIdx, Chapter_Index, SegmentIdx=-1):
         Ignore = False
         if not self.canceled_file is None:
@@ -407,7 +754,12 @@ class DownloaderThread(QThread):
             CancelType = self.canceled_file["CancelType"]
             CanceledLectureIdx = self.canceled_file["LectureIdx"]
             CanceledSegmentIdx = self.canceled_file["SegmentIdx"]
-            if "Chapter" in CancelType:
+            if const.COURSE_CANCEL_TYPE_SCHEDULE in CancelType:
+                if LectureIdx in self.canceled_file["Done"]:
+                    Ignore = True
+                else:
+                    self.ResumeOnLastDownload = False
+            elif "Chapter" in CancelType:
                 if LectureIdx <= CanceledLectureIdx:
                     Ignore = True
                 else:
@@ -430,7 +782,7 @@ class DownloaderThread(QThread):
         m3u8list = m3u8.load(Lecture_Download_URL)
         # If playlist contains other playlists with different resolutions get highest
         if m3u8list.is_variant:
-            bestresplaylisturl = self.GetPlaylistwithhighestResolution(m3u8list.playlists).uri
+            bestresplaylisturl = self.GetPlaylistwithhighestResolution(m3u8list.playlists, Chapter).uri
             m3u8list = m3u8.load(bestresplaylisturl)
         # Get all segments and download it:
         segments = m3u8list.segments
@@ -447,9 +799,9 @@ class DownloaderThread(QThread):
                 if not self.IgnoreDownloadFileChapterSectionCauseOfResume(cnt, LectureIdx, Chapter_Index, segmentid):
                     self.DoDownloadVideo(Lecture_Download_TYP, Lecture_Download_URL, DownloadVideoName)
                 if self.ResumeOnLastDownload:
-                    self._signal_info.emit(const.PROGRESSBAR_LABEL_DOWNLOAD_RESUME)
+                    self.progress.SetInfo(const.PROGRESSBAR_LABEL_DOWNLOAD_RESUME)
                 else:
-                    self._signal_progress_parts.emit(Chapter_Index, Lecture_Index, segmentid, segmentscount)
+                    self.progress.SetParts(Chapter_Index, Lecture_Index, segmentid, segmentscount)
                 # Store last segment downloaded
                 self.LastLectureIdx = self.CurrentLectureIdx
                 self.LastSegmentIdx = segmentid
@@ -461,13 +813,13 @@ class DownloaderThread(QThread):
     # TODO: Keep currently
     def DownloadVideoPartsBuggy(self, Lecture_Download_URL, LectureIdx, Chapter, cnt, Chapter_Index, Chapter_Title,
                            Lecture_FileName, Lecture_Download_TYP, Lecture_Index, Lecture_Title, Lecture_Media_License_Token):
-        ReqHeaders = const.RequestHeaders(self.access_token_value)
+        ReqHeaders = dict(self.session.Headers)
         with requests.session() as req:
             # Get m3u8 file list
             m3u8list = m3u8.load(Lecture_Download_URL, headers=ReqHeaders)
             # If playlist contains other playlists with different resolutions get highest
             if m3u8list.is_variant:
-                bestresplaylisturl = self.GetPlaylistwithhighestResolution(m3u8list.playlists).uri
+                bestresplaylisturl = self.GetPlaylistwithhighestResolution(m3u8list.playlists, Chapter).uri
                 m3u8list = m3u8.load(bestresplaylisturl, headers=ReqHeaders)
             # Get keys
             key_url = m3u8list.keys[0].absolute_uri
@@ -493,11 +845,21 @@ class DownloaderThread(QThread):
                 # Counter 1..n
                 num = 1
                 # Write bytes into a file
-                with open(self.CoursePath + '/Filename.part' + str(num) + '.ts', 'wb') as seg_ts:
-                    # Get all chunks of current part-file
-                    for chunk in requests.request(url=download_url, stream=True, headers=ReqHeaders, method="get"):
-                        # decrypt it and write it into the file
-                        seg_ts.write(cipher.decrypt(chunk))
+                with open(self.CoursePath + '/Filename.part' + str(num) + '.ts', 'wb') as seg_ts, \
+                        req.get(download_url, stream=True, headers=ReqHeaders) as response, \
+                        bufferpool.GlobalPool().Buffer() as buffer:
+                    # Read chunks of current part-file into pooled buffer
+                    view = memoryview(buffer)
+                    rest = b""
+                    while True:
+                        count = response.raw.readinto(view)
+                        if not count:
+                            break
+                        # decrypt complete blocks and write it into the file
+                        data = rest + bytes(view[:count])
+                        aligned = len(data) - len(data) % AES.block_size
+                        seg_ts.write(cipher.decrypt(data[:aligned]))
+                        rest = data[aligned:]
                     # Counter increase for the next part number
                     num += 1
 
@@ -509,37 +871,97 @@ class DownloaderThread(QThread):
         # Download splitted video part
         self.DoDownloadVideo(Lecture_Download_TYP, Lecture_Download_URL, DownloadVideoName)
         # Update progress
-        self._signal_progress_parts.emit(Chapter_Index, Lecture_Index, 1, 1)
+        self.progress.SetParts(Chapter_Index, Lecture_Index, 1, 1)
+
+    def LectureVideoName(self, Chapter):
+        Chapter_Index = Chapter.Chapter_Index
+        Lecture_Index = Chapter.Lecture_Index
+        # Shorten Chapter title and Lecture title if too long names used:
+        Chapter_Title = self.LectureChapterTitle(Chapter)
+        Lecture_Title = Chapter.Lecture_Title[:35]
+        filename, DownloadVideoFileExt = os.path.splitext(Chapter.Lecture_FileName)
+        # Segments of a hls stream are assembled into one transport stream
+        if ".m3u8" in Chapter.Lecture_Download_URL:
+            DownloadVideoFileExt = ".ts"
+        return f"{Chapter_Index:04d}-{Lecture_Index:04d}-0000__{self.CourseTitle}__{Chapter_Title}__{Lecture_Title}{DownloadVideoFileExt}"
+
+    @staticmethod
+    def LectureChapterTitle(Chapter):
+        return curriculum.ShortChapterTitle(Chapter.Chapter_Title)
+
+    def WritePlaylists(self, LecturesList):
+        # Downloaded videos in curriculum order
+        Entries = []
+        for Lecture in LecturesList:
+            if "MEDIA" in Lecture.Lecture_Download_TYP and ".mpd" in Lecture.Lecture_Download_URL:
+                continue
+            VideoName = self.LectureVideoName(Lecture)
+            if os.path.splitext(VideoName)[1].lower() in const.COURSE_PLAYLIST_VIDEO_TYPES and \
+                    os.path.exists(self.CoursePath + os.sep + VideoName):
+                Entries.append((Lecture, VideoName))
+        # Real durations by probing the videos, else the estimation of the curriculum
+        Durations = {}
+        ffmpeg_util = ffmpeg.FFMPEGUtil()
+        if ffmpeg_util.ProbeAvailable():
+            with concurrent.futures.ThreadPoolExecutor(const.FFPROBE_WORKERS, thread_name_prefix="FFProbe") as executor:
+                Probed = executor.map(lambda Entry: ffmpeg_util.ProbeDuration(self.CoursePath + os.sep + Entry[1]), Entries)
+                Durations = dict(zip([VideoName for Lecture, VideoName in Entries], Probed))
+        Items = []
+        for Lecture, VideoName in Entries:
+            Duration = Durations.get(VideoName)
+            if Duration is None:
+                Duration = Lecture.Lecture_Time_Estimation or -1
+            Items.append((Lecture, VideoName, int(round(Duration))))
+        self.WritePlaylist(self.PlaylistFileName, Items)
+        # One playlist per chapter
+        if self.cfg.ChapterPlaylists:
+            Chapters = {}
+            for Item in Items:
+                Chapters.setdefault(Item[0].Chapter_Index, []).append(Item)
+            for Chapter_Index, ChapterItems in Chapters.items():
+                ChapterPlaylistName = const.COURSE_CHAPTER_PLAYLIST.format(
+                    Chapter_Index=Chapter_Index, Chapter_Title=self.LectureChapterTitle(ChapterItems[0][0]))
+                self.WritePlaylist(self.CoursePath + os.sep + ChapterPlaylistName, ChapterItems)
+
+    def WritePlaylist(self, PlaylistFileName, Items):
+        # Write to temporary file first and replace old playlist at once
+        PlaylistFileNameTemp = PlaylistFileName + const.DOWNLOAD_TEMP_EXT
+        with open(PlaylistFileNameTemp, "w", encoding="utf-8") as playlist:
+            playlist.write("#EXTM3U\n")
+            for Lecture, VideoName, Duration in Items:
+                playlist.write(f"#EXTINF:{Duration},{Lecture.Chapter_Title} - {Lecture.Lecture_Title}\n")
+                playlist.write(f"{VideoName}\n")
+        os.replace(PlaylistFileNameTemp, PlaylistFileName)
 
     def DownloadVideoChapter(self, LectureIdx, Chapter):
-        cnt = Chapter["cnt"]
-        Chapter_Index = Chapter["Chapter_Index"]
-        Chapter_Title = const.ReplaceSpecialChars(Chapter["Chapter_Title"])
-        Chapter_Title = re.sub('[^0-9a-zA-Z]+', '_', Chapter_Title)
-        Lecture_Index = Chapter["Lecture_Index"]
-        Lecture_Title = Chapter["Lecture_Title"]
-        Lecture_FileName = Chapter["Lecture_FileName"]
-        Lecture_Download_URL = Chapter["Lecture_Download_URL"]
-        Lecture_Download_TYP = Chapter["Lecture_Download_TYP"]
-        Lecture_Media_License_Token = Chapter["Lecture_Media_License_Token"]
+        cnt = Chapter.cnt
+        Chapter_Index = Chapter.Chapter_Index
+        Chapter_Title = self.LectureChapterTitle(Chapter)
+        Lecture_Index = Chapter.Lecture_Index
+        Lecture_Title = Chapter.Lecture_Title
+        Lecture_FileName = Chapter.Lecture_FileName
+        Lecture_Download_URL = Chapter.Lecture_Download_URL
+        Lecture_Download_TYP = Chapter.Lecture_Download_TYP
+        Lecture_Media_License_Token = Chapter.Lecture_Media_License_Token
         self.ResumeOnLastDownload = False
-        # Shorten Chapter title and Lecture title if too long names used:
-        Chapter_Title = Chapter_Title[:25]
+        # Shorten Lecture title if too long names used:
         Lecture_Title = Lecture_Title[:35]
         # Build name for downloading
-        filename, DownloadVideoFileExt = os.path.splitext(Lecture_FileName)
-        DownloadVideoName = f"{Chapter_Index:04d}-{Lecture_Index:04d}-0000__{self.CourseTitle}__{Chapter_Title}__{Lecture_Title}{DownloadVideoFileExt}"
+        DownloadVideoName = self.LectureVideoName(Chapter)
         # Download video by type
         if "MEDIA" in Lecture_Download_TYP and ".mpd" in Lecture_Download_URL:
             self.DownloadVideoParts(Lecture_Download_URL, LectureIdx, Chapter, cnt, Chapter_Index, Chapter_Title,
                                     Lecture_FileName, Lecture_Download_TYP, Lecture_Index, Lecture_Title, Lecture_Media_License_Token)
         else:
             if not self.IgnoreDownloadFileChapterSectionCauseOfResume(cnt, LectureIdx, Chapter_Index):
-                self.DoDownloadVideo(Lecture_Download_TYP, Lecture_Download_URL, DownloadVideoName)
+                if ".m3u8" in Lecture_Download_URL:
+                    self.DownloadVideoSegments(Chapter, DownloadVideoName)
+                else:
+                    self.DoDownloadVideo(Lecture_Download_TYP, Lecture_Download_URL, DownloadVideoName)
             if self.ResumeOnLastDownload:
-                self._signal_info.emit(const.PROGRESSBAR_LABEL_DOWNLOAD_RESUME)
+                self.progress.SetInfo(const.PROGRESSBAR_LABEL_DOWNLOAD_RESUME)
             else:
-                self._signal_progress_parts.emit(Chapter_Index, Lecture_Index, 1, 1)
+                self.progress.SetParts(Chapter_Index, Lecture_Index, 1, 1)
 
     def ExtractDownloadExtFromUri(self, Lecture_Download_URL):
         DownloadExt = ""
@@ -553,16 +975,22 @@ class DownloaderThread(QThread):
 
 
 class Downloader():
-    def __init__(self, accesstokenvalue):
+    def __init__(self, session):
         self.cfg = util_settings.GlobalSettings()
-        self.access_token_value = accesstokenvalue
+        self.session = session
+        # Transfer engine (util_engine) and the listener of its progress, if enabled
+        self.engine = None
+        self.listener = None
+        # Returns the callback for the size of each chunk of the transfers started by the calling thread (the callback
+        # is called from the transfer threads or the engine)
+        self.onbytes = None
 
     def DownloadFileAgainFromURL(self, url, filename):
         # Always download course video again
         if self.cfg.DownloadCourseVideoAgain:
             return True
         filename = filename.replace("\\", "/")
-        # If video does not exists download
+        # If video does not exists download (files are renamed to their final name only when complete)
         if not os.path.exists(filename):
             return True
         # File exists but no need to check file size activated
@@ -574,7 +1002,7 @@ class Downloader():
         log.info(f"Checking filesize of downloaded '{filename}' again from '{url}' ?")
         contentlen = -1
         try:
-            obj_info = urlopen(url)
+            obj_info = self.session.Open(url)
             contentlen = int(obj_info.getheader('Content-Length'))
             log.info(f"FileSize of video from url content disk is: {contentlen}")
         except Exception as error:
@@ -603,7 +1031,65 @@ class Downloader():
         else:
             return True
 
+    @staticmethod
+    def Preallocate(f, size):
+        # Reserve expected size at once to avoid fragmentation of large files
+        if size <= 0:
+            return
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+        except OSError as error:
+            log.debug(f"Can not preallocate {size} bytes: {repr(error)}")
+
+    def BytesCallback(self):
+        return None if self.onbytes is None else self.onbytes()
+
+    def StreamToFile(self, url, filename, source=None, onbytes=None):
+        # Write to a temporary name (in temp path if set) and move into place only after the size has been verified,
+        # so a half written file never exists under its final name - returns the checksum computed while streaming
+        if not self.engine is None:
+            # Retried by the caller
+            return self.engine.Call(self.engine.Fetch(url, filename, listener=self.listener, retries=0, onbytes=onbytes,
+                                                      source=source))
+        FileNameTemp = staging.StagedFileName(filename)
+        sha = checksums.NewHash()
+        req = Request(url, headers={"User-Agent": const.HEADER_DEFAULT["User-Agent"]})
+        try:
+            with self.session.Open(req, timeout=const.DOWNLOAD_TIMEOUT) as res:
+                ContentLength = int(res.getheader("Content-Length", -1))
+                Written = 0
+                # Read into a pooled buffer - waits if the memory ceiling of all transfers is reached
+                with open(FileNameTemp, "wb") as f, bufferpool.GlobalPool().Buffer() as buffer:
+                    self.Preallocate(f, ContentLength)
+                    view = memoryview(buffer)
+                    while True:
+                        count = res.readinto(view)
+                        if not count:
+                            break
+                        f.write(view[:count])
+                        sha.update(view[:count])
+                        Written += count
+                        if not onbytes is None:
+                            onbytes(count)
+                    if ContentLength >= 0 and not Written == ContentLength:
+                        raise IOError(f"Incomplete download of '{url}': {Written} of {ContentLength} bytes")
+                    f.truncate(Written)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if not source is None:
+                    source.update({"ETag": res.getheader("ETag"), "Size": Written})
+            staging.MoveIntoPlace(FileNameTemp, filename)
+        except BaseException:
+            if os.path.exists(FileNameTemp):
+                os.remove(FileNameTemp)
+            raise
+        return sha.hexdigest()
+
     def DownloadFileFast(self, url, filename, extract = False):
+        # Returns True if file has been transferred, False if existing file has been kept
         if self.DownloadFileAgainFromURL(url, filename):
             # Extract dest filename and path
             DownloadFileName = os.path.basename(filename)
@@ -611,10 +1097,91 @@ class Downloader():
             ExtractFilePath = ""
             if extract:
                 ExtractFilePath = DownloadFilePath
-            log.debug(f"Start downloading '{DownloadFileName}' file with fastdl")
-            if extract:
-                file_path = fastdl.download(url, fname=DownloadFileName, dir_prefix=DownloadFilePath,
+            Metrics = metrics.GlobalMetrics()
+            # Take identical content from store instead of downloading
+            store = None
+            if self.cfg.Deduplicate and not extract and not self.cfg.DownloadPath == "":
+                store = dedup.GlobalStore(self.cfg.DownloadPath)
+            # Probed only if content of this source has been stored before
+            if not store is None and store.HasCandidates(url):
+                hash = store.Lookup(store.ProbeSourceKey(url, self.session.Open))
+                if hash is not None:
+                    store.LinkFromStore(hash, filename)
+                    checksums.GlobalManifest(DownloadFilePath).Record(filename, hash)
+                    Metrics.Inc("dedup_hits_total")
+                    Metrics.Inc("dedup_bytes_total", os.path.getsize(filename))
+                    log.info(f"Took '{DownloadFileName}' from content store ({hash}) instead of downloading")
+                    return False
+            log.debug(f"Start downloading '{DownloadFileName}'")
+            # Etag and size of the response identify the source in the store
+            Source = {}
+            onbytes = self.BytesCallback()
+            def Transfer():
+                with Metrics.Timer("download_seconds", const.METRICS_DURATION_BUCKETS):
+                    if extract:
+                        fastdl.download(url, fname=DownloadFileName, dir_prefix=DownloadFilePath,
                                         force_download=extract, force_extraction=extract, extract=extract, extract_dir=ExtractFilePath)
-            else:
-                file_path = fastdl.download(url, fname=DownloadFileName, dir_prefix=DownloadFilePath)
-            log.debug(f"Finished downloading file '{DownloadFileName}' to '{DownloadFilePath}' [{file_path}]")
+                        return None
+                    return self.StreamToFile(url, filename, Source, onbytes)
+            hash = self.Retried(DownloadFileName, Transfer)
+            Metrics.Inc("downloads_total")
+            if os.path.exists(filename):
+                Metrics.Inc("download_bytes_total", os.path.getsize(filename))
+                # Keep checksum of the streamed content to verify the library later
+                if hash is not None:
+                    checksums.GlobalManifest(DownloadFilePath).Record(filename, hash)
+                if store is not None:
+                    store.Add(store.SourceKey(url, Source.get("Size"), Source.get("ETag")), filename, hash)
+            log.debug(f"Finished downloading file '{DownloadFileName}' to '{DownloadFilePath}'")
+            return True
+        return False
+
+    @staticmethod
+    def Retried(name, transfer):
+        # Runs transfer again after a failure, at most DOWNLOAD_RETRIES times - returns its result
+        Metrics = metrics.GlobalMetrics()
+        for attempt in range(const.DOWNLOAD_RETRIES + 1):
+            try:
+                return transfer()
+            except Exception as error:
+                if attempt >= const.DOWNLOAD_RETRIES:
+                    Metrics.Inc("download_errors_total")
+                    raise
+                Metrics.Inc("download_retries_total")
+                log.warn(f"Downloading '{name}' failed ({repr(error)}), retry {attempt + 1} of {const.DOWNLOAD_RETRIES}")
+                time.sleep(const.DOWNLOAD_RETRY_DELAY * (attempt + 1))
+
+    def DownloadSegment(self, url, filename, onbytes=None):
+        self.Retried(os.path.basename(filename), lambda: self.StreamToFile(url, filename, onbytes=onbytes))
+        return os.path.getsize(filename)
+
+    def DownloadSegments(self, items, ondone=None):
+        """ Segments (url, filename) of a stream in parallel, segments on disk from an interrupted download are kept -
+            returns the number of bytes transferred """
+        Pending = [(url, filename) for url, filename in items
+                   if self.cfg.DownloadCourseVideoAgain or not os.path.exists(filename)]
+        Done = len(items) - len(Pending)
+        Transferred = 0
+        # Resolved on the lecture thread, the segments are transferred by other threads
+        onbytes = self.BytesCallback()
+        if not self.engine is None:
+            # All segments of the lecture in flight on the engine at once, each retried there
+            for result in self.engine.Call(self.engine.FetchAll(Pending, listener=self.listener, onbytes=onbytes)):
+                if isinstance(result, BaseException):
+                    raise result
+            if not ondone is None:
+                ondone(len(items), len(items))
+            return sum(os.path.getsize(filename) for url, filename in Pending)
+        with concurrent.futures.ThreadPoolExecutor(const.HLS_SEGMENT_WORKERS, thread_name_prefix="Segment") as executor:
+            futures = [executor.submit(self.DownloadSegment, url, filename, onbytes) for url, filename in Pending]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    Transferred += future.result()
+                    Done += 1
+                    if not ondone is None:
+                        ondone(Done, len(items))
+            finally:
+                # Don't start any further segment after an error
+                for future in futures:
+                    future.cancel()
+        return Transferred
@@ -0,0 +1,406 @@
+import asyncio
+import os
+import ssl
+import threading
+import time
+import util_bufferpool as bufferpool
+import util_checksums as checksums
+import util_constants as const
+import util_logging as log
+import util_metrics as metrics
+import util_staging as staging
+from urllib.parse import urljoin, urlparse
+
+REDIRECT_STATUS = [301, 302, 303, 307, 308]
+
+
+class Connection():
+    """ Keep alive connection to one host of the transfer engine """
+
+    def __init__(self, key, reader, writer):
+        self.Key = key
+        self.Reader = reader
+        self.Writer = writer
+        # Set if the connection has been used before, a closed idle connection is only noticed on the next request
+        self.Reused = False
+        self.Reusable = True
+
+    def Close(self):
+        self.Reusable = False
+        self.Writer.close()
+
+
+class ConnectionPool():
+    """ Idle connections by scheme, host and port - never more than perhost connections to the same host """
+
+    def __init__(self, perhost):
+        self.PerHost = perhost
+        self.Idle = {}
+        self.Limits = {}
+        self.SSL = ssl.create_default_context()
+
+    def Limit(self, key):
+        if key not in self.Limits:
+            self.Limits[key] = asyncio.Semaphore(self.PerHost)
+        return self.Limits[key]
+
+    async def Acquire(self, scheme, host, port, timeout):
+        key = (scheme, host, port)
+        await self.Limit(key).acquire()
+        Idle = self.Idle.get(key) or []
+        while Idle:
+            conn = Idle.pop()
+            if not conn.Reader.at_eof():
+                conn.Reused = True
+                return conn
+            conn.Close()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=self.SSL if scheme == "https" else None,
+                                        limit=const.ENGINE_CHUNK_SIZE), timeout)
+        except BaseException:
+            self.Limit(key).release()
+            raise
+        return Connection(key, reader, writer)
+
+    def Release(self, conn):
+        if conn.Reusable and not conn.Reader.at_eof():
+            self.Idle.setdefault(conn.Key, []).append(conn)
+        else:
+            conn.Close()
+        self.Limit(conn.Key).release()
+
+    def Close(self):
+        for Idle in self.Idle.values():
+            for conn in Idle:
+                conn.Close()
+        self.Idle = {}
+
+
+class EngineResponse():
+    """ Status, headers and body of a response - the body must be read or discarded, then released """
+
+    def __init__(self, pool, conn, url, status, headers, timeout):
+        self.Pool = pool
+        self.Connection = conn
+        self.URL = url
+        self.Status = status
+        # Header names in lower case
+        self.Headers = headers
+        self.Timeout = timeout
+        self.Released = False
+        if headers.get("connection", "").lower() == "close":
+            conn.Reusable = False
+
+    def ContentLength(self):
+        return int(self.Headers.get("content-length", -1))
+
+    async def Read(self, count):
+        return await asyncio.wait_for(self.Connection.Reader.read(count), self.Timeout)
+
+    async def ReadLine(self):
+        return await asyncio.wait_for(self.Connection.Reader.readline(), self.Timeout)
+
+    async def Chunks(self, size=const.ENGINE_CHUNK_SIZE):
+        # Body by content length, chunked transfer encoding or until the server closes the connection
+        if "chunked" in self.Headers.get("transfer-encoding", "").lower():
+            while True:
+                ChunkSize = int((await self.ReadLine()).split(b";")[0].strip() or b"0", 16)
+                if ChunkSize == 0:
+                    # Trailers until the empty line
+                    while (await self.ReadLine()).strip():
+                        pass
+                    return
+                while ChunkSize > 0:
+                    data = await self.Read(min(size, ChunkSize))
+                    if not data:
+                        raise IOError(f"Connection closed within chunk of '{self.URL}'")
+                    ChunkSize -= len(data)
+                    yield data
+                await self.ReadLine()
+        elif "content-length" in self.Headers:
+            Remaining = self.ContentLength()
+            while Remaining > 0:
+                data = await self.Read(min(size, Remaining))
+                if not data:
+                    raise IOError(f"Connection closed with {Remaining} bytes missing of '{self.URL}'")
+                Remaining -= len(data)
+                yield data
+        else:
+            self.Connection.Reusable = False
+            while True:
+                data = await self.Read(size)
+                if not data:
+                    return
+                yield data
+
+    async def Body(self):
+        return b"".join([data async for data in self.Chunks()])
+
+    async def Discard(self):
+        # Small bodies (redirects, errors) are read so the connection can be reused
+        if self.ContentLength() < 0 or self.ContentLength() > const.ENGINE_CHUNK_SIZE:
+            self.Connection.Reusable = False
+        else:
+            async for data in self.Chunks():
+                pass
+        self.Release()
+
+    def Release(self):
+        if not self.Released:
+            self.Released = True
+            self.Pool.Release(self.Connection)
+
+
+class TransferEngine():
+    """ Downloads on one asyncio event loop - hundreds of videos, segments and assets in flight without a thread each.
+        The loop runs on its own thread, so the downloader threads of the ui and the headless command line use it alike """
+
+    def __init__(self, inflight=const.ENGINE_MAX_IN_FLIGHT, perhost=const.ENGINE_CONNECTIONS_PER_HOST):
+        self.MaxInFlight = inflight
+        self.PerHost = perhost
+        # Only the user agent - videos, segments and assets come from signed cdn urls, so the headers and cookies of the
+        # account session (util_session.Session) are not sent, api requests always go through the session
+        self.Headers = {"User-Agent": const.HEADER_DEFAULT["User-Agent"]}
+        self.Lock = threading.Lock()
+        self.Loop = None
+        self.Thread = None
+        # Pool and limit belong to the loop they have been created on
+        self.StateLoop = None
+        self.Pool = None
+        self.InFlight = None
+        self.metrics = metrics.GlobalMetrics()
+
+    def State(self):
+        loop = asyncio.get_running_loop()
+        if not self.StateLoop is loop:
+            self.StateLoop = loop
+            self.Pool = ConnectionPool(self.PerHost)
+            self.InFlight = asyncio.Semaphore(self.MaxInFlight)
+        return self.Pool, self.InFlight
+
+    def Start(self):
+        with self.Lock:
+            if self.Loop is None:
+                self.Loop = asyncio.new_event_loop()
+                self.Thread = threading.Thread(target=self.Loop.run_forever, name=const.ENGINE_THREAD_NAME, daemon=True)
+                self.Thread.start()
+        return self
+
+    def Submit(self, coro):
+        # From any thread - returns a concurrent.futures.Future of the coroutine running on the engine thread
+        self.Start()
+        return asyncio.run_coroutine_threadsafe(coro, self.Loop)
+
+    def Call(self, coro):
+        # From any thread but the engine thread - waits for the result
+        return self.Submit(coro).result()
+
+    async def Open(self, url, headers=None, timeout=const.DOWNLOAD_TIMEOUT, method="GET"):
+        """ Response of a request, redirects are followed - caller reads the body and releases it """
+        Pool, InFlight = self.State()
+        RequestHeaders = dict(self.Headers)
+        RequestHeaders.update(headers or {})
+        for redirect in range(const.ENGINE_MAX_REDIRECTS + 1):
+            parsed = urlparse(url)
+            port = parsed.port or (443 if parsed.scheme == "https" else 80)
+            path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+            lines = [f"{method} {path} HTTP/1.1", f"Host: {parsed.netloc}", "Connection: keep-alive", "Accept-Encoding: identity"]
+            lines += [f"{name}: {value}" for name, value in RequestHeaders.items()
+                      if name.lower() not in ["host", "connection", "accept-encoding"]]
+            Request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+            start = time.time()
+            while True:
+                conn = await Pool.Acquire(parsed.scheme, parsed.hostname, port, timeout)
+                try:
+                    conn.Writer.write(Request)
+                    await conn.Writer.drain()
+                    StatusLine = await asyncio.wait_for(conn.Reader.readline(), timeout)
+                    # Idle connection has been closed by the server meanwhile - once again on a new one
+                    if not StatusLine and conn.Reused:
+                        conn.Close()
+                        Pool.Release(conn)
+                        continue
+                    parts = StatusLine.decode("latin-1").split(" ", 2)
+                    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+                        raise IOError(f"Invalid response from '{url}': {StatusLine[:80]}")
+                    Status = int(parts[1])
+                    Headers = {}
+                    while True:
+                        line = await asyncio.wait_for(conn.Reader.readline(), timeout)
+                        if not line.strip():
+                            break
+                        name, sep, value = line.decode("latin-1").partition(":")
+                        Headers[name.strip().lower()] = value.strip()
+                except BaseException as error:
+                    conn.Close()
+                    Pool.Release(conn)
+                    if not isinstance(error, asyncio.CancelledError):
+                        self.metrics.Inc("http_errors_total")
+                    raise
+                break
+            self.metrics.Inc("http_requests_total")
+            self.metrics.Inc("http_responses_total", status=Status)
+            self.metrics.Observe("http_request_seconds", time.time() - start)
+            response = EngineResponse(Pool, conn, url, Status, Headers, timeout)
+            if Status in REDIRECT_STATUS and "location" in Headers:
+                await response.Discard()
+                url = urljoin(url, Headers["location"])
+                continue
+            return response
+        raise IOError(f"Too many redirects for '{url}'")
+
+    async def Fetch(self, url, filename, headers=None, listener=None, retries=const.DOWNLOAD_RETRIES,
+                    timeout=const.DOWNLOAD_TIMEOUT, onbytes=None, source=None):
+        """ Streams url into filename like Downloader.StreamToFile, onbytes is called with the size of each chunk and
+            source (a dict) gets etag and size of the response - returns the checksum of the content """
+        Pool, InFlight = self.State()
+        async with InFlight:
+            for attempt in range(retries + 1):
+                try:
+                    return await self.FetchOnce(url, filename, headers, listener, timeout, onbytes, source)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    if attempt >= retries:
+                        if not listener is None:
+                            listener.OnTransferFailed(filename, repr(error))
+                        raise
+                    self.metrics.Inc("download_retries_total")
+                    log.warn(f"Downloading '{os.path.basename(filename)}' failed ({repr(error)}), retry {attempt + 1} of {retries}")
+                    await asyncio.sleep(const.DOWNLOAD_RETRY_DELAY * (attempt + 1))
+
+    @staticmethod
+    async def AcquireBuffer():
+        # Pooled buffer without blocking the loop - waits while the memory ceiling of all transfers is reached
+        Pool = bufferpool.GlobalPool()
+        return Pool, await Pool.AcquireAsync()
+
+    @staticmethod
+    def Sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    async def FetchOnce(self, url, filename, headers, listener, timeout, onbytes=None, source=None):
+        FileNameTemp = staging.StagedFileName(filename)
+        sha = checksums.NewHash()
+        # Buffer is taken before the request, so a waiting transfer does not hold a connection
+        BufferPool, buffer = await self.AcquireBuffer()
+        try:
+            return await self.FetchInto(url, filename, FileNameTemp, sha, memoryview(buffer), headers, listener, timeout,
+                                        onbytes, source)
+        finally:
+            BufferPool.Release(buffer)
+
+    async def FetchInto(self, url, filename, FileNameTemp, sha, view, headers, listener, timeout, onbytes, source=None):
+        response = await self.Open(url, headers, timeout)
+        try:
+            if not response.Status == 200:
+                raise IOError(f"HTTP {response.Status} for '{url}'")
+            ContentLength = response.ContentLength()
+            if not listener is None:
+                listener.OnTransferStarted(filename, ContentLength)
+            Written = 0
+            Filled = 0
+            Reported = time.time()
+            # Chunks are collected in the pooled buffer, each full buffer is written by the executor, so a slow disk does not
+            # stall the other transfers on the loop
+            loop = asyncio.get_running_loop()
+            with await loop.run_in_executor(None, open, FileNameTemp, "wb") as f:
+                async for data in response.Chunks():
+                    if Filled + len(data) > len(view):
+                        await loop.run_in_executor(None, f.write, view[:Filled])
+                        Filled = 0
+                    if len(data) > len(view):
+                        await loop.run_in_executor(None, f.write, data)
+                    else:
+                        view[Filled:Filled + len(data)] = data
+                        Filled += len(data)
+                    sha.update(data)
+                    Written += len(data)
+                    if not onbytes is None:
+                        onbytes(len(data))
+                    if not listener is None and time.time() - Reported >= const.ENGINE_PROGRESS_INTERVAL:
+                        Reported = time.time()
+                        listener.OnTransferProgress(filename, Written, ContentLength)
+                await loop.run_in_executor(None, f.write, view[:Filled])
+                if ContentLength >= 0 and not Written == ContentLength:
+                    raise IOError(f"Incomplete download of '{url}': {Written} of {ContentLength} bytes")
+                await loop.run_in_executor(None, self.Sync, f)
+            response.Release()
+            await loop.run_in_executor(None, staging.MoveIntoPlace, FileNameTemp, filename)
+        except BaseException:
+            if not response.Released:
+                response.Connection.Reusable = False
+                response.Release()
+            if os.path.exists(FileNameTemp):
+                os.remove(FileNameTemp)
+            raise
+        if not listener is None:
+            listener.OnTransferDone(filename, Written)
+        if not source is None:
+            source.update({"ETag": response.Headers.get("etag"), "Size": Written})
+        return sha.hexdigest()
+
+    async def FetchAll(self, items, headers=None, listener=None, onbytes=None):
+        # All (url, filename) at once (eg. the segments of a stream), as many in flight as allowed and as the pooled buffers
+        # of the memory ceiling permit - exceptions are returned, not raised
+        return await asyncio.gather(*[self.Fetch(url, filename, headers, listener, onbytes=onbytes) for url, filename in items],
+                                    return_exceptions=True)
+
+
+class QtBridge():
+    """ Forwards the transfers of the engine into the progress and _signal_* interface of a downloader thread,
+        so the main window does not need to know about the engine """
+
+    def __init__(self, thread):
+        self.Thread = thread
+        self.Lock = threading.Lock()
+        # Transferred and total bytes by file name of the running transfers
+        self.Running = {}
+        self.Reported = 0
+
+    def OnTransferStarted(self, filename, total):
+        with self.Lock:
+            self.Running[filename] = (0, max(total, 0))
+        self.Report()
+
+    def OnTransferProgress(self, filename, transferred, total):
+        with self.Lock:
+            self.Running[filename] = (transferred, max(total, transferred))
+        self.Report()
+
+    def OnTransferDone(self, filename, size):
+        with self.Lock:
+            self.Running.pop(filename, None)
+        self.Report(True)
+
+    def OnTransferFailed(self, filename, error):
+        with self.Lock:
+            self.Running.pop(filename, None)
+        self.Thread._signal_info.emit(f"Download of '{os.path.basename(filename)}' failed: {error}")
+
+    def Report(self, force=False):
+        # Progress is polled by the ui, so it is only replaced at the interval
+        now = time.time()
+        with self.Lock:
+            if not force and now - self.Reported < const.ENGINE_PROGRESS_INTERVAL or not self.Running:
+                return
+            self.Reported = now
+            done = sum(transferred for transferred, total in self.Running.values())
+            total = sum(total for transferred, total in self.Running.values())
+            count = len(self.Running)
+        self.Thread.progress.SetInfo(const.ENGINE_PROGRESS_LABEL.format(count=count, done=done / 1024 ** 2, total=total / 1024 ** 2))
+
+
+# One engine for all downloads, its loop runs on the first use
+Engine = None
+EngineLock = threading.Lock()
+
+
+def GlobalEngine():
+    global Engine
+    with EngineLock:
+        if Engine is None:
+            Engine = TransferEngine()
+        return Engine
@@ -1,14 +1,21 @@
+import concurrent.futures
 import datetime as dt
 import glob
+import json
 import os
+import queue
 import shlex
 import subprocess
+import threading
 import time
 import traceback
 import util_constants as const
 import util_downloader as downloader
 import util_logging as log
+import util_metrics as metrics
 import util_overview as overview
+import util_session as session
+import util_profiling as profiling
 import util_settings as settings
 from typing import Union
 from PySide2.QtCore import QThread, Signal, QSortFilterProxyModel
@@ -59,7 +66,7 @@ class CourseSelection(QDialog):
         self.cfg = settings.GlobalSettings()
         self.ffmpeg_util = FFMPEGUtil()
         self.access_token_value = accesstokenvalue
-        self.overview = overview.Overview(self.access_token_value)
+        self.overview = overview.Overview(session.GlobalSession(self.access_token_value))
         self.Selected = None
         self.initUI()
 
@@ -119,6 +126,9 @@ class FFMPEGUtil():
     def FFMPEGUtilFullFilePath(self):
         return self.FFMPEGUtilFullPath() + os.sep + const.FFMPEG_TOOL_FILENAME
 
+    def FFPROBEUtilFullFilePath(self):
+        return self.FFMPEGUtilFullPath() + os.sep + const.FFPROBE_TOOL_FILENAME
+
     def Available(self):
         if not os.path.exists(const.FFMPEGDownloadPath()):
             return False
@@ -126,6 +136,105 @@ class FFMPEGUtil():
             return False
         return True
 
+    def ProbeAvailable(self):
+        return os.path.exists(self.FFPROBEUtilFullFilePath())
+
+    def ProbeDuration(self, filename):
+        # Duration of a video in seconds or None if unknown
+        args = [arg.format(input=filename) for arg in const.FFPROBE_DURATION_ARGS]
+        try:
+            result = subprocess.run([self.FFPROBEUtilFullFilePath()] + args, capture_output=True, text=True)
+            return float(result.stdout.strip())
+        except Exception as error:
+            log.debug(f"Can not probe duration of '{filename}': {repr(error)}")
+            return None
+
+    def ProbeStreams(self, filename):
+        # Codec, resolution, time base and audio layout of all streams of a video or None if unknown
+        args = [arg.format(input=filename) for arg in const.FFPROBE_STREAMS_ARGS]
+        try:
+            result = subprocess.run([self.FFPROBEUtilFullFilePath()] + args, capture_output=True, text=True, check=True)
+            return json.loads(result.stdout)["streams"]
+        except Exception as error:
+            log.debug(f"Can not probe streams of '{filename}': {repr(error)}")
+            return None
+
+
+class FFMPEGPipeline():
+    """ Remuxes downloaded videos in background into concat ready pieces, so combining only has to concatenate """
+
+    def __init__(self, coursepath):
+        self.CoursePath = coursepath
+        self.PreparedPath = PreparedPath(coursepath)
+        self.ffmpegutil = FFMPEGUtil()
+        self.Queue = queue.Queue()
+        self.Worker = None
+
+    def Start(self):
+        if not os.path.exists(self.PreparedPath):
+            os.makedirs(self.PreparedPath)
+        self.Worker = threading.Thread(target=self.Process, daemon=True)
+        self.Worker.start()
+
+    def Enqueue(self, VideoFileName):
+        if self.Worker is not None:
+            self.Queue.put(VideoFileName)
+
+    def Finish(self, canceled=False):
+        if self.Worker is None:
+            return
+        # Drop waiting videos if canceled, they will be prepared on combine
+        if canceled:
+            try:
+                while True:
+                    self.Queue.get_nowait()
+            except queue.Empty:
+                pass
+        self.Queue.put(None)
+        self.Worker.join()
+        self.Worker = None
+
+    def Process(self):
+        while True:
+            VideoFileName = self.Queue.get()
+            if VideoFileName is None:
+                break
+            try:
+                self.Prepare(VideoFileName)
+            except Exception as error:
+                log.error(f"An error has been occured on preparing video '{VideoFileName}' for combining:")
+                log.error(traceback.format_exc())
+
+    def Prepare(self, VideoFileName):
+        PreparedFileNameFull = PreparedFileName(self.CoursePath, VideoFileName)
+        if IsPrepared(self.CoursePath, VideoFileName):
+            return PreparedFileNameFull
+        VideoFileNameFull = self.CoursePath + "/" + VideoFileName
+        # Remux to a temporary name first - only complete pieces are used for combining
+        PreparedFileNameTemp = PreparedFileNameFull + ".part"
+        args = [arg.format(input=VideoFileNameFull, output=PreparedFileNameTemp) for arg in const.FFMPEG_REMUX_ARGS]
+        log.debug(f"Preparing video '{VideoFileName}' for combining")
+        with metrics.GlobalMetrics().Timer("ffmpeg_job_seconds", const.METRICS_DURATION_BUCKETS, job="remux"):
+            subprocess.run([self.ffmpegutil.FFMPEGUtilFullFilePath()] + args, check=True, capture_output=True)
+        os.replace(PreparedFileNameTemp, PreparedFileNameFull)
+        return PreparedFileNameFull
+
+
+def PreparedPath(CoursePath):
+    return CoursePath + "/" + const.FFMPEG_PREPARED_PATH
+
+
+def PreparedFileName(CoursePath, VideoFileName):
+    return PreparedPath(CoursePath) + "/" + os.path.splitext(VideoFileName)[0] + const.FFMPEG_PREPARED_EXT
+
+
+def IsPrepared(CoursePath, VideoFileName):
+    # Prepared piece must be newer than the downloaded video
+    PreparedFileNameFull = PreparedFileName(CoursePath, VideoFileName)
+    if not os.path.exists(PreparedFileNameFull):
+        return False
+    return os.path.getmtime(PreparedFileNameFull) >= os.path.getmtime(CoursePath + "/" + VideoFileName)
+
 
 class FFMPEGDownloadInstallThread(QThread):
     _signal_info: Union[Signal, Signal] = Signal(str)
@@ -134,7 +243,7 @@ class FFMPEGDownloadInstallThread(QThread):
 
     def __init__(self, mw, accesstokenvalue):
         super(FFMPEGDownloadInstallThread, self).__init__(mw)
-        self.downloader = downloader.Downloader(accesstokenvalue)
+        self.downloader = downloader.Downloader(session.GlobalSession(accesstokenvalue))
         self.ffmpeg = FFMPEGUtil()
 
     def run(self):
@@ -169,7 +278,7 @@ class FFMPEGThread(QThread):
         super(FFMPEGThread, self).__init__(mw)
         self.canceled = False
         self.cfg = settings.GlobalSettings()
-        self.overview = overview.Overview(accesstokenvalue)
+        self.overview = overview.Overview(session.GlobalSession(accesstokenvalue))
         self.ffmpegutil = FFMPEGUtil()
         self.course = selectedcourse
 
@@ -223,6 +332,60 @@ class FFMPEGThread(QThread):
         if not self.canceled:
             self._signal_info.emit(f"Combining all videos of course '{CourseTitle}' finished!")
 
+    def ConcatPreparedVideos(self, Videos, CombinedFileName, CourseTitle, CoursePath):
+        start = time.time()
+        Videos = [Video for Video in Videos if not Video == CombinedFileName]
+        VideoCount = len(Videos)
+        # Prepare videos which have not been prepared while downloading
+        pipeline = FFMPEGPipeline(CoursePath)
+        if not os.path.exists(pipeline.PreparedPath):
+            os.makedirs(pipeline.PreparedPath)
+        PreparedVideos = []
+        for VideoIdx in range(VideoCount):
+            Video = Videos[VideoIdx]
+            if not IsPrepared(CoursePath, Video):
+                self._signal_info.emit(f"Preparing video {VideoIdx + 1} of {VideoCount} for combining ...")
+            PreparedVideos.append(pipeline.Prepare(Video))
+            if self.canceled:
+                return
+        # Pieces differing in codec, resolution, time base or audio layout can not be concatenated without re-encoding
+        if not self.PreparedVideosMatch(PreparedVideos):
+            self._signal_info.emit(f"Videos differ in their formats - combining with re-encoding ...")
+            self.ExecuteFFMPEG(Videos, CombinedFileName, CourseTitle)
+            return
+        # Write concat list and concatenate all prepared pieces
+        PlaylistFileName = pipeline.PreparedPath + "/" + const.FFMPEG_PLAYLIST_NAME
+        with open(PlaylistFileName, "w", encoding="utf-8") as playlist:
+            for PreparedVideo in PreparedVideos:
+                playlist.write(f"file '{os.path.basename(PreparedVideo)}'\n")
+        self._signal_info.emit(f"Concatenating {VideoCount} prepared videos - Please wait ...")
+        args = [arg.format(playlist=PlaylistFileName, output=CombinedFileName) for arg in const.FFMPEG_CONCAT_ARGS]
+        ff = FfmpegProgress([self.ffmpegutil.FFMPEGUtilFullFilePath()] + args)
+        for progress in ff.run_command_with_progress():
+            ProgressPercent = int(progress)
+            VideosProcessed = int(VideoCount * ProgressPercent / 100)
+            if not VideosProcessed == 0:
+                prstime = self.calcProcessTime(start, VideosProcessed, VideoCount)
+                self._signal_progress.emit(ProgressPercent, VideosProcessed, VideoCount, CourseTitle, prstime)
+            if self.canceled:
+                break
+        if not self.canceled:
+            self._signal_info.emit(f"Combining all videos of course '{CourseTitle}' finished!")
+
+    def PreparedVideosMatch(self, PreparedVideos):
+        if not self.ffmpegutil.ProbeAvailable():
+            log.warn(f"ffprobe is not available, so the videos are combined with re-encoding")
+            return False
+        self._signal_info.emit(f"Checking formats of {len(PreparedVideos)} prepared videos ...")
+        with concurrent.futures.ThreadPoolExecutor(const.FFPROBE_WORKERS, thread_name_prefix="FFProbe") as executor:
+            Streams = list(executor.map(self.ffmpegutil.ProbeStreams, PreparedVideos))
+        for PreparedVideo, VideoStreams in zip(PreparedVideos, Streams):
+            if VideoStreams is None or not VideoStreams == Streams[0]:
+                log.warn(f"Format of '{os.path.basename(PreparedVideo)}' differs from the first video "
+                         f"({VideoStreams} instead of {Streams[0]}), so the videos are combined with re-encoding")
+                return False
+        return True
+
     def CombineVideos(self, CourseTitle, CoursePath):
         CourseTitle = const.ReplaceSpecialChars(CourseTitle)
         CombinedFileName = f"0000-0000-0000-{CourseTitle}" + const.COURSE_COMBINE_FILENAME_EXT
@@ -235,16 +398,23 @@ class FFMPEGThread(QThread):
         # Scan for all types of videos and build a combine list for ffmpeg:
         os.chdir(CoursePath)
         Videos = []
-        for type in const.COURSE_COMPLETE_SCAN_FOR_FILETYPES:
-            this_type_files = glob.glob(type)
-            Videos += this_type_files
+        with profiling.Span("Scan videos"):
+            for type in const.COURSE_COMPLETE_SCAN_FOR_FILETYPES:
+                this_type_files = glob.glob(type)
+                Videos += this_type_files
         # Sort list by name
         self._signal_info.emit(f"Sorting videos ...")
         Videos_Sorted = sorted(Videos)
         # Execute FFMPEG and concat all files to one
-        self.ExecuteFFMPEG(Videos_Sorted, CombinedFileName, CourseTitle)
+        if self.cfg.CombinePipeline:
+            with metrics.GlobalMetrics().Timer("ffmpeg_job_seconds", const.METRICS_DURATION_BUCKETS, job="concat"):
+                self.ConcatPreparedVideos(Videos_Sorted, CombinedFileName, CourseTitle, CoursePath)
+        else:
+            with metrics.GlobalMetrics().Timer("ffmpeg_job_seconds", const.METRICS_DURATION_BUCKETS, job="combine"):
+                self.ExecuteFFMPEG(Videos_Sorted, CombinedFileName, CourseTitle)
 
 
+    @profiling.Profiled("combine")
     def run(self):
         # Store original path
         OriginalPath = const.GlobalPaths().AppDataPath()
@@ -269,5 +439,6 @@ class FFMPEGThread(QThread):
                 self._signal_canceled.emit()
             else:
                 self._signal_done.emit()
+        metrics.GlobalMetrics().WriteSnapshot(True)
         # Re-store original path
         os.chdir(OriginalPath)
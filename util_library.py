@@ -0,0 +1,343 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import pickle
+import re
+import select
+import struct
+import threading
+import time
+import traceback
+import util_constants as const
+import util_logging as log
+import util_settings
+
+# inotify events of interest (see <sys/inotify.h>)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+IN_COURSE_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ATTRIB | IN_DELETE_SELF
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def CourseIdFromFolder(folder):
+    # Course id is stored as hashtag in pathname
+    found = re.findall(r'#(.+?)#', os.path.basename(folder))
+    if len(found) == 0 or not found[0].isdigit():
+        return 0
+    return int(found[0])
+
+
+def CourseTitleFromFolder(folder):
+    # Title from the stored course info, otherwise from the folder name
+    CourseInfoFile = folder + "/" + const.APP_REST_COURSE_INFO_FILE_NAME
+    try:
+        if os.path.exists(CourseInfoFile):
+            with open(CourseInfoFile, encoding="utf-8") as f:
+                return json.load(f)[const.UDEMY_API_FIELD_COURSE_TITLE]
+        CourseIdFile = folder + "/" + const.COURSE_ID_FILE_NAME
+        if os.path.exists(CourseIdFile):
+            with open(CourseIdFile, "rb") as f:
+                return pickle.load(f)["Title"]
+    except Exception as error:
+        log.debug(f"Can not read title of course '{folder}': {repr(error)}")
+    return re.sub(r'-?#.+?#', '', os.path.basename(folder))
+
+
+def SubFolders(folder):
+    # All folders below a course folder (eg. the assets of its articles)
+    Folders = []
+    for entry in os.scandir(folder):
+        if entry.is_dir(follow_symlinks=False):
+            Folders.append(entry.path.replace("\\", "/"))
+            Folders += SubFolders(entry.path)
+    return Folders
+
+
+def FolderSignature(folder):
+    # Directory mtime changes whenever a file is created, removed or renamed into place - latest of the course folder
+    # and all folders below it
+    return max(os.stat(path).st_mtime_ns for path in [folder] + SubFolders(folder))
+
+
+def ScanCourse(folder):
+    folder = folder.replace("\\", "/")
+    CourseId = CourseIdFromFolder(folder)
+    if CourseId == 0:
+        return None
+    Course = {"Id": CourseId, "Title": CourseTitleFromFolder(folder), "Path": folder,
+              "Files": 0, "Videos": 0, "Bytes": 0, "Modified": 0.0, "Signature": FolderSignature(folder)}
+    # Files of the folders below (eg. assets) count for the size of the course as well
+    for path in [folder] + SubFolders(folder):
+        for entry in os.scandir(path):
+            if entry.is_file() and not entry.name.endswith(const.DOWNLOAD_TEMP_EXT):
+                stat = entry.stat()
+                Course["Files"] += 1
+                Course["Bytes"] += stat.st_size
+                Course["Modified"] = max(Course["Modified"], stat.st_mtime)
+                if path == folder and os.path.splitext(entry.name)[1].lower() in const.COURSE_PLAYLIST_VIDEO_TYPES:
+                    Course["Videos"] += 1
+    return Course
+
+
+class LibraryIndex():
+    """ Index of all courses in the download root, kept in memory and in a hidden file of the root """
+
+    def __init__(self, rootpath):
+        self.RootPath = rootpath.replace("\\", "/")
+        self.FileName = self.RootPath + "/" + const.LIBRARY_INDEX_FILE_NAME
+        self.Lock = threading.Lock()
+        self.Courses = {}
+        self.Load()
+
+    def Load(self):
+        if os.path.exists(self.FileName):
+            try:
+                with open(self.FileName, encoding="utf-8") as f:
+                    self.Courses = {Course["Path"]: Course for Course in json.load(f)["courses"]}
+            except Exception as error:
+                log.error(f"An error has been occured on loading library index '{self.FileName}':")
+                log.error(traceback.format_exc())
+                self.Courses = {}
+
+    def Save(self):
+        with self.Lock:
+            data = {"root": self.RootPath, "updated": time.time(), "courses": list(self.Courses.values())}
+        FileNameTemp = self.FileName + const.DOWNLOAD_TEMP_EXT
+        try:
+            with open(FileNameTemp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+            os.replace(FileNameTemp, self.FileName)
+        except OSError as error:
+            log.warn(f"Can not write library index '{self.FileName}': {repr(error)}")
+
+    def CourseFolders(self):
+        return [entry.path.replace("\\", "/") for entry in os.scandir(self.RootPath)
+                if entry.is_dir() and not entry.name.startswith(".")]
+
+    def Update(self, folder, save=True):
+        # Rescan one course folder, removes it from the index if it is gone
+        folder = folder.replace("\\", "/")
+        try:
+            Course = ScanCourse(folder) if os.path.isdir(folder) else None
+        except OSError as error:
+            log.debug(f"Can not scan course folder '{folder}': {repr(error)}")
+            Course = None
+        with self.Lock:
+            if Course is None:
+                self.Courses.pop(folder, None)
+            else:
+                self.Courses[folder] = Course
+        if save:
+            self.Save()
+
+    def Refresh(self):
+        # Only folders which are new or whose signature changed are scanned again
+        if not os.path.isdir(self.RootPath):
+            return False
+        changed = False
+        folders = self.CourseFolders()
+        with self.Lock:
+            removed = [path for path in self.Courses if path not in folders]
+            for path in removed:
+                del self.Courses[path]
+                changed = True
+        for folder in folders:
+            with self.Lock:
+                Course = self.Courses.get(folder)
+            try:
+                if Course is None or not Course["Signature"] == FolderSignature(folder):
+                    self.Update(folder, False)
+                    changed = True
+            except OSError:
+                self.Update(folder, False)
+                changed = True
+        if changed:
+            self.Save()
+        return changed
+
+    def CourseInfos(self):
+        # Same format as Overview.BuildCourseInfos
+        with self.Lock:
+            Courses = [dict(Course) for Course in self.Courses.values()]
+        return sorted(Courses, key=lambda Course: Course["Title"].lower())
+
+
+class LibraryWatcher():
+    """ Keeps a library index current - inotify on linux, polling of the folder signatures otherwise """
+
+    def __init__(self, index):
+        self.Index = index
+        self.Thread = None
+        self.Stopped = threading.Event()
+        self.Pending = set()
+        self.Watches = {}
+        self.libc = None
+
+    def Start(self):
+        if self.Thread is not None:
+            return
+        self.Stopped.clear()
+        self.Thread = threading.Thread(target=self.Run, name="LibraryWatcher", daemon=True)
+        self.Thread.start()
+
+    def Stop(self):
+        self.Stopped.set()
+        if self.Thread is not None:
+            self.Thread.join()
+            self.Thread = None
+
+    def Run(self):
+        try:
+            self.Index.Refresh()
+            fd = self.InitInotify()
+            if fd is None:
+                self.RunPolling()
+            else:
+                try:
+                    self.RunInotify(fd)
+                finally:
+                    os.close(fd)
+        except Exception as error:
+            log.error(f"An error has been occured on watching library '{self.Index.RootPath}':")
+            log.error(traceback.format_exc())
+
+    def RunPolling(self):
+        log.info(f"Watching library '{self.Index.RootPath}' by polling")
+        while not self.Stopped.wait(const.LIBRARY_POLL_INTERVAL):
+            self.Index.Refresh()
+
+    def InitInotify(self):
+        if not hasattr(select, "poll") or not os.uname().sysname == "Linux":
+            return None
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as error:
+            log.debug(f"inotify not available: {repr(error)}")
+            return None
+        if fd < 0:
+            return None
+        self.AddWatch(fd, self.Index.RootPath, IN_ROOT_MASK)
+        for folder in self.Index.CourseFolders():
+            self.AddCourseWatches(fd, folder)
+        log.info(f"Watching library '{self.Index.RootPath}' with inotify")
+        return fd
+
+    def AddWatch(self, fd, path, mask):
+        wd = self.libc.inotify_add_watch(fd, os.fsencode(path), mask)
+        if wd < 0:
+            log.debug(f"Can not watch '{path}': errno {ctypes.get_errno()}")
+            return
+        self.Watches[wd] = path
+
+    def AddCourseWatches(self, fd, folder):
+        # Course folder and all folders below it
+        self.AddWatch(fd, folder, IN_COURSE_MASK)
+        try:
+            for path in SubFolders(folder):
+                self.AddWatch(fd, path, IN_COURSE_MASK)
+        except OSError as error:
+            log.debug(f"Can not watch folders below '{folder}': {repr(error)}")
+
+    def CourseFolderOf(self, path):
+        # Course folder of a watched folder below it
+        return self.Index.RootPath + "/" + path[len(self.Index.RootPath) + 1:].split("/")[0]
+
+    def RunInotify(self, fd):
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        while not self.Stopped.is_set():
+            # Wait until events stop for a moment, so a running download does not rescan for each file
+            if poller.poll(const.LIBRARY_WATCH_DEBOUNCE * 1000):
+                self.ReadEvents(fd)
+                continue
+            self.FlushPending()
+
+    def ReadEvents(self, fd):
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0"))
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.Pending.add(None)
+                continue
+            path = self.Watches.get(wd)
+            if path is None:
+                continue
+            # Watch has been removed (eg. folder deleted), the descriptor may be reused by the kernel
+            if mask & IN_IGNORED:
+                del self.Watches[wd]
+                if not path == self.Index.RootPath:
+                    self.Pending.add(self.CourseFolderOf(path))
+                continue
+            if path == self.Index.RootPath:
+                if name.startswith(".") or name == "":
+                    continue
+                folder = path + "/" + name
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.AddCourseWatches(fd, folder)
+                self.Pending.add(folder)
+            else:
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.AddCourseWatches(fd, path + "/" + name)
+                self.Pending.add(self.CourseFolderOf(path))
+
+    def FlushPending(self):
+        if len(self.Pending) == 0:
+            return
+        pending, self.Pending = self.Pending, set()
+        if None in pending:
+            self.Index.Refresh()
+            return
+        for folder in pending:
+            self.Index.Update(folder, False)
+        self.Index.Save()
+
+
+# One index per download root, only the watcher of the current root is running
+Libraries = {}
+Watchers = {}
+LibrariesLock = threading.Lock()
+
+
+def StopWatchers():
+    with LibrariesLock:
+        for path in list(Watchers):
+            Watchers.pop(path).Stop()
+
+
+def GlobalLibrary(rootpath, watch=None):
+    rootpath = rootpath.replace("\\", "/")
+    if watch is None:
+        watch = util_settings.GlobalSettings().LibraryWatcher
+    watcher = None
+    with LibrariesLock:
+        if rootpath not in Libraries:
+            Libraries[rootpath] = LibraryIndex(rootpath)
+        index = Libraries[rootpath]
+        for path in [path for path in Watchers if not path == rootpath or not watch]:
+            Watchers.pop(path).Stop()
+        if watch and rootpath not in Watchers:
+            watcher = Watchers[rootpath] = LibraryWatcher(index)
+    # Without a running watcher the index is brought up to date on each access
+    if not watch or watcher is not None:
+        index.Refresh()
+    if watcher is not None:
+        watcher.Start()
+    return index
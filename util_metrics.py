@@ -0,0 +1,234 @@
+import json
+import os
+import socket
+import threading
+import time
+import util_constants as const
+import util_logging as log
+import traceback
+from contextlib import contextmanager
+
+
+# Counters and histograms of downloads and combines, exported as json snapshot and prometheus text file
+class Metrics:
+    __instance = None
+
+    @staticmethod
+    def getInstance():
+        """ Static access method. """
+        if Metrics.__instance == None:
+            Metrics()
+        return Metrics.__instance
+
+    def __init__(self):
+        """ Virtually private constructor. """
+        if Metrics.__instance != None:
+            raise Exception("This class is a singleton!")
+        else:
+            Metrics.__instance = self
+        self.Lock = threading.Lock()
+        self.Counters = {}
+        self.Histograms = {}
+        self.StartTime = time.time()
+        self.ExportPath = const.GlobalPaths().AppDataPath() + "/" + const.METRICS_PATH
+        self.ExportTimer = None
+        self.ExportInterval = const.METRICS_EXPORT_INTERVAL
+        # Snapshot of the previous history entry, so each entry only holds what happened since then
+        self.HistoryLock = threading.Lock()
+        self.HistorySnapshot = None
+        # Wall clock timers: counter key -> (running timers, start of the not yet counted time)
+        self.WallTimers = {}
+
+    @staticmethod
+    def Key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def Inc(self, name, value=1, **labels):
+        key = self.Key(name, labels)
+        with self.Lock:
+            self.Counters[key] = self.Counters.get(key, 0) + value
+
+    def Observe(self, name, value, buckets=const.METRICS_LATENCY_BUCKETS, **labels):
+        key = self.Key(name, labels)
+        with self.Lock:
+            histogram = self.Histograms.get(key)
+            if histogram is None:
+                histogram = {"buckets": list(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+                self.Histograms[key] = histogram
+            # Buckets are cumulative as in prometheus
+            for idx in range(len(histogram["buckets"])):
+                if value <= histogram["buckets"][idx]:
+                    histogram["counts"][idx] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def Timer(self, name, buckets=const.METRICS_LATENCY_BUCKETS, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.Observe(name, time.time() - start, buckets, **labels)
+
+    @contextmanager
+    def WallTimer(self, name, **labels):
+        """ Counts the wall clock seconds in which at least one timer of name runs - overlapping timers (eg. parallel
+            downloads) are counted once, elapsed time is added whenever one of them ends """
+        key = self.Key(name, labels)
+        with self.Lock:
+            Running, Since = self.WallTimers.get(key, (0, None))
+            self.WallTimers[key] = (Running + 1, time.time() if Running == 0 else Since)
+        try:
+            yield
+        finally:
+            with self.Lock:
+                Running, Since = self.WallTimers[key]
+                now = time.time()
+                self.Counters[key] = self.Counters.get(key, 0) + now - Since
+                self.WallTimers[key] = (Running - 1, now)
+
+    def Snapshot(self):
+        with self.Lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.Counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), "buckets": histogram["buckets"],
+                           "counts": list(histogram["counts"]), "sum": histogram["sum"], "count": histogram["count"]}
+                          for (name, labels), histogram in sorted(self.Histograms.items())]
+        return {
+            "app": const.APP_NAME,
+            "version": const.APP_VERSION,
+            "host": socket.gethostname(),
+            "started": self.StartTime,
+            "timestamp": time.time(),
+            "counters": counters,
+            "histograms": histograms
+        }
+
+    @staticmethod
+    def Delta(snapshot, previous):
+        """ Counters and histograms of snapshot minus those of the previous snapshot, unchanged ones are left out """
+        if previous is None:
+            return dict(snapshot, since=snapshot["started"])
+        Counters = {(counter["name"], json.dumps(counter["labels"], sort_keys=True)): counter["value"]
+                    for counter in previous["counters"]}
+        Histograms = {(histogram["name"], json.dumps(histogram["labels"], sort_keys=True)): histogram
+                      for histogram in previous["histograms"]}
+        counters = []
+        for counter in snapshot["counters"]:
+            value = counter["value"] - Counters.get((counter["name"], json.dumps(counter["labels"], sort_keys=True)), 0)
+            if not value == 0:
+                counters.append(dict(counter, value=value))
+        histograms = []
+        for histogram in snapshot["histograms"]:
+            Previous = Histograms.get((histogram["name"], json.dumps(histogram["labels"], sort_keys=True)))
+            if Previous is None:
+                histograms.append(histogram)
+            elif histogram["count"] > Previous["count"]:
+                histograms.append(dict(histogram, counts=[count - PreviousCount for count, PreviousCount
+                                                          in zip(histogram["counts"], Previous["counts"])],
+                                       sum=histogram["sum"] - Previous["sum"], count=histogram["count"] - Previous["count"]))
+        return dict(snapshot, since=previous["timestamp"], counters=counters, histograms=histograms)
+
+    @staticmethod
+    def PrometheusLabels(labels, extra=None):
+        items = list(labels.items())
+        if extra is not None:
+            items.append(extra)
+        if not items:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+    def PrometheusText(self, snapshot):
+        lines = []
+        typed = set()
+        for counter in snapshot["counters"]:
+            name = f"{const.METRICS_PREFIX}_{counter['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self.PrometheusLabels(counter['labels'])} {counter['value']}")
+        for histogram in snapshot["histograms"]:
+            name = f"{const.METRICS_PREFIX}_{histogram['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            labels = histogram["labels"]
+            for idx in range(len(histogram["buckets"])):
+                bucket = self.PrometheusLabels(labels, ("le", histogram["buckets"][idx]))
+                lines.append(f"{name}_bucket{bucket} {histogram['counts'][idx]}")
+            lines.append(f"{name}_bucket{self.PrometheusLabels(labels, ('le', '+Inf'))} {histogram['count']}")
+            lines.append(f"{name}_sum{self.PrometheusLabels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{self.PrometheusLabels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def WriteFile(self, filename, content):
+        # Write to temporary file first, so readers never see a half written snapshot
+        filenametemp = filename + ".tmp"
+        with open(filenametemp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(filenametemp, filename)
+
+    def WriteSnapshot(self, history=False):
+        try:
+            if not os.path.exists(self.ExportPath):
+                os.makedirs(self.ExportPath)
+            snapshot = self.Snapshot()
+            self.WriteFile(self.ExportPath + "/" + const.METRICS_JSON_FILE_NAME, json.dumps(snapshot, indent=1))
+            self.WriteFile(self.ExportPath + "/" + const.METRICS_PROMETHEUS_FILE_NAME, self.PrometheusText(snapshot))
+            # Keep what happened in each finished run (since the previous entry) for comparing runs and machines
+            if history:
+                with self.HistoryLock:
+                    Run = self.Delta(snapshot, self.HistorySnapshot)
+                    self.HistorySnapshot = snapshot
+                    with open(self.ExportPath + "/" + const.METRICS_HISTORY_FILE_NAME, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(Run) + "\n")
+        except Exception as error:
+            log.error(f"An error has been occured on writing metrics to '{self.ExportPath}':")
+            log.error(traceback.format_exc())
+
+    def StartExport(self, interval=None):
+        if interval is not None:
+            self.ExportInterval = interval
+        if self.ExportTimer is not None:
+            return
+        self.ScheduleExport()
+
+    def ScheduleExport(self):
+        self.ExportTimer = threading.Timer(self.ExportInterval, self.OnExport)
+        self.ExportTimer.daemon = True
+        self.ExportTimer.start()
+
+    def OnExport(self):
+        self.WriteSnapshot()
+        self.ScheduleExport()
+
+    def StopExport(self):
+        if self.ExportTimer is not None:
+            self.ExportTimer.cancel()
+            self.ExportTimer = None
+        self.WriteSnapshot()
+
+
+def MeasuredBandwidth():
+    # Bytes per second of the downloads of the latest finished run (entries hold the counts of their run only) in wall
+    # clock time, the summed seconds of the transfers overlap with parallel downloads - None if nothing has been measured yet
+    HistoryFileName = const.GlobalPaths().AppDataPath() + "/" + const.METRICS_PATH + "/" + const.METRICS_HISTORY_FILE_NAME
+    if not os.path.exists(HistoryFileName):
+        return None
+    try:
+        with open(HistoryFileName, encoding="utf-8") as f:
+            snapshots = [json.loads(line) for line in f if line.strip()]
+    except Exception as error:
+        log.warn(f"Can not read metrics history '{HistoryFileName}': {repr(error)}")
+        return None
+    for snapshot in reversed(snapshots):
+        Bytes = sum(counter["value"] for counter in snapshot["counters"] if counter["name"] == "download_bytes_total")
+        Seconds = sum(counter["value"] for counter in snapshot["counters"] if counter["name"] == "download_wall_seconds")
+        if Bytes > 0 and Seconds > 0:
+            return Bytes / Seconds
+    return None
+
+
+# Global access metrics via singleton function
+def GlobalMetrics():
+    return Metrics.getInstance()
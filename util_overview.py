@@ -1,31 +1,31 @@
 import json
 import os
 import pickle
-import re
-import traceback
 import webbrowser
 import util_constants as const
+import util_library as library
 import util_logging as log
+import util_profiling as profiling
 import util_settings
+import util_thumbnails as thumbnails
 from pprint import pformat
-from urllib.request import Request, urlopen
 from PySide2.QtWidgets import QMessageBox
 
 
 
 
 class Overview():
-    def __init__(self, accesstokenvalue):
+    def __init__(self, session):
         self.cfg = util_settings.GlobalSettings()
-        self.access_token_value = accesstokenvalue
+        # Account of the requests (util_session.Session)
+        self.session = session
 
     def GetTitleFromCourseId(self, CourseId):
         url = const.UDEMY_API_COURSE_TITLE.format(CourseId=CourseId)
         log.info(f"Getting course title for course with id '{CourseId}'")
         log.info(f" Course url is: '{url}'")
         # Get more information on course:
-        req = Request(url, headers=const.RequestHeaders(self.access_token_value))
-        res = urlopen(req).read()
+        res = self.session.Open(self.session.Request(url)).read()
         # Convert to json
         CourseInfo = json.loads(res.decode("utf-8"))
         log.debug(pformat(CourseInfo))
@@ -54,40 +54,31 @@ class Overview():
         self.GenerateCourseInfoFile(CourseInfoFile, CourseInfo)
         return CourseInfo
 
+    @profiling.Profiled("courseinfos")
     def BuildCourseInfos(self):
         self.cfg.InitSettings(True)
         self.cfg.LoadConfigs()
-        CourseFolders = [f.path for f in os.scandir(self.cfg.DownloadPath) if f.is_dir()]
-        Courses = []
-        for CourseFolder in CourseFolders:
-            CourseFolder = CourseFolder.replace("\\", "/")
-            # Check if course in in folder exists
-            CourseInfo = {
-                "Id": 0,
-                "Title": "",
-                "Path": ""
-            }
-            # Get course id from hashtag in pathname:
-            try:
-                CourseId = re.findall(r'#(.+?)#', CourseFolder)[0]
-                CourseInfo = self.BuildOrGetCourseInfo(CourseFolder, CourseId)
-            except Exception as error:
-                CourseInfo["Id"] = 0
-                log.error(f"An error has been occured on CourseFolder {CourseFolder}:")
-                log.error(traceback.format_exc())
-            # Add course info to list
-            if CourseInfo["Id"] > 0:
-                Courses.append(CourseInfo)
-        return Courses
+        with profiling.Span("Query library index"):
+            # Index is kept current by the watcher (if enabled) or refreshed for changed folders only
+            return library.GlobalLibrary(self.cfg.DownloadPath).CourseInfos()
 
-    def AddHTMLCourse(self, CourseId, CourseTitle, CoursePath):
+    def CourseImage(self, cache, CoursePath):
+        # Name of the cached cover, None for courses without cover
+        CacheFileName = cache.FromFile(CoursePath.replace("\\", "/") + "/" + const.COURSE_PREVIEW_IMAGE_NAME)
+        if CacheFileName is None:
+            return None
+        return os.path.basename(CacheFileName)
+
+    def AddHTMLCourse(self, CourseId, CourseTitle, CoursePath, CourseImage=None):
         CoursePathPrepared = CoursePath.replace("\\", "/").replace("#", "%23")
         CoursePathURL = f"file:///{CoursePathPrepared}/"
-        CourseImage = f"{CoursePathURL}/{const.COURSE_PREVIEW_IMAGE_NAME}"
+        Width, Height = const.THUMBNAIL_SIZE
+        # Fixed size placeholder until the browser loads the cover (if any)
+        CourseImageSource = "" if CourseImage is None else f"src='{const.THUMBNAIL_CACHE_PATH}/{CourseImage}' "
         HTMLCourse = (
             "\n"
             f"       <div class='card' data-filter='{CourseTitle}'>\n"
-            f"           <img src='{CourseImage}' class='card-img-top' alt='' width='240px'></img>"
+            f"           <img {CourseImageSource}class='card-img-top' alt='' loading='lazy' decoding='async' width='{Width}' height='{Height}'></img>"
             "           <div class='card-body'>\n"
             f"               <h4 class='card-title'>Course ID: {CourseId}</h4>\n"
             f"               <p>{CourseTitle}</p>\n"
@@ -106,12 +97,22 @@ class Overview():
             Courses = self.BuildCourseInfos()
             # Now build an html overview of all available courses
             if Courses:
-                HTML = ""
+                # Covers are taken from the thumbnail cache beside the overview and loaded by the browser when scrolled into view
+                cache = thumbnails.GlobalCache(self.cfg.DownloadPath.replace("\\", "/") + "/" + const.THUMBNAIL_CACHE_PATH)
+                HTMLCourses = []
+                Images = set()
                 for Course in Courses:
                     CourseId = Course["Id"]
                     CourseTitle = Course["Title"]
                     CoursePath = Course["Path"]
-                    HTML = HTML + self.AddHTMLCourse(CourseId, CourseTitle, CoursePath)
+                    CourseImage = self.CourseImage(cache, CoursePath)
+                    if not CourseImage is None:
+                        Images.add(CourseImage)
+                    HTMLCourses.append(self.AddHTMLCourse(CourseId, CourseTitle, CoursePath, CourseImage))
+                # Covers referenced by the overview are never evicted (also not by downloads and later saves)
+                cache.Pin(Images)
+                cache.Save()
+                HTML = "".join(HTMLCourses)
                 # Add header and footer
                 HTML = const.HTML_HEADER + HTML + const.HTML_FOOTER
                 # Write an index.html file to main download folder
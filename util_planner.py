@@ -0,0 +1,156 @@
+import concurrent.futures
+import m3u8
+import os
+import traceback
+import util_constants as const
+import util_courselist as courselist
+import util_downloader as downloader
+import util_logging as log
+import util_metrics as metrics
+import util_resolution as resolution
+import util_settings
+from urllib.request import Request
+
+
+class PlannedAssets():
+    """ Stands in for the asset fetcher while planning - only counts the assets which are not on disk yet """
+
+    def __init__(self):
+        self.Files = 0
+
+    def Submit(self, url, filename):
+        if not os.path.exists(filename):
+            self.Files += 1
+
+    def SubmitLink(self, url, filename):
+        if not os.path.exists(filename):
+            self.Files += 1
+
+    def SubmitTask(self, fct, *args):
+        pass
+
+
+class CoursePlanner():
+    """ Dry run of a course download: sizes of all selected videos and what is missing on disk, nothing is written """
+
+    def __init__(self, session):
+        self.cfg = util_settings.GlobalSettings()
+        # Account of the requests (util_session.Session)
+        self.session = session
+
+    def PlanThread(self, CourseId):
+        # Downloader is only used to resolve the curriculum the same way as the download does
+        courseurl = f"{const.UDEMY_MAIN_COURSE_REDIRECT}?{const.UDEMY_API_FIELD_COURSE_ID}={CourseId}"
+        thread = downloader.DownloaderThread(None, courseurl, self.session)
+        thread.CourseId = CourseId
+        thread.SaveArticles = False
+        thread.assets = PlannedAssets()
+        return thread
+
+    def LectureSize(self, thread, Lecture):
+        # Size of the selected rendition in bytes, number of files and if the size is exact (not estimated) - streams
+        # are assembled into one file per lecture as well
+        url = Lecture.Lecture_Download_URL
+        Duration = Lecture.Lecture_Time_Estimation
+        if Lecture.Lecture_Protected:
+            return resolution.EstimateSize(resolution.MakeRendition(const.PLAN_PROTECTED_RESOLUTION, url), Duration), 1, False
+        if ".m3u8" in url:
+            playlist = m3u8.load(url, headers=dict(self.session.Headers))
+            if playlist.is_variant:
+                variant = thread.GetPlaylistwithhighestResolution(playlist.playlists, Lecture)
+                Rendition = resolution.CollectPlaylistRenditions([variant])[0]
+                return resolution.EstimateSize(Rendition, Duration), 1, False
+            Seconds = sum(segment.duration or 0 for segment in playlist.segments)
+            return resolution.EstimateSize(resolution.MakeRendition(const.PLAN_PROTECTED_RESOLUTION, url), Seconds), 1, False
+        for Rendition in Lecture.Lecture_Renditions:
+            if Rendition.URL == url and Rendition.Size is not None and Rendition.Size >= 0:
+                return Rendition.Size, 1, True
+        res = self.session.Open(Request(url, method="HEAD"), timeout=const.ASSET_FETCH_TIMEOUT)
+        return int(res.getheader("Content-Length", 0)), 1, True
+
+    def LectureOnDisk(self, thread, Lecture):
+        # Bytes of the lecture already downloaded
+        if self.cfg.DownloadCourseVideoAgain:
+            return 0
+        filename = thread.CoursePath + os.sep + thread.LectureVideoName(Lecture)
+        if os.path.exists(filename):
+            return os.path.getsize(filename)
+        return 0
+
+    def PlanLecture(self, thread, Lecture):
+        try:
+            Size, Files, Exact = self.LectureSize(thread, Lecture)
+        except Exception as error:
+            log.warn(f"Can not determine size of '{Lecture.Lecture_Title}': {repr(error)}")
+            Size = resolution.EstimateSize(resolution.MakeRendition(const.PLAN_PROTECTED_RESOLUTION, ""), Lecture.Lecture_Time_Estimation)
+            Files = 1
+            Exact = False
+        OnDisk = self.LectureOnDisk(thread, Lecture)
+        # Partially downloaded lectures are downloaded again, an estimated size can only tell if anything is there
+        Missing = OnDisk < Size if Exact else OnDisk == 0
+        if Size > 0:
+            OnDisk = min(OnDisk, Size)
+        return {"Size": Size, "Files": Files, "OnDisk": OnDisk, "Missing": Missing}
+
+    def Plan(self, CourseId):
+        thread = self.PlanThread(CourseId)
+        CourseInfo = thread.FetchCourseDetails(CourseId)
+        thread.CoursePath = thread.CoursePathFor(CourseId, CourseInfo[const.UDEMY_API_FIELD_COURSE_TITLE])
+        LecturesList = thread.ParseCurriculum(thread.FetchCurriculum(CourseId))
+        # Same resolutions as the download would choose
+        LecturesList = thread.SelectResolutions(LecturesList, False)
+        with concurrent.futures.ThreadPoolExecutor(const.RESOLUTION_PROBE_WORKERS, thread_name_prefix="Plan") as executor:
+            Planned = list(executor.map(lambda Lecture: self.PlanLecture(thread, Lecture), LecturesList))
+        Bytes = sum(Item["Size"] for Item in Planned)
+        BytesOnDisk = sum(Item["OnDisk"] for Item in Planned)
+        return {
+            "Id": int(CourseId),
+            "Title": CourseInfo[const.UDEMY_API_FIELD_COURSE_TITLE],
+            "Path": thread.CoursePath.replace("\\", "/"),
+            "Lectures": len(Planned),
+            "Protected": len([Lecture for Lecture in LecturesList if Lecture.Lecture_Protected]),
+            "Files": sum(Item["Files"] for Item in Planned),
+            "FilesToDownload": sum(Item["Files"] for Item in Planned if Item["Missing"]),
+            "AssetsToDownload": thread.assets.Files,
+            "Bytes": Bytes,
+            "BytesOnDisk": BytesOnDisk,
+            # Missing lectures are downloaded completely
+            "BytesToDownload": sum(Item["Size"] for Item in Planned if Item["Missing"])
+        }
+
+    def SubscribedCourseIds(self):
+        # All pages, unchanged pages are taken from the cache of the course list
+        return [Course["Id"] for Course in courselist.CourseCatalog(self.session).Refresh()]
+
+    def PlanAll(self, CourseIds=None, onplanned=None):
+        if CourseIds is None:
+            CourseIds = self.SubscribedCourseIds()
+        Plans = []
+        for CourseId in CourseIds:
+            try:
+                Plan = self.Plan(CourseId)
+            except Exception as error:
+                log.error(f"An error has been occured on planning course with id '{CourseId}':")
+                log.error(traceback.format_exc())
+                continue
+            Plans.append(Plan)
+            if not onplanned is None:
+                onplanned(Plan)
+        return Plans
+
+    def Bandwidth(self):
+        # Measured by the latest download, otherwise the expected bandwidth of the settings
+        Measured = metrics.MeasuredBandwidth()
+        if Measured is not None:
+            return Measured, "measured"
+        return self.cfg.ResolutionBandwidthMBs * 1024 ** 2, "expected"
+
+    def Summary(self, Plans):
+        Bandwidth, Source = self.Bandwidth()
+        Total = {key: sum(Plan[key] for Plan in Plans) for key in
+                 ["Lectures", "Files", "FilesToDownload", "AssetsToDownload", "Bytes", "BytesOnDisk", "BytesToDownload"]}
+        Total["Courses"] = len(Plans)
+        Total["Bandwidth"] = Bandwidth
+        Total["BandwidthSource"] = Source
+        Total["Seconds"] = Total["BytesToDownload"] / Bandwidth if Bandwidth > 0 else 0
+        return Total
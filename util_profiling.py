@@ -0,0 +1,223 @@
+import cProfile
+import datetime as dt
+import functools
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+import util_constants as const
+import util_logging as log
+from contextlib import contextmanager
+
+# Tracemalloc is process wide, so it is only stopped by the last running profile
+TraceLock = threading.Lock()
+TraceUsers = 0
+
+# Profilers of the worker threads started while any run is profiled, the engine loop thread gets one on demand
+ThreadLock = threading.Lock()
+ThreadUsers = 0
+ThreadProfiles = []
+EngineProfile = None
+
+
+def ProfileEnabled():
+    if os.getenv(const.PROFILE_ENV_NAME, "").lower() in ["1", "true", "yes"]:
+        return True
+    # Imported here, because settings import the modules using the profiling decorators
+    import util_settings
+    return util_settings.GlobalSettings().ProfileRuns
+
+
+def ProfilePath():
+    path = const.GlobalPaths().AppDataPath() + "/" + const.PROFILE_PATH
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+
+def StartTracing():
+    global TraceUsers
+    with TraceLock:
+        if TraceUsers == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(const.PROFILE_TRACEMALLOC_FRAMES)
+        TraceUsers += 1
+
+
+def StopTracing(takesnapshot=False):
+    global TraceUsers
+    snapshot = None
+    with TraceLock:
+        TraceUsers -= 1
+        if takesnapshot:
+            snapshot = tracemalloc.take_snapshot()
+        if TraceUsers == 0:
+            tracemalloc.stop()
+    return snapshot
+
+
+def WriteAllocations(filename, snapshot):
+    stats = snapshot.statistics("lineno")
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(f"Top {const.PROFILE_TOP_ALLOCATIONS} allocations\n\n")
+        for stat in stats[:const.PROFILE_TOP_ALLOCATIONS]:
+            f.write(f"{stat}\n")
+            for line in stat.traceback.format()[-const.PROFILE_TRACEMALLOC_FRAMES:]:
+                f.write(f"    {line}\n")
+
+
+def EngineLoop():
+    # Imported here, because the engine imports the modules using the profiling decorators
+    import util_engine
+    return util_engine.GlobalEngine().Loop
+
+
+def CallInLoop(loop, fct):
+    # Profilers are enabled per thread, so they are started and stopped on the thread of the loop
+    done = threading.Event()
+
+    def call():
+        try:
+            fct()
+        finally:
+            done.set()
+    loop.call_soon_threadsafe(call)
+    done.wait(const.PROFILE_LOOP_TIMEOUT)
+
+
+def EnableEngineProfile():
+    global EngineProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Since python 3.12 there is only one profiler at a time (which then sees all threads)
+        return
+    with ThreadLock:
+        EngineProfile = profiler
+
+
+def StartThreadProfile(frame, event, arg):
+    # Profile hook called once on the start of every new thread, only worker threads get a profiler
+    sys.setprofile(None)
+    name = threading.current_thread().name
+    with ThreadLock:
+        if ThreadUsers == 0:
+            return
+    if name == const.ENGINE_THREAD_NAME:
+        EnableEngineProfile()
+        return
+    if not name.startswith(tuple(const.PROFILE_THREAD_PREFIXES)):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return
+    with ThreadLock:
+        ThreadProfiles.append((name, threading.current_thread(), profiler))
+
+
+def StartThreadProfiles():
+    global ThreadUsers
+    with ThreadLock:
+        ThreadUsers += 1
+        if ThreadUsers > 1:
+            return
+        threading.setprofile(StartThreadProfile)
+    loop = EngineLoop()
+    if not loop is None:
+        CallInLoop(loop, EnableEngineProfile)
+
+
+def StopThreadProfiles():
+    """ Profilers of the finished worker threads (of any run profiled meanwhile) and names of the threads which
+        are still running, the engine loop is stopped and included by the last running profile """
+    global ThreadUsers, EngineProfile
+    with ThreadLock:
+        ThreadUsers -= 1
+        Engine = None
+        if ThreadUsers == 0:
+            threading.setprofile(None)
+            Engine, EngineProfile = EngineProfile, None
+    if not Engine is None:
+        CallInLoop(EngineLoop(), Engine.disable)
+    with ThreadLock:
+        Finished = [(name, profiler) for name, thread, profiler in ThreadProfiles if not thread.is_alive()]
+        Running = [name for name, thread, profiler in ThreadProfiles if thread.is_alive()]
+        if not EngineProfile is None:
+            Running.append(const.ENGINE_THREAD_NAME)
+        ThreadProfiles[:] = [] if ThreadUsers == 0 else \
+            [(name, thread, profiler) for name, thread, profiler in ThreadProfiles if thread.is_alive()]
+    if not Engine is None:
+        Finished.append((const.ENGINE_THREAD_NAME, Engine))
+    return Finished, Running
+
+
+def MergedStats(profiler, threads):
+    stats = pstats.Stats(profiler)
+    for name, ThreadProfiler in threads:
+        try:
+            stats.add(ThreadProfiler)
+        except TypeError:
+            # Thread without any profiled call
+            pass
+    return stats
+
+
+@contextmanager
+def ProfileRun(name):
+    """ Profiles the run with cProfile and tracemalloc and writes .prof and allocation report to app path - worker
+        threads and the engine loop are profiled on their own and merged into the .prof """
+    if not ProfileEnabled():
+        yield
+        return
+    profiler = cProfile.Profile()
+    StartTracing()
+    StartThreadProfiles()
+    start = time.time()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = StopTracing(True)
+        try:
+            Threads, Running = StopThreadProfiles()
+            timestamp = dt.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            filename = ProfilePath() + f"/{name}-{timestamp}"
+            MergedStats(profiler, Threads).dump_stats(filename + const.PROFILE_STATS_EXT)
+            WriteAllocations(filename + const.PROFILE_ALLOCATIONS_EXT, snapshot)
+            log.info(f"Profile of run '{name}' ({time.time() - start:.2f}s) written to '{filename}{const.PROFILE_STATS_EXT}'")
+            log.info(f"Profile of run '{name}' includes {len(Threads)} threads: {', '.join(sorted(set(ThreadName for ThreadName, ThreadProfiler in Threads))) or '-'}")
+            if Running:
+                log.info(f"Profile of run '{name}' misses the still running threads: {', '.join(sorted(set(Running)))}")
+        except Exception as error:
+            log.error(f"An error has been occured on writing profile of run '{name}':")
+            log.error(traceback.format_exc())
+
+
+def Profiled(name):
+    """ Decorator to profile a whole run method """
+    def decorator(fct):
+        @functools.wraps(fct)
+        def wrapper(*args, **kwargs):
+            with ProfileRun(name):
+                return fct(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def Span(name):
+    """ Logs the wall-clock time of a stage if profiling is enabled """
+    if not ProfileEnabled():
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        log.info(f"[Span] {name}: {time.time() - start:.3f}s")
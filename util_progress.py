@@ -0,0 +1,177 @@
+import itertools
+import threading
+import time
+import datetime as dt
+import util_constants as const
+
+
+class ThroughputEstimator():
+    """ Estimates progress and finish time of a download in bytes with an exponentially smoothed throughput """
+
+    def __init__(self, weights, smoothing=const.PROGRESS_THROUGHPUT_SMOOTHING):
+        # Weights are used as fallback until the real size of an item is known (eg. time estimation in seconds)
+        self.Weights = [max(float(weight or 0), 0.0) for weight in weights]
+        self.Sizes = [None] * len(self.Weights)
+        self.Smoothing = smoothing
+        self.Throughput = None
+        self.BytesDone = 0
+        # Running totals of completed and pending items, so each estimation is O(1) for any number of items
+        self.CompletedCount = 0
+        self.CompletedBytesWeighted = 0
+        self.CompletedWeight = 0.0
+        self.PendingWeight = sum(self.Weights)
+        self.PendingUnweighted = len([weight for weight in self.Weights if weight <= 0])
+        # Bytes of items not completed yet, reported by the running transfers (from several threads) per item
+        self.Lock = threading.Lock()
+        self.BytesInFlight = 0
+        self.ItemBytesInFlight = {}
+        self.WindowStart = None
+        self.WindowBytes = 0
+        self.LiveSamples = False
+
+    def Transferred(self, count, idx=None, interval=const.PROGRESS_SAMPLE_INTERVAL):
+        # Bytes of all transfers together are sampled once per interval - returns True if a new sample has been taken
+        now = time.time()
+        with self.Lock:
+            self.BytesInFlight += count
+            self.ItemBytesInFlight[idx] = self.ItemBytesInFlight.get(idx, 0) + count
+            if self.WindowStart is None:
+                self.WindowStart = now
+            self.WindowBytes += count
+            if now - self.WindowStart < interval:
+                return False
+            self.AddSample(self.WindowBytes / (now - self.WindowStart))
+            self.WindowStart = now
+            self.WindowBytes = 0
+            self.LiveSamples = True
+            return True
+
+    def DropInFlight(self, idx):
+        # All bytes counted for the item are gone from in flight, including those of failed attempts
+        self.BytesInFlight = max(self.BytesInFlight - self.ItemBytesInFlight.pop(idx, 0), 0)
+
+    def Completed(self, idx, size, transferred=0, seconds=0.0):
+        # Size of completed item is known now - only transferred bytes are used for throughput, if not sampled while running
+        with self.Lock:
+            if self.Sizes[idx] is None:
+                self.CompletedCount += 1
+                self.PendingWeight -= self.Weights[idx]
+                if self.Weights[idx] <= 0:
+                    self.PendingUnweighted -= 1
+            else:
+                self.BytesDone -= self.Sizes[idx]
+                if self.Weights[idx] > 0:
+                    self.CompletedBytesWeighted -= self.Sizes[idx]
+                    self.CompletedWeight -= self.Weights[idx]
+            self.Sizes[idx] = size
+            self.BytesDone += size
+            if self.Weights[idx] > 0:
+                self.CompletedBytesWeighted += size
+                self.CompletedWeight += self.Weights[idx]
+            self.DropInFlight(idx)
+            if seconds > 0 and transferred > 0 and not self.LiveSamples:
+                self.AddSample(transferred / seconds)
+
+    def Failed(self, idx):
+        # Item has not been completed (eg. canceled or failed) - its bytes are not in flight any longer
+        with self.Lock:
+            self.DropInFlight(idx)
+
+    def AddSample(self, bytespersecond):
+        if self.Throughput is None:
+            self.Throughput = bytespersecond
+        else:
+            self.Throughput = self.Smoothing * bytespersecond + (1 - self.Smoothing) * self.Throughput
+
+    def BytesPerWeight(self):
+        # Ratio between bytes and weight learned from completed items
+        if self.CompletedWeight > 0:
+            return self.CompletedBytesWeighted / self.CompletedWeight
+        return None
+
+    def BytesAverage(self):
+        if self.CompletedCount > 0:
+            return self.BytesDone / self.CompletedCount
+        return 0.0
+
+    def ExpectedSize(self, idx):
+        if self.Sizes[idx] is not None:
+            return self.Sizes[idx]
+        Ratio = self.BytesPerWeight()
+        if Ratio is not None and self.Weights[idx] > 0:
+            return self.Weights[idx] * Ratio
+        return self.BytesAverage()
+
+    def BytesRemaining(self):
+        # Same as the expected sizes of all pending items summed up
+        Ratio = self.BytesPerWeight()
+        if Ratio is None:
+            return (len(self.Sizes) - self.CompletedCount) * self.BytesAverage()
+        return max(self.PendingWeight, 0.0) * Ratio + self.PendingUnweighted * self.BytesAverage()
+
+    def PercentDone(self):
+        if not self.Sizes:
+            return 100
+        Remaining = self.BytesRemaining()
+        Total = self.BytesDone + Remaining
+        if Total > 0:
+            return int((self.BytesDone + min(self.BytesInFlight, Remaining)) / Total * 100)
+        # Nothing known in bytes yet, so use weights and at least item count
+        WeightTotal = self.CompletedWeight + self.PendingWeight
+        if WeightTotal > 0:
+            return int(self.CompletedWeight / WeightTotal * 100)
+        return int(self.CompletedCount / len(self.Sizes) * 100)
+
+    def ThroughputMBs(self):
+        if self.Throughput is None:
+            return 0.0
+        return self.Throughput / (1024 * 1024)
+
+    def FinishTime(self):
+        if self.Throughput is None or self.Throughput <= 0:
+            return "calculating..."
+        finishtime = time.time() + max(self.BytesRemaining() - self.BytesInFlight, 0) / self.Throughput
+        finishtime = dt.datetime.fromtimestamp(finishtime).strftime("%H:%M:%S")  # in time
+        return f"{finishtime} ({self.ThroughputMBs():.1f} MB/s)"
+
+
+class ProgressAggregator():
+    """ Latest progress of a download, written cheaply by workers and read by the UI on a fixed rate timer """
+
+    def __init__(self):
+        # Each state is replaced as one (version, values) tuple, so no lock is needed between writer and reader
+        self.Counter = itertools.count(1)
+        self.Progress = (0, None)
+        self.Label = (0, None)
+
+    def SetProgress(self, percent, idx, max, coursetitle, finishtime):
+        self.Progress = (next(self.Counter), (percent, idx, max, coursetitle, finishtime))
+
+    def SetParts(self, sectionindex, lectureindex, segment, count):
+        self.Label = (next(self.Counter), (sectionindex, lectureindex, segment, count))
+
+    def SetInfo(self, message):
+        self.Label = (next(self.Counter), message)
+
+
+class ProgressReader():
+    """ Returns only the states of an aggregator which have been changed since the last read """
+
+    def __init__(self, aggregator):
+        self.Aggregator = aggregator
+        self.ProgressVersion = 0
+        self.LabelVersion = 0
+
+    def ReadProgress(self):
+        Version, Values = self.Aggregator.Progress
+        if Version == self.ProgressVersion:
+            return None
+        self.ProgressVersion = Version
+        return Values
+
+    def ReadLabel(self):
+        Version, Values = self.Aggregator.Label
+        if Version == self.LabelVersion:
+            return None
+        self.LabelVersion = Version
+        return Values
@@ -0,0 +1,142 @@
+import concurrent.futures
+import m3u8
+import util_constants as const
+import util_logging as log
+from collections import namedtuple
+from urllib.request import Request
+
+
+class Rendition(namedtuple("Rendition", ["Resolution", "URL", "Size", "Bandwidth"])):
+    """ Immutable rendition of a lecture video - use replace() to get a changed copy """
+    __slots__ = ()
+
+    def replace(self, **changes):
+        return self._replace(**changes)
+
+
+def MakeRendition(Resolution, URL, Size=None, Bandwidth=None):
+    return Rendition(Resolution, URL, Size, Bandwidth)
+
+
+def CollectVideoRenditions(Videos):
+    # Download and stream urls of the curriculum with numeric labels (eg. "720")
+    Renditions = []
+    for Video in Videos:
+        if "label" in Video and "file" in Video and str(Video["label"]).isnumeric():
+            Renditions.append(MakeRendition(int(Video["label"]), Video["file"]))
+    return Renditions
+
+
+def CollectMediaRenditions(mediasources):
+    Renditions = []
+    for mediasource in mediasources:
+        if mediasource.get("type") in ["video/mp4"] and "src" in mediasource and str(mediasource.get("label", "")).isnumeric():
+            Renditions.append(MakeRendition(int(mediasource["label"]), mediasource["src"]))
+    return Renditions
+
+
+def CollectPlaylistRenditions(variantplaylist):
+    # Variants of a m3u8 master playlist, the bandwidth attribute is given in bits per second
+    Renditions = []
+    for playlist in variantplaylist:
+        Resolution = playlist.stream_info.resolution
+        if not Resolution is None:
+            Renditions.append(MakeRendition(Resolution[1], playlist.uri, Bandwidth=playlist.stream_info.bandwidth))
+    return Renditions
+
+
+def LoadPlaylistRenditions(urls, headers=None, workers=const.RESOLUTION_PROBE_WORKERS):
+    # Variants of the master playlists of streams concurrently, empty for a playlist which can not be loaded
+    def Load(url):
+        try:
+            playlist = m3u8.load(url, headers=headers)
+        except Exception as error:
+            log.debug(f"Can not load playlist '{url}': {repr(error)}")
+            return []
+        return CollectPlaylistRenditions(playlist.playlists) if playlist.is_variant else []
+    with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="ProbeSize") as executor:
+        return list(executor.map(Load, urls))
+
+
+def HighestRendition(Renditions, MaxResolution=None):
+    # Later renditions win on equal resolution (same as before renditions were collected)
+    Highest = None
+    for Candidate in Renditions:
+        if MaxResolution is not None and Candidate.Resolution > MaxResolution:
+            continue
+        if Highest is None or Candidate.Resolution >= Highest.Resolution:
+            Highest = Candidate
+    return Highest
+
+
+def EstimateSize(Candidate, Duration):
+    # Known size (HEAD), else bandwidth of the playlist, else a typical bitrate of the resolution
+    if Candidate.Size is not None and Candidate.Size >= 0:
+        return Candidate.Size
+    Duration = max(Duration or 0, const.RESOLUTION_MIN_DURATION)
+    if Candidate.Bandwidth:
+        return int(Candidate.Bandwidth / 8 * Duration)
+    Bitrates = sorted(const.RESOLUTION_TYPICAL_BITRATES.items())
+    Bitrate = Bitrates[-1][1]
+    for Resolution, Rate in Bitrates:
+        if Candidate.Resolution <= Resolution:
+            Bitrate = Rate
+            break
+    return int(Bitrate / 8 * Duration)
+
+
+def ProbeSizes(Renditions, openurl, workers=const.RESOLUTION_PROBE_WORKERS):
+    # Ask the cdn for the sizes of all renditions concurrently (HEAD requests only) - returns the renditions with their size
+    def Probe(Candidate):
+        if ".m3u8" in Candidate.URL:
+            return Candidate
+        try:
+            res = openurl(Request(Candidate.URL, method="HEAD"), timeout=const.ASSET_FETCH_TIMEOUT)
+            return Candidate.replace(Size=int(res.getheader("Content-Length", -1)))
+        except Exception as error:
+            log.debug(f"Can not probe size of '{Candidate.URL}': {repr(error)}")
+            return Candidate
+    with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="ProbeSize") as executor:
+        return list(executor.map(Probe, Renditions))
+
+
+def SelectRenditions(Candidates, Budget):
+    """ Chooses one rendition per lecture (candidates are lists of (rendition, estimated size)) so the total fits into the
+        budget: the highest common resolution which fits, then single lectures are upgraded with the rest - returns the
+        chosen (rendition, estimated size) per lecture """
+    Candidates = [sorted(Renditions, key=lambda Candidate: Candidate[0].Resolution) for Renditions in Candidates]
+    Choice = [0] * len(Candidates)
+    for Cap in sorted({Candidate.Resolution for Renditions in Candidates for Candidate, Estimate in Renditions}, reverse=True):
+        Capped = []
+        for Renditions in Candidates:
+            Fitting = [idx for idx in range(len(Renditions)) if Renditions[idx][0].Resolution <= Cap]
+            Capped.append(Fitting[-1] if Fitting else 0)
+        if sum(Candidates[idx][Capped[idx]][1] for idx in range(len(Candidates))) <= Budget:
+            Choice = Capped
+            break
+    Remaining = Budget - sum(Candidates[idx][Choice[idx]][1] for idx in range(len(Candidates)))
+    # Cheapest upgrades first, one step at a time
+    while True:
+        Upgrades = [(Candidates[idx][Choice[idx] + 1][1] - Candidates[idx][Choice[idx]][1], idx)
+                    for idx in range(len(Candidates)) if Choice[idx] + 1 < len(Candidates[idx])]
+        Upgrades = [(Cost, idx) for Cost, idx in Upgrades if Cost <= Remaining]
+        if not Upgrades:
+            break
+        Cost, idx = min(Upgrades)
+        Choice[idx] += 1
+        Remaining -= Cost
+    return [Candidates[idx][Choice[idx]] for idx in range(len(Candidates))]
+
+
+def BudgetBytes(cfg, LibraryBytes=0):
+    # Smallest of the storage budget and what can be transferred until the deadline, None if unlimited
+    Budgets = []
+    if cfg.ResolutionPolicy == const.RESOLUTION_POLICY_COURSE_BUDGET:
+        Budgets.append(cfg.ResolutionBudgetGB * 1024 ** 3)
+    elif cfg.ResolutionPolicy == const.RESOLUTION_POLICY_LIBRARY_BUDGET:
+        Budgets.append(max(cfg.ResolutionBudgetGB * 1024 ** 3 - LibraryBytes, 0))
+    if cfg.ResolutionDeadlineHours > 0:
+        Budgets.append(cfg.ResolutionDeadlineHours * 3600 * cfg.ResolutionBandwidthMBs * 1024 ** 2)
+    if not Budgets:
+        return None
+    return min(Budgets)
@@ -0,0 +1,32 @@
+import util_constants as const
+
+
+def PriorityLectures(Lectures, Policy, FirstN):
+    # Indexes of the lectures which make the course watchable first, in curriculum order
+    if Policy == const.SCHEDULE_POLICY_FIRST_LECTURES:
+        return list(range(min(FirstN, len(Lectures))))
+    if Policy == const.SCHEDULE_POLICY_FIRST_PER_CHAPTER:
+        Priority = []
+        Chapters = set()
+        for LectureIdx in range(len(Lectures)):
+            Chapter_Index = Lectures[LectureIdx].Chapter_Index
+            if Chapter_Index not in Chapters:
+                Chapters.add(Chapter_Index)
+                Priority.append(LectureIdx)
+        return Priority
+    return []
+
+
+def ScheduleLectures(Lectures, Policy, FirstN=const.SCHEDULE_FIRST_LECTURES, Sizes=None):
+    """ Download order of the lectures as (priority, rest) - the rest is ordered largest first,
+        so the biggest lectures don't end up alone at the end of the parallel downloads """
+    if Policy == const.SCHEDULE_POLICY_CURRICULUM:
+        return [], list(range(len(Lectures)))
+    if Sizes is None:
+        # Time estimation is proportional to the video size as long as the real size is unknown
+        Sizes = [Lecture.Lecture_Time_Estimation or 0 for Lecture in Lectures]
+    Priority = PriorityLectures(Lectures, Policy, FirstN)
+    Prioritized = set(Priority)
+    Rest = [LectureIdx for LectureIdx in range(len(Lectures)) if LectureIdx not in Prioritized]
+    Rest.sort(key=lambda LectureIdx: Sizes[LectureIdx], reverse=True)
+    return Priority, Rest
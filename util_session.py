@@ -0,0 +1,257 @@
+import ctypes
+import json
+import os
+import threading
+import time
+import traceback
+import requests
+import util_constants as const
+import util_downloader as downloader
+import util_logging as log
+from types import MappingProxyType
+from typing import Union
+from PySide2.QtCore import QThread, Signal
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import Request
+
+
+class RateLimiter():
+    """ Token bucket - allows bursts, but not more than rate requests per second on average """
+
+    def __init__(self, rate, burst):
+        self.Rate = rate
+        self.Burst = burst
+        self.Tokens = burst
+        self.Updated = time.monotonic()
+        self.Lock = threading.Lock()
+
+    def Acquire(self):
+        while True:
+            with self.Lock:
+                now = time.monotonic()
+                self.Tokens = min(self.Burst, self.Tokens + (now - self.Updated) * self.Rate)
+                self.Updated = now
+                if self.Tokens >= 1:
+                    self.Tokens -= 1
+                    return
+                wait = (1 - self.Tokens) / self.Rate
+            time.sleep(wait)
+
+
+class PooledResponse():
+    """ Streamed response of the pooled connections with the part of the urllib response used by the callers """
+
+    def __init__(self, response):
+        self.Response = response
+        self.status = response.status_code
+        self.url = response.url
+        response.raw.decode_content = True
+
+    def getheader(self, name, default=None):
+        return self.Response.headers.get(name, default)
+
+    def read(self, amt=None):
+        return self.Response.raw.read(amt)
+
+    def readinto(self, b):
+        return self.Response.raw.readinto(b)
+
+    def close(self):
+        # Connection goes back to the pool if the body has been read completely
+        self.Response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PooledOpener():
+    """ Opens urllib requests on the keep alive connections (and cookies) of a requests session - responses other than 2xx
+        are raised as urllib HTTPError, so callers and the metrics of downloader.OpenURL see no difference """
+
+    def __init__(self, pool):
+        # Returns the requests session
+        self.Pool = pool
+
+    def open(self, req, data=None, timeout=None):
+        if not isinstance(req, Request):
+            req = Request(req)
+        if not data is None:
+            req.data = data
+        response = self.Pool().request(req.get_method(), req.full_url, headers=dict(req.header_items()), data=req.data,
+                                       timeout=timeout, stream=True)
+        if not 200 <= response.status_code < 300:
+            response.close()
+            raise HTTPError(req.full_url, response.status_code, response.reason, response.headers, None)
+        return PooledResponse(response)
+
+
+class Session():
+    """ Everything which belongs to one account: access token, request headers (never changed after creation),
+        pooled keep alive connections with their own cookies and the rate limit of the api requests """
+
+    def __init__(self, accesstokenvalue):
+        self.AccessToken = accesstokenvalue
+        self.Headers = MappingProxyType(const.RequestHeaders(accesstokenvalue))
+        # All requests of the account (api, videos, assets) are opened on the pooled connections
+        self.Opener = PooledOpener(self.HTTP)
+        self.Limiter = RateLimiter(const.SESSION_API_RATE, const.SESSION_API_BURST)
+        self.ApiHost = urlparse(const.UDEMY_MAIN_URL).netloc
+        self.Lock = threading.Lock()
+        self.Pool = None
+
+    def Request(self, url, data=None, method=None):
+        # Api request with the headers of this account (each request gets its own copy)
+        return Request(url, data, headers=dict(self.Headers), method=method)
+
+    def Open(self, req, data=None, timeout=None):
+        url = req.full_url if isinstance(req, Request) else req
+        if urlparse(url).netloc == self.ApiHost:
+            self.Limiter.Acquire()
+        return downloader.OpenURL(req, data, timeout, self.Opener)
+
+    def HTTP(self):
+        # Connections are kept alive and reused by all requests of the account
+        with self.Lock:
+            if self.Pool is None:
+                self.Pool = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=const.SESSION_POOL_SIZE,
+                                                        pool_maxsize=const.SESSION_POOL_SIZE)
+                self.Pool.mount("https://", adapter)
+                self.Pool.mount("http://", adapter)
+                # Only the headers of each request are sent - account headers for the api, the user agent for the cdn
+                self.Pool.headers.clear()
+            return self.Pool
+
+    def Validate(self):
+        # One cheap api call - False if the token is rejected, network errors are raised
+        try:
+            self.Open(self.Request(const.UDEMY_API_ME), timeout=const.SESSION_VALIDATE_TIMEOUT).read()
+        except HTTPError as error:
+            if error.code in [401, 403]:
+                return False
+            raise
+        return True
+
+    def Close(self):
+        with self.Lock:
+            if not self.Pool is None:
+                self.Pool.close()
+                self.Pool = None
+
+
+# One session per account (access token), shared by all downloads of the account
+Sessions = {}
+SessionsLock = threading.Lock()
+
+
+def GlobalSession(accesstokenvalue):
+    with SessionsLock:
+        if accesstokenvalue not in Sessions:
+            Sessions[accesstokenvalue] = Session(accesstokenvalue)
+        return Sessions[accesstokenvalue]
+
+
+CRYPTPROTECT_UI_FORBIDDEN = 0x01
+
+
+class DataBlob(ctypes.Structure):
+    _fields_ = [("cbData", ctypes.c_uint32), ("pbData", ctypes.POINTER(ctypes.c_char))]
+
+
+def CryptData(fct, data):
+    # DPAPI - only the current windows user can decrypt
+    blobin = DataBlob(len(data), ctypes.create_string_buffer(data, len(data)))
+    blobout = DataBlob()
+    if not fct(ctypes.byref(blobin), None, None, None, None, CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(blobout)):
+        raise ctypes.WinError()
+    try:
+        return ctypes.string_at(blobout.pbData, blobout.cbData)
+    finally:
+        ctypes.windll.kernel32.LocalFree(blobout.pbData)
+
+
+def Protect(data):
+    if os.name == "nt":
+        return CryptData(ctypes.windll.crypt32.CryptProtectData, data)
+    return data
+
+
+def Unprotect(data):
+    if os.name == "nt":
+        return CryptData(ctypes.windll.crypt32.CryptUnprotectData, data)
+    return data
+
+
+def SessionFileName():
+    return const.GlobalPaths().AppDataPath() + "/" + const.SESSION_FILE_NAME
+
+
+def SaveToken(accesstokenvalue, expires=0):
+    # Readable by the current user only, written to a temporary name and replaced at once
+    data = Protect(json.dumps({"AccessToken": accesstokenvalue, "Expires": expires}).encode("utf-8"))
+    SessionFileNameTemp = SessionFileName() + const.DOWNLOAD_TEMP_EXT
+    fd = os.open(SessionFileNameTemp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(SessionFileNameTemp, SessionFileName())
+
+
+def LoadToken():
+    # Access token and expiry (0 if unknown) of the last login, (None, 0) if there is none
+    try:
+        with open(SessionFileName(), "rb") as f:
+            stored = json.loads(Unprotect(f.read()).decode("utf-8"))
+        return stored["AccessToken"], stored.get("Expires") or 0
+    except FileNotFoundError:
+        return None, 0
+    except Exception as error:
+        log.warn(f"Stored session can not be read: {repr(error)}")
+        return None, 0
+
+
+def DeleteToken():
+    if os.path.exists(SessionFileName()):
+        os.remove(SessionFileName())
+
+
+def StoredSession():
+    """ Session of the last login if the token has not expired and is still accepted by the api, otherwise None """
+    accesstokenvalue, expires = LoadToken()
+    if accesstokenvalue is None:
+        return None
+    if expires > 0 and expires <= time.time():
+        log.info("Stored session has expired")
+        DeleteToken()
+        return None
+    stored = GlobalSession(accesstokenvalue)
+    try:
+        if not stored.Validate():
+            log.info("Stored session is no longer accepted")
+            DeleteToken()
+            return None
+    except Exception as error:
+        log.warn(f"Stored session can not be validated: {repr(error)}")
+        return None
+    return stored
+
+
+class StoredSessionThread(QThread):
+    """ Checks the stored session of the last login (one api call) without blocking the window - emits its access token,
+        or an empty string if the login page is needed """
+    _signal_done: Union[Signal, Signal] = Signal(str)
+
+    def __init__(self, mw):
+        super(StoredSessionThread, self).__init__(mw)
+
+    def run(self):
+        Stored = None
+        try:
+            Stored = StoredSession()
+        except Exception as error:
+            log.error(f"An error has been occured on checking the stored session:")
+            log.error(traceback.format_exc())
+        self._signal_done.emit("" if Stored is None else Stored.AccessToken)
@@ -2,7 +2,7 @@ from __future__ import annotations
 from PySide2.QtCore import QSettings
 from PySide2.QtGui import QIcon
 from PySide2.QtWidgets import QDialog, QDialogButtonBox, QVBoxLayout, QFormLayout, QLabel, QComboBox, QCheckBox, \
-    QLineEdit, QFileDialog, QAction, QMessageBox
+    QLineEdit, QFileDialog, QAction, QMessageBox, QSpinBox
 import os.path, util_logging as log, util_constants as const, util_ffmpeg as ffmpeg
 import subprocess
 
@@ -60,12 +60,82 @@ class AppSettings(QDialog):
         self.cfgDownValue = QLineEdit()
         self.cfgDownValue.addAction(ActionSettingsChooseDownloadPath, QLineEdit.TrailingPosition)
         formLayout.addRow("Courses path", self.cfgDownValue)
+        # Temp (staging) path
+        ActionSettingsChooseTempPath = QAction(QIcon(const.FontAweSomeIcon("folder-plus.svg")), "", self)
+        ActionSettingsChooseTempPath.setToolTip("Choose temp path (eg. on a local SSD) for downloading")
+        ActionSettingsChooseTempPath.triggered.connect(self.OnActionChooseTempPath)
+        self.cfgTempValue = QLineEdit()
+        self.cfgTempValue.setPlaceholderText("Download directly into courses path")
+        self.cfgTempValue.addAction(ActionSettingsChooseTempPath, QLineEdit.TrailingPosition)
+        formLayout.addRow("Temp path", self.cfgTempValue)
+        # Memory ceiling for transfer buffers
+        self.cfgTransferMemory = QSpinBox()
+        self.cfgTransferMemory.setRange(1, 4096)
+        self.cfgTransferMemory.setSuffix(" MB")
+        formLayout.addRow("Transfer buffer memory", self.cfgTransferMemory)
+        # Size of the cache for article assets shared by all courses
+        self.cfgAssetCache = QSpinBox()
+        self.cfgAssetCache.setRange(16, 65536)
+        self.cfgAssetCache.setSuffix(" MB")
+        formLayout.addRow("Article asset cache", self.cfgAssetCache)
         # Do not download existing videos again
         self.cfgDownloadCourseVideoAgain = QCheckBox("Even if they already exists", self)
         formLayout.addRow("Download the course video(s):", self.cfgDownloadCourseVideoAgain)
+        # Only lectures added or changed since the last complete download
+        self.cfgDeltaSync = QCheckBox("Only lectures added or changed since the last complete download", self)
+        formLayout.addRow("", self.cfgDeltaSync)
+        # Videos and assets on one event loop instead of a thread each
+        self.cfgTransferEngine = QCheckBox("Transfer videos and assets with the asyncio engine", self)
+        formLayout.addRow("", self.cfgTransferEngine)
+        # Download order and parallel downloads
+        self.cfgSchedulePolicy = QComboBox()
+        self.cfgSchedulePolicy.addItem("Curriculum order", const.SCHEDULE_POLICY_CURRICULUM)
+        self.cfgSchedulePolicy.addItem("First lectures first, then largest first", const.SCHEDULE_POLICY_FIRST_LECTURES)
+        self.cfgSchedulePolicy.addItem("First lecture of each chapter first, then largest first", const.SCHEDULE_POLICY_FIRST_PER_CHAPTER)
+        formLayout.addRow("Download order", self.cfgSchedulePolicy)
+        self.cfgScheduleFirstLectures = QSpinBox()
+        self.cfgScheduleFirstLectures.setRange(1, 100)
+        formLayout.addRow("First lectures", self.cfgScheduleFirstLectures)
+        self.cfgDownloadWorkers = QSpinBox()
+        self.cfgDownloadWorkers.setRange(1, 16)
+        formLayout.addRow("Parallel downloads", self.cfgDownloadWorkers)
+        # Resolution of the videos within a storage budget or deadline
+        self.cfgResolutionPolicy = QComboBox()
+        self.cfgResolutionPolicy.addItem("Highest resolution", const.RESOLUTION_POLICY_HIGHEST)
+        self.cfgResolutionPolicy.addItem("Best resolution within a budget per course", const.RESOLUTION_POLICY_COURSE_BUDGET)
+        self.cfgResolutionPolicy.addItem("Best resolution within a budget for all courses", const.RESOLUTION_POLICY_LIBRARY_BUDGET)
+        formLayout.addRow("Video resolution", self.cfgResolutionPolicy)
+        self.cfgResolutionBudget = QSpinBox()
+        self.cfgResolutionBudget.setRange(1, 100000)
+        self.cfgResolutionBudget.setSuffix(" GB")
+        formLayout.addRow("Storage budget", self.cfgResolutionBudget)
+        self.cfgResolutionDeadline = QSpinBox()
+        self.cfgResolutionDeadline.setRange(0, 168)
+        self.cfgResolutionDeadline.setSuffix(" h")
+        self.cfgResolutionDeadline.setSpecialValueText("No deadline")
+        formLayout.addRow("Download deadline", self.cfgResolutionDeadline)
+        self.cfgResolutionBandwidth = QSpinBox()
+        self.cfgResolutionBandwidth.setRange(1, 10000)
+        self.cfgResolutionBandwidth.setSuffix(" MB/s")
+        formLayout.addRow("Expected bandwidth", self.cfgResolutionBandwidth)
+        # Keep index of courses path current in background
+        self.cfgLibraryWatcher = QCheckBox("Watch courses path for changes in background", self)
+        formLayout.addRow("Library index:", self.cfgLibraryWatcher)
         # Check file size on downloaded video
         self.cfgCheckFileSize = QCheckBox("Even if the file size is different", self)
         formLayout.addRow("", self.cfgCheckFileSize)
+        # Deduplicate identical files
+        self.cfgDeduplicate = QCheckBox("Store identical files of all courses only once (hardlinks)", self)
+        formLayout.addRow("", self.cfgDeduplicate)
+        # Prepare videos for combining while downloading
+        self.cfgCombinePipeline = QCheckBox("Prepare videos for combining while downloading", self)
+        formLayout.addRow("Combine:", self.cfgCombinePipeline)
+        # Playlist per chapter
+        self.cfgChapterPlaylists = QCheckBox("Generate a playlist for each chapter too", self)
+        formLayout.addRow("Playlist:", self.cfgChapterPlaylists)
+        # Profile runs
+        self.cfgProfileRuns = QCheckBox("Profile download and combine runs (written to app path)", self)
+        formLayout.addRow("Diagnostics:", self.cfgProfileRuns)
         # Add to layout
         layout.addLayout(formLayout)
         layout.addWidget(buttonBox)
@@ -83,6 +153,12 @@ class AppSettings(QDialog):
             self.cfgDownValue.setText(dir)
             self.Save(True)
 
+    def OnActionChooseTempPath(self):
+        dir = str(QFileDialog.getExistingDirectory(self, "Choose directory"))
+        if not dir == "":
+            self.cfgTempValue.setText(dir)
+            self.Save(True)
+
     def OnActionDownloadInstallFFMPEG(self):
         # Save entered settings before
         self.Save(True)
@@ -132,16 +208,66 @@ class AppSettings(QDialog):
             self.StatusBarLabel.setStyleSheet("QLabel { color : black }")
         # Download path
         self.cfgDownValue.setText(self.cfg.DownloadPath)
+        # Temp path
+        self.cfgTempValue.setText(self.cfg.TempPath)
+        # Transfer memory
+        self.cfgTransferMemory.setValue(self.cfg.TransferMemoryMB)
+        # Asset cache
+        self.cfgAssetCache.setValue(self.cfg.AssetCacheMB)
         # Download again
         self.cfgDownloadCourseVideoAgain.setChecked(self.cfg.DownloadCourseVideoAgain)
+        # Delta sync
+        self.cfgDeltaSync.setChecked(self.cfg.DeltaSync)
+        # Transfer engine
+        self.cfgTransferEngine.setChecked(self.cfg.TransferEngine)
+        # Library watcher
+        self.cfgLibraryWatcher.setChecked(self.cfg.LibraryWatcher)
+        # Download order
+        SchedulePolicyDataIndex = self.cfgSchedulePolicy.findData(self.cfg.SchedulePolicy)
+        if SchedulePolicyDataIndex >= 0:
+            self.cfgSchedulePolicy.setCurrentIndex(SchedulePolicyDataIndex)
+        self.cfgScheduleFirstLectures.setValue(self.cfg.ScheduleFirstLectures)
+        self.cfgDownloadWorkers.setValue(self.cfg.DownloadWorkers)
+        # Resolution
+        ResolutionPolicyDataIndex = self.cfgResolutionPolicy.findData(self.cfg.ResolutionPolicy)
+        if ResolutionPolicyDataIndex >= 0:
+            self.cfgResolutionPolicy.setCurrentIndex(ResolutionPolicyDataIndex)
+        self.cfgResolutionBudget.setValue(self.cfg.ResolutionBudgetGB)
+        self.cfgResolutionDeadline.setValue(self.cfg.ResolutionDeadlineHours)
+        self.cfgResolutionBandwidth.setValue(self.cfg.ResolutionBandwidthMBs)
         # Check file size
         self.cfgCheckFileSize.setChecked(self.cfg.DownloadCourseVideoCheckFileSize)
+        # Deduplicate
+        self.cfgDeduplicate.setChecked(self.cfg.Deduplicate)
+        # Combine pipeline
+        self.cfgCombinePipeline.setChecked(self.cfg.CombinePipeline)
+        # Chapter playlists
+        self.cfgChapterPlaylists.setChecked(self.cfg.ChapterPlaylists)
+        # Profile runs
+        self.cfgProfileRuns.setChecked(self.cfg.ProfileRuns)
 
     def Save(self, saveonly=False):
         self.cfg.StartOnMonitorNumber = int(self.cfgStartValue.currentData())
         self.cfg.DownloadPath = self.cfgDownValue.text()
+        self.cfg.TempPath = self.cfgTempValue.text()
+        self.cfg.TransferMemoryMB = self.cfgTransferMemory.value()
+        self.cfg.AssetCacheMB = self.cfgAssetCache.value()
         self.cfg.DownloadCourseVideoAgain = self.cfgDownloadCourseVideoAgain.isChecked()
+        self.cfg.DeltaSync = self.cfgDeltaSync.isChecked()
+        self.cfg.TransferEngine = self.cfgTransferEngine.isChecked()
+        self.cfg.LibraryWatcher = self.cfgLibraryWatcher.isChecked()
+        self.cfg.SchedulePolicy = self.cfgSchedulePolicy.currentData()
+        self.cfg.ScheduleFirstLectures = self.cfgScheduleFirstLectures.value()
+        self.cfg.DownloadWorkers = self.cfgDownloadWorkers.value()
+        self.cfg.ResolutionPolicy = self.cfgResolutionPolicy.currentData()
+        self.cfg.ResolutionBudgetGB = self.cfgResolutionBudget.value()
+        self.cfg.ResolutionDeadlineHours = self.cfgResolutionDeadline.value()
+        self.cfg.ResolutionBandwidthMBs = self.cfgResolutionBandwidth.value()
         self.cfg.DownloadCourseVideoCheckFileSize = self.cfgCheckFileSize.isChecked()
+        self.cfg.Deduplicate = self.cfgDeduplicate.isChecked()
+        self.cfg.CombinePipeline = self.cfgCombinePipeline.isChecked()
+        self.cfg.ChapterPlaylists = self.cfgChapterPlaylists.isChecked()
+        self.cfg.ProfileRuns = self.cfgProfileRuns.isChecked()
         self.cfg.SaveConfigs()
         log.info(f"Configuration has been saved !")
         if not saveonly:
@@ -174,8 +300,25 @@ class Settings():
         # Set default values
         self.StartOnMonitorNumber = const.USR_CONFIG_START_ON_MONITOR_DEFAULT
         self.DownloadPath = const.USR_CONFIG_DOWNLOAD_PATH_DEFAULT
+        self.TempPath = const.USR_CONFIG_TEMP_PATH_DEFAULT
+        self.TransferMemoryMB = const.USR_CONFIG_TRANSFER_MEMORY_DEFAULT
+        self.AssetCacheMB = const.USR_CONFIG_ASSET_CACHE_DEFAULT
         self.DownloadCourseVideoCheckFileSize = const.USR_CONFIG_DOWNLOAD_CHECK_FILESIZE_DEFAULT
         self.DownloadCourseVideoAgain = const.USR_CONFIG_DOWNLOAD_COURSE_AGAIN_DEFAULT
+        self.DeltaSync = const.USR_CONFIG_DELTA_SYNC_DEFAULT
+        self.TransferEngine = const.USR_CONFIG_TRANSFER_ENGINE_DEFAULT
+        self.Deduplicate = const.USR_CONFIG_DEDUPLICATE_DEFAULT
+        self.LibraryWatcher = const.USR_CONFIG_LIBRARY_WATCHER_DEFAULT
+        self.SchedulePolicy = const.USR_CONFIG_SCHEDULE_POLICY_DEFAULT
+        self.ScheduleFirstLectures = const.SCHEDULE_FIRST_LECTURES
+        self.DownloadWorkers = const.USR_CONFIG_DOWNLOAD_WORKERS_DEFAULT
+        self.ResolutionPolicy = const.USR_CONFIG_RESOLUTION_POLICY_DEFAULT
+        self.ResolutionBudgetGB = const.USR_CONFIG_RESOLUTION_BUDGET_DEFAULT
+        self.ResolutionDeadlineHours = const.USR_CONFIG_RESOLUTION_DEADLINE_DEFAULT
+        self.ResolutionBandwidthMBs = const.USR_CONFIG_RESOLUTION_BANDWIDTH_DEFAULT
+        self.CombinePipeline = const.USR_CONFIG_COMBINE_PIPELINE_DEFAULT
+        self.ChapterPlaylists = const.USR_CONFIG_CHAPTER_PLAYLISTS_DEFAULT
+        self.ProfileRuns = const.USR_CONFIG_PROFILE_RUNS_DEFAULT
         # Check if FFMPEG ist available (as relative path)
         self.FFMPEGPath = const.USR_CONFIG_FFMPEG_PATH_DEFAULT
         if self.ffmpeg_util.Available():
@@ -203,7 +346,11 @@ class Settings():
         self.StartOnMonitorNumber = self.valueToInt(self.settings.value(const.USR_CONFIG_START_ON_MONITOR,
                                                                         const.USR_CONFIG_START_ON_MONITOR_DEFAULT))
         self.DownloadPath = self.settings.value(const.USR_CONFIG_DOWNLOAD_PATH, const.USR_CONFIG_DOWNLOAD_PATH_DEFAULT)
-        # self.TempPath = self.settings.value(const.USR_CONFIG_TEMP_PATH, const.USR_CONFIG_TEMP_PATH_DEFAULT)
+        self.TempPath = self.settings.value(const.USR_CONFIG_TEMP_PATH, const.USR_CONFIG_TEMP_PATH_DEFAULT)
+        self.TransferMemoryMB = self.valueToInt(
+            self.settings.value(const.USR_CONFIG_TRANSFER_MEMORY, const.USR_CONFIG_TRANSFER_MEMORY_DEFAULT))
+        self.AssetCacheMB = self.valueToInt(
+            self.settings.value(const.USR_CONFIG_ASSET_CACHE, const.USR_CONFIG_ASSET_CACHE_DEFAULT))
         # Check if FFMPEG ist available (as relative path)
         if self.ffmpeg_util.Available():
             path = const.GlobalPaths().AppDataPath()
@@ -212,16 +359,58 @@ class Settings():
             self.FFMPEGPath = const.USR_CONFIG_FFMPEG_PATH_DEFAULT
         self.DownloadCourseVideoAgain = self.valueToBool(
             self.settings.value(const.USR_CONFIG_DOWNLOAD_COURSE_AGAIN, const.USR_CONFIG_DOWNLOAD_COURSE_AGAIN_DEFAULT))
+        self.DeltaSync = self.valueToBool(
+            self.settings.value(const.USR_CONFIG_DELTA_SYNC, const.USR_CONFIG_DELTA_SYNC_DEFAULT))
+        self.TransferEngine = self.valueToBool(
+            self.settings.value(const.USR_CONFIG_TRANSFER_ENGINE, const.USR_CONFIG_TRANSFER_ENGINE_DEFAULT))
         self.DownloadCourseVideoCheckFileSize = self.valueToBool(
             self.settings.value(const.USR_CONFIG_DOWNLOAD_CHECK_FILESIZE,
                                 const.USR_CONFIG_DOWNLOAD_CHECK_FILESIZE_DEFAULT))
+        self.Deduplicate = self.valueToBool(
+            self.settings.value(const.USR_CONFIG_DEDUPLICATE, const.USR_CONFIG_DEDUPLICATE_DEFAULT))
+        self.LibraryWatcher = self.valueToBool(
+            self.settings.value(const.USR_CONFIG_LIBRARY_WATCHER, const.USR_CONFIG_LIBRARY_WATCHER_DEFAULT))
+        self.SchedulePolicy = self.settings.value(const.USR_CONFIG_SCHEDULE_POLICY, const.USR_CONFIG_SCHEDULE_POLICY_DEFAULT)
+        self.ScheduleFirstLectures = self.valueToInt(
+            self.settings.value(const.USR_CONFIG_SCHEDULE_FIRST_LECTURES, const.SCHEDULE_FIRST_LECTURES))
+        self.DownloadWorkers = self.valueToInt(
+            self.settings.value(const.USR_CONFIG_DOWNLOAD_WORKERS, const.USR_CONFIG_DOWNLOAD_WORKERS_DEFAULT))
+        self.ResolutionPolicy = self.settings.value(const.USR_CONFIG_RESOLUTION_POLICY, const.USR_CONFIG_RESOLUTION_POLICY_DEFAULT)
+        self.ResolutionBudgetGB = self.valueToInt(
+            self.settings.value(const.USR_CONFIG_RESOLUTION_BUDGET, const.USR_CONFIG_RESOLUTION_BUDGET_DEFAULT))
+        self.ResolutionDeadlineHours = self.valueToInt(
+            self.settings.value(const.USR_CONFIG_RESOLUTION_DEADLINE, const.USR_CONFIG_RESOLUTION_DEADLINE_DEFAULT))
+        self.ResolutionBandwidthMBs = self.valueToInt(
+            self.settings.value(const.USR_CONFIG_RESOLUTION_BANDWIDTH, const.USR_CONFIG_RESOLUTION_BANDWIDTH_DEFAULT))
+        self.CombinePipeline = self.valueToBool(
+            self.settings.value(const.USR_CONFIG_COMBINE_PIPELINE, const.USR_CONFIG_COMBINE_PIPELINE_DEFAULT))
+        self.ChapterPlaylists = self.valueToBool(
+            self.settings.value(const.USR_CONFIG_CHAPTER_PLAYLISTS, const.USR_CONFIG_CHAPTER_PLAYLISTS_DEFAULT))
+        self.ProfileRuns = self.valueToBool(
+            self.settings.value(const.USR_CONFIG_PROFILE_RUNS, const.USR_CONFIG_PROFILE_RUNS_DEFAULT))
 
     def SaveConfigs(self):
         self.settings.setValue(const.USR_CONFIG_START_ON_MONITOR, self.StartOnMonitorNumber)
         self.settings.setValue(const.USR_CONFIG_DOWNLOAD_PATH, self.DownloadPath)
-        # self.settings.setValue(const.USR_CONFIG_TEMP_PATH, self.TempPath)
+        self.settings.setValue(const.USR_CONFIG_TEMP_PATH, self.TempPath)
+        self.settings.setValue(const.USR_CONFIG_TRANSFER_MEMORY, self.TransferMemoryMB)
+        self.settings.setValue(const.USR_CONFIG_ASSET_CACHE, self.AssetCacheMB)
         self.settings.setValue(const.USR_CONFIG_DOWNLOAD_COURSE_AGAIN, self.DownloadCourseVideoAgain)
+        self.settings.setValue(const.USR_CONFIG_DELTA_SYNC, self.DeltaSync)
+        self.settings.setValue(const.USR_CONFIG_TRANSFER_ENGINE, self.TransferEngine)
         self.settings.setValue(const.USR_CONFIG_DOWNLOAD_CHECK_FILESIZE, self.DownloadCourseVideoCheckFileSize)
+        self.settings.setValue(const.USR_CONFIG_DEDUPLICATE, self.Deduplicate)
+        self.settings.setValue(const.USR_CONFIG_LIBRARY_WATCHER, self.LibraryWatcher)
+        self.settings.setValue(const.USR_CONFIG_SCHEDULE_POLICY, self.SchedulePolicy)
+        self.settings.setValue(const.USR_CONFIG_SCHEDULE_FIRST_LECTURES, self.ScheduleFirstLectures)
+        self.settings.setValue(const.USR_CONFIG_DOWNLOAD_WORKERS, self.DownloadWorkers)
+        self.settings.setValue(const.USR_CONFIG_RESOLUTION_POLICY, self.ResolutionPolicy)
+        self.settings.setValue(const.USR_CONFIG_RESOLUTION_BUDGET, self.ResolutionBudgetGB)
+        self.settings.setValue(const.USR_CONFIG_RESOLUTION_DEADLINE, self.ResolutionDeadlineHours)
+        self.settings.setValue(const.USR_CONFIG_RESOLUTION_BANDWIDTH, self.ResolutionBandwidthMBs)
+        self.settings.setValue(const.USR_CONFIG_COMBINE_PIPELINE, self.CombinePipeline)
+        self.settings.setValue(const.USR_CONFIG_CHAPTER_PLAYLISTS, self.ChapterPlaylists)
+        self.settings.setValue(const.USR_CONFIG_PROFILE_RUNS, self.ProfileRuns)
         self.settings.sync()
         self.InitSettings(True)
 
@@ -0,0 +1,105 @@
+import os
+import shutil
+import threading
+import util_bufferpool as bufferpool
+import util_constants as const
+import util_logging as log
+import util_settings
+
+# Bounds the number of files moved concurrently from staging to download path
+MoveSemaphore = threading.BoundedSemaphore(const.STAGING_MOVE_WORKERS)
+
+
+def StagedFileName(filename):
+    # Downloads are written to the temp path (eg. local ssd) if set, otherwise next to the final file
+    TempPath = util_settings.GlobalSettings().TempPath
+    if TempPath == "":
+        return filename + const.DOWNLOAD_TEMP_EXT
+    filename = filename.replace("\\", "/")
+    CourseFolder = os.path.basename(os.path.dirname(filename))
+    StagingPath = TempPath.replace("\\", "/") + "/" + CourseFolder
+    if not os.path.exists(StagingPath):
+        os.makedirs(StagingPath, exist_ok=True)
+    return StagingPath + "/" + os.path.basename(filename) + const.DOWNLOAD_TEMP_EXT
+
+
+def SegmentFileName(filename, idx):
+    # Segments of a stream stay in the temp path (if set) until they are assembled into filename
+    return StagedFileName(filename)[:-len(const.DOWNLOAD_TEMP_EXT)] + f".{idx:05d}"
+
+
+def AssembleFile(segments, filename, hash):
+    # Segments are appended to one staged file in order and moved into place at once, so the courses path only sees
+    # one large sequential write per lecture - hash is updated with the content, segments are removed afterwards
+    FileNameTemp = StagedFileName(filename)
+    try:
+        with open(FileNameTemp, "wb") as fdst, bufferpool.GlobalPool().Buffer() as buffer:
+            view = memoryview(buffer)
+            for segment in segments:
+                with open(segment, "rb") as fsrc:
+                    while True:
+                        count = fsrc.readinto(view)
+                        if not count:
+                            break
+                        fdst.write(view[:count])
+                        hash.update(view[:count])
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        MoveIntoPlace(FileNameTemp, filename)
+    except BaseException:
+        if os.path.exists(FileNameTemp):
+            os.remove(FileNameTemp)
+        raise
+    for segment in segments:
+        os.remove(segment)
+
+
+def CopyFileFast(source, target):
+    # Copy inside the kernel if possible, so the target only sees large sequential writes
+    with open(source, "rb") as fsrc, open(target, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                while copied < size:
+                    count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(const.STAGING_COPY_CHUNK_SIZE, size - copied))
+                    if count == 0:
+                        break
+                    copied += count
+            except OSError as error:
+                log.debug(f"copy_file_range not possible ({repr(error)}), falling back")
+        if copied < size and hasattr(os, "sendfile") and os.name == "posix":
+            try:
+                while copied < size:
+                    count = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, min(const.STAGING_COPY_CHUNK_SIZE, size - copied))
+                    if count == 0:
+                        break
+                    copied += count
+            except OSError as error:
+                log.debug(f"sendfile not possible ({repr(error)}), falling back")
+        if copied < size:
+            fsrc.seek(copied)
+            fdst.seek(copied)
+            shutil.copyfileobj(fsrc, fdst, const.STAGING_COPY_CHUNK_SIZE)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+
+
+def MoveIntoPlace(staged, filename):
+    # Same file system - just rename
+    try:
+        os.replace(staged, filename)
+        return
+    except OSError:
+        pass
+    # Other device (eg. NAS) - copy to a temporary name there and rename, never more than the allowed moves at once
+    FileNameTemp = filename + const.DOWNLOAD_TEMP_EXT
+    with MoveSemaphore:
+        try:
+            CopyFileFast(staged, FileNameTemp)
+            os.replace(FileNameTemp, filename)
+        except BaseException:
+            if os.path.exists(FileNameTemp):
+                os.remove(FileNameTemp)
+            raise
+    os.remove(staged)
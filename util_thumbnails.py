@@ -0,0 +1,214 @@
+import json
+import os
+import shutil
+import threading
+import time
+import util_assetcache as assetcache
+import util_checksums as checksums
+import util_constants as const
+import util_logging as log
+import util_metrics as metrics
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import Request
+
+# One cache per path (courses path for the overview, app path for the course list)
+Caches = {}
+CachesLock = threading.Lock()
+
+
+def GlobalCache(path):
+    with CachesLock:
+        if path not in Caches:
+            Caches[path] = ThumbnailCache(path)
+        return Caches[path]
+
+
+class ThumbnailCache():
+    """ Course covers stored once by content hash with size bounded LRU eviction - each source (url or cover file)
+        remembers its validators, so a thumbnail is only fetched or copied again if the source has changed """
+
+    def __init__(self, path, maxbytes=const.THUMBNAIL_CACHE_MB * 1024 * 1024):
+        self.CachePath = path.replace("\\", "/")
+        self.MaxBytes = maxbytes
+        self.Lock = threading.Lock()
+        self.SaveLock = threading.Lock()
+        self.metrics = metrics.GlobalMetrics()
+        os.makedirs(self.CachePath, exist_ok=True)
+        self.IndexFileName = self.CachePath + "/" + const.THUMBNAIL_INDEX_FILE_NAME
+        # Source key -> name of the cached file and the validators of the source
+        self.Sources = {}
+        # Files referenced by a generated overview, which are never evicted
+        self.Pinned = set()
+        try:
+            with open(self.IndexFileName, encoding="utf-8") as f:
+                data = json.load(f)
+            # Older indexes only hold the sources
+            if "Sources" in data:
+                self.Sources = data["Sources"]
+                self.Pinned = set(data.get("Pinned", []))
+            else:
+                self.Sources = data
+        except (OSError, ValueError):
+            pass
+        self.Changed = False
+
+    @staticmethod
+    def URLKey(url):
+        # Without the signing parameters of the query, which change on every request
+        return assetcache.URLKey(url)
+
+    def CacheFileName(self, name):
+        return self.CachePath + "/" + name
+
+    def Lookup(self, key):
+        # Cached file of a source if it is still in the cache
+        with self.Lock:
+            Source = self.Sources.get(key)
+        if Source is None or not os.path.exists(self.CacheFileName(Source["Name"])):
+            return None
+        return Source
+
+    def Store(self, key, data, ext, validators):
+        # Identical images of several courses are stored once
+        hash = checksums.NewHash()
+        hash.update(data)
+        name = hash.hexdigest() + (ext.lower() or ".jpg")
+        FileName = self.CacheFileName(name)
+        if not os.path.exists(FileName):
+            with open(FileName + const.DOWNLOAD_TEMP_EXT, "wb") as f:
+                f.write(data)
+            os.replace(FileName + const.DOWNLOAD_TEMP_EXT, FileName)
+        self.Touch(name)
+        validators.update({"Name": name, "Hash": hash.hexdigest()})
+        with self.Lock:
+            self.Sources[key] = validators
+            self.Changed = True
+        return validators
+
+    def Touch(self, name):
+        # Mark as recently used by the access time - covers placed as hardlink share the modification time
+        try:
+            FileName = self.CacheFileName(name)
+            os.utime(FileName, (time.time(), os.stat(FileName).st_mtime))
+        except OSError:
+            pass
+
+    def FromURL(self, url, openurl):
+        """ Cached file name of an image url, revalidated with a conditional request - None if it can not be loaded """
+        key = self.URLKey(url)
+        Cached = self.Lookup(key)
+        req = Request(url, headers={"User-Agent": const.HEADER_DEFAULT["User-Agent"]})
+        if not Cached is None:
+            if Cached.get("ETag"):
+                req.add_header("If-None-Match", Cached["ETag"])
+            if Cached.get("LastModified"):
+                req.add_header("If-Modified-Since", Cached["LastModified"])
+        try:
+            res = openurl(req, timeout=const.ASSET_FETCH_TIMEOUT)
+            Stored = self.Store(key, res.read(), os.path.splitext(urlparse(url).path)[1][:8],
+                                {"ETag": res.getheader("ETag"), "LastModified": res.getheader("Last-Modified")})
+        except HTTPError as error:
+            if error.code == 304 and not Cached is None:
+                self.metrics.Inc("thumbnails_total", state="unchanged")
+                self.Touch(Cached["Name"])
+                return self.CacheFileName(Cached["Name"])
+            log.warn(f"Can not load thumbnail '{url}': {repr(error)}")
+            return None
+        except Exception as error:
+            log.warn(f"Can not load thumbnail '{url}': {repr(error)}")
+            return None
+        self.metrics.Inc("thumbnails_total", state="loaded")
+        return self.CacheFileName(Stored["Name"])
+
+    def FromFile(self, filename):
+        """ Cached file name of a local image (eg. the cover of a downloaded course), copied only if size or
+            modification time have changed - None if there is no such file """
+        filename = filename.replace("\\", "/")
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        key = "file:" + filename
+        Cached = self.Lookup(key)
+        if not Cached is None and Cached.get("Size") == stat.st_size and Cached.get("MTime") == stat.st_mtime:
+            self.Touch(Cached["Name"])
+            return self.CacheFileName(Cached["Name"])
+        with open(filename, "rb") as f:
+            Stored = self.Store(key, f.read(), os.path.splitext(filename)[1], {"Size": stat.st_size, "MTime": stat.st_mtime})
+        self.metrics.Inc("thumbnails_total", state="copied")
+        return self.CacheFileName(Stored["Name"])
+
+    def Cached(self, url):
+        # Without any request - cached file name of an image url or None
+        Cached = self.Lookup(self.URLKey(url))
+        return None if Cached is None else self.CacheFileName(Cached["Name"])
+
+    @staticmethod
+    def Place(cachefilename, filename):
+        # Hardlink the cached thumbnail to filename (replaced if it differs), copy if the file system can not link
+        if os.path.exists(filename) and os.path.samefile(cachefilename, filename):
+            return
+        FileNameTemp = filename + const.DOWNLOAD_TEMP_EXT
+        if os.path.exists(FileNameTemp):
+            os.remove(FileNameTemp)
+        try:
+            os.link(cachefilename, FileNameTemp)
+        except OSError:
+            shutil.copyfile(cachefilename, FileNameTemp)
+        os.replace(FileNameTemp, filename)
+
+    def Pin(self, names):
+        # Replaces the files referenced by the overview - kept until the next overview references others
+        with self.Lock:
+            if not set(names) == self.Pinned:
+                self.Pinned = set(names)
+                self.Changed = True
+
+    def Evict(self, keep=()):
+        # Least recently used files until the cache fits again (except pinned ones and those still referenced), their
+        # sources are fetched or copied again on next use
+        with self.Lock:
+            keep = set(keep) | self.Pinned
+        Files = []
+        for entry in os.scandir(self.CachePath):
+            if entry.is_file() and not entry.name == const.THUMBNAIL_INDEX_FILE_NAME \
+                    and not entry.name.endswith(const.DOWNLOAD_TEMP_EXT) and not entry.name in keep:
+                stat = entry.stat()
+                Files.append((stat.st_atime, stat.st_size, entry.name))
+        Total = sum(size for used, size, name in Files)
+        Evicted = set()
+        for used, size, name in sorted(Files):
+            if Total <= self.MaxBytes:
+                break
+            try:
+                os.remove(self.CacheFileName(name))
+            except OSError as error:
+                log.debug(f"Can not evict thumbnail '{name}': {repr(error)}")
+                continue
+            Total -= size
+            Evicted.add(name)
+            self.metrics.Inc("thumbnails_total", state="evicted")
+        if Evicted:
+            with self.Lock:
+                self.Sources = {key: Source for key, Source in self.Sources.items() if not Source["Name"] in Evicted}
+                self.Changed = True
+
+    def Save(self, keep=()):
+        # Evicts and writes the index if anything has changed - once per batch of thumbnails, eviction scans the cache
+        with self.SaveLock:
+            self.Evict(keep)
+            with self.Lock:
+                if not self.Changed:
+                    return
+                data = {"Sources": dict(self.Sources), "Pinned": sorted(self.Pinned)}
+                self.Changed = False
+            self.WriteIndex(data)
+
+    def WriteIndex(self, data):
+        try:
+            with open(self.IndexFileName + const.DOWNLOAD_TEMP_EXT, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(self.IndexFileName + const.DOWNLOAD_TEMP_EXT, self.IndexFileName)
+        except OSError as error:
+            log.warn(f"Can not write thumbnail index '{self.IndexFileName}': {repr(error)}")
@@ -85,6 +85,8 @@ class QWebEngineViewPlus(QWebEngineView):
         c = QNetworkCookie(cookie)
         CookieNam = bytearray(c.name()).decode()
         CookieVal = bytearray(c.value()).decode()
+        # Expiry in seconds since epoch, 0 for a session cookie
+        CookieExpires = c.expirationDate().toSecsSinceEpoch() if c.expirationDate().isValid() else 0
         if self.CookieFilter in CookieNam:
             log.info(f"Cookie '{self.CookieFilter}' has been found! Turning off filter.")
             self.CookieFound = True
@@ -92,4 +94,4 @@ class QWebEngineViewPlus(QWebEngineView):
             cookie_store = profile.cookieStore()
             cookie_store.cookieAdded.disconnect()
             if self.CookieFilterCallback:
-                self.CookieFilterCallback(CookieNam, CookieVal)
+                self.CookieFilterCallback(CookieNam, CookieVal, CookieExpires)